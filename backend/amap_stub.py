@@ -0,0 +1,300 @@
+"""
+高德API录制/回放桩，用于离线测试、压测和故障演练
+
+录制：以 AMAP_CASSETTE_MODE=record 启动后端，经 AmapAPIManager 发出的请求和响应都会追加到磁带文件
+（默认 ./instance/amap_cassette.jsonl，可用 AMAP_CASSETTE_PATH 指定）。磁带中不保存API Key。
+
+回放有两种方式:
+    1) 进程内：AMAP_CASSETTE_MODE=replay，共享会话挂载 CassetteReplayAdapter，完全不访问网络；
+       故障注入参数通过 AMAP_STUB_LATENCY_MS / AMAP_STUB_JITTER_MS / AMAP_STUB_ERROR_RATE / AMAP_STUB_QPS 设置。
+    2) 独立桩服务：
+        python amap_stub.py instance/amap_cassette.jsonl --port 8765 \
+            --latency-ms 80 --jitter-ms 40 --error-rate 0.02 --qps 20
+       然后以 AMAP_BASE_URL=http://127.0.0.1:8765 启动后端。
+
+故障注入：固定延迟+随机抖动（或 --recorded-latency 按录制时的耗时）、按比例返回HTTP 500、
+按路径的QPS上限（超出时返回与高德一致的 CUQPS_HAS_EXCEEDED_THE_LIMIT 响应）。
+磁带中找不到的请求返回HTTP 404。
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlparse
+
+import requests
+import requests.adapters
+from requests.structures import CaseInsensitiveDict
+
+# 不参与匹配的参数：Key和签名因环境而异
+IGNORED_PARAMS = {'key', 'sig'}
+
+QPS_LIMIT_BODY = {'status': '0', 'info': 'CUQPS_HAS_EXCEEDED_THE_LIMIT', 'infocode': '10021'}
+INJECTED_ERROR_BODY = {'status': '0', 'info': 'STUB_INJECTED_ERROR', 'infocode': '50000'}
+CASSETTE_MISS_BODY = {'status': '0', 'info': 'CASSETTE_MISS', 'infocode': '40400'}
+
+
+def _normalize_query(params):
+    return urlencode(sorted((k, str(v)) for k, v in (params or {}).items() if k not in IGNORED_PARAMS and v is not None))
+
+
+def _normalize_sub_url(url):
+    """批量接口子请求URL（/v3/...?...）去掉Key后规范化"""
+    parsed = urlparse(url)
+    return f"{parsed.path}?{_normalize_query(dict(parse_qsl(parsed.query)))}"
+
+
+def cassette_key(method, path, params=None, json_body=None):
+    """请求的匹配键：方法 + 路径 + 排序后的参数（忽略Key），批量请求再加上规范化的子请求列表"""
+    key = f"{method.upper()} {path}?{_normalize_query(params)}"
+    if json_body:
+        if isinstance(json_body, dict) and isinstance(json_body.get('ops'), list):
+            json_body = dict(json_body, ops=[
+                dict(op, url=_normalize_sub_url(op['url'])) if isinstance(op, dict) and 'url' in op else op
+                for op in json_body['ops']
+            ])
+        key += ' ' + json.dumps(json_body, ensure_ascii=False, sort_keys=True)
+    return key
+
+
+class Cassette:
+    """JSON Lines 格式的磁带：每行一次请求/响应"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = defaultdict(list)  # key -> [record]
+        self.cursors = defaultdict(int)   # 同一请求录制了多次时轮流回放
+
+    @classmethod
+    def load(cls, path):
+        cassette = cls(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"跳过无法解析的第{line_no}行", file=sys.stderr)
+                    continue
+                cassette.entries[record['k']].append(record)
+        return cassette
+
+    def __len__(self):
+        return sum(len(records) for records in self.entries.values())
+
+    def record(self, method, url, params, json_body, status, body_text, latency_seconds, content_type='application/json'):
+        """追加一条录制记录（线程安全）"""
+        path = urlparse(url).path
+        record = {
+            'k': cassette_key(method, path, params, json_body),
+            'method': method.upper(),
+            'path': path,
+            'status': status,
+            'body': body_text,
+            'content_type': content_type,
+            'latency_ms': round(latency_seconds * 1000, 1),
+            't': round(time.time(), 3),
+        }
+        line = json.dumps(record, ensure_ascii=False) + '\n'
+        with self.lock:
+            self.entries[record['k']].append(record)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def lookup(self, key):
+        with self.lock:
+            records = self.entries.get(key)
+            if not records:
+                return None
+            index = self.cursors[key] % len(records)
+            self.cursors[key] += 1
+            return records[index]
+
+
+class ReplayResponder:
+    """根据磁带生成响应，并按配置注入延迟、错误和QPS超限"""
+
+    def __init__(self, cassette, latency_ms=0.0, jitter_ms=0.0, recorded_latency=False,
+                 error_rate=0.0, qps_limit=0, seed=None):
+        self.cassette = cassette
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.recorded_latency = recorded_latency
+        self.error_rate = error_rate
+        self.qps_limit = qps_limit
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.windows = defaultdict(deque)  # path -> 最近1秒内的请求时间
+        self.stats = defaultdict(int)
+
+    def _qps_exceeded(self, path):
+        if not self.qps_limit:
+            return False
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows[path]
+            while window and now - window[0] >= 1.0:
+                window.popleft()
+            if len(window) >= self.qps_limit:
+                return True
+            window.append(now)
+            return False
+
+    def _delay_seconds(self, record):
+        base = record.get('latency_ms', 0) if record and self.recorded_latency else self.latency_ms
+        with self.lock:
+            jitter = self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0
+            inject_error = self.error_rate > 0 and self.random.random() < self.error_rate
+        return (base + jitter) / 1000, inject_error
+
+    def respond(self, method, path, params, json_body):
+        """返回 (HTTP状态码, 响应字节, Content-Type, 延迟秒数)"""
+        with self.lock:
+            self.stats['requests'] += 1
+        if self._qps_exceeded(path):
+            with self.lock:
+                self.stats['qps_limited'] += 1
+            return 200, json.dumps(QPS_LIMIT_BODY).encode(), 'application/json', self.latency_ms / 1000
+
+        record = self.cassette.lookup(cassette_key(method, path, params, json_body))
+        delay, inject_error = self._delay_seconds(record)
+        if inject_error:
+            with self.lock:
+                self.stats['injected_errors'] += 1
+            return 500, json.dumps(INJECTED_ERROR_BODY).encode(), 'application/json', delay
+        if record is None:
+            with self.lock:
+                self.stats['misses'] += 1
+            return 404, json.dumps(CASSETTE_MISS_BODY).encode(), 'application/json', delay
+        with self.lock:
+            self.stats['hits'] += 1
+        return record['status'], record['body'].encode('utf-8'), record.get('content_type', 'application/json'), delay
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+class CassetteReplayAdapter(requests.adapters.BaseAdapter):
+    """requests传输适配器：请求不出进程，直接由 ReplayResponder 回放；注入的延迟超过读超时时抛出 ReadTimeout"""
+
+    def __init__(self, responder):
+        super().__init__()
+        self.responder = responder
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        parsed = urlparse(request.url)
+        params = dict(parse_qsl(parsed.query))
+        json_body = None
+        if request.body:
+            body = request.body.decode('utf-8') if isinstance(request.body, bytes) else request.body
+            try:
+                json_body = json.loads(body)
+            except ValueError:
+                json_body = body
+        status, content, content_type, delay = self.responder.respond(request.method, parsed.path, params, json_body)
+
+        read_timeout = timeout[1] if isinstance(timeout, tuple) else timeout
+        if read_timeout is not None and delay > read_timeout:
+            time.sleep(read_timeout)
+            raise requests.exceptions.ReadTimeout(f"stub latency {delay:.2f}s exceeds read timeout", request=request)
+        if delay > 0:
+            time.sleep(delay)
+
+        response = requests.Response()
+        response.status_code = status
+        response._content = content
+        response.headers = CaseInsensitiveDict({'Content-Type': content_type, 'Content-Length': str(len(content))})
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.reason = 'OK' if status < 400 else 'Stub Error'
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
+
+
+def make_handler(responder):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _handle(self):
+            parsed = urlparse(self.path)
+            params = dict(parse_qsl(parsed.query))
+            length = int(self.headers.get('Content-Length') or 0)
+            json_body = None
+            if length:
+                raw = self.rfile.read(length)
+                try:
+                    json_body = json.loads(raw)
+                except ValueError:
+                    json_body = raw.decode('utf-8', errors='replace')
+            status, content, content_type, delay = responder.respond(self.command, parsed.path, params, json_body)
+            if delay > 0:
+                time.sleep(delay)
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        do_GET = _handle
+        do_POST = _handle
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def serve(responder, host='127.0.0.1', port=8765):
+    """启动桩服务（阻塞）"""
+    server = ThreadingHTTPServer((host, port), make_handler(responder))
+    server.daemon_threads = True
+    print(f"高德API桩服务已启动: http://{host}:{server.server_address[1]}  （以 AMAP_BASE_URL 指向该地址）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(responder.get_stats(), ensure_ascii=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='回放录制的高德API响应，支持延迟、错误率和QPS超限注入')
+    parser.add_argument('cassette', help='AMAP_CASSETTE_MODE=record 生成的磁带文件')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='每个响应的固定延迟')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='在固定延迟上叠加的随机抖动上限')
+    parser.add_argument('--recorded-latency', action='store_true', help='使用录制时的实际耗时代替 --latency-ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回HTTP 500的比例（0-1）')
+    parser.add_argument('--qps', type=int, default=0, help='每个路径每秒允许的请求数，超出返回QPS超限，0表示不限')
+    parser.add_argument('--seed', type=int, default=None, help='随机种子，便于复现故障注入')
+    args = parser.parse_args(argv)
+
+    cassette = Cassette.load(args.cassette)
+    if not len(cassette):
+        print('磁带为空', file=sys.stderr)
+        return 1
+    print(f"已加载 {len(cassette)} 条录制记录（{len(cassette.entries)} 个不同请求）")
+    responder = ReplayResponder(
+        cassette, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, recorded_latency=args.recorded_latency,
+        error_rate=args.error_rate, qps_limit=args.qps, seed=args.seed
+    )
+    serve(responder, args.host, args.port)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
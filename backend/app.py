@@ -1,8 +1,12 @@
 import os
 import requests # Added for Amap API calls
 import itertools # Added for permutations
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, has_app_context
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session as SQLAlchemySession
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_cors import CORS  # 添加CORS支持
@@ -10,12 +14,17 @@ import time
 import itertools
 import concurrent.futures
 import hashlib # Added for route deduplication
+import re
+import unicodedata
+import difflib # Added for shop name matching
 import asyncio
 from functools import wraps
 from concurrent.futures import ThreadPoolExecutor
 import logging
 import json # Added for distance cache
-from datetime import datetime, timedelta # Added for cache expiry
+import dataclasses
+from urllib.parse import urlencode
+from datetime import date, datetime, timedelta # Added for cache expiry
 import random # Added for genetic algorithm
 import numpy as np # Added for advanced algorithms
 try:
@@ -25,6 +34,21 @@ try:
 except ImportError:
     ORTOOLS_AVAILABLE = False
     print("Or-Tools not available, using fallback algorithms")
+try:
+    import redis  # 可选：跨主机共享高德QPS配额
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+try:
+    import orjson  # 可选：更快的JSON编解码
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+try:
+    from amap_stub import Cassette, CassetteReplayAdapter, ReplayResponder  # 录制/回放高德响应，用于离线测试
+    AMAP_STUB_AVAILABLE = True
+except ImportError:
+    AMAP_STUB_AVAILABLE = False
 
 # 常量定义
 MAX_SHOPS_FOR_OPTIMIZATION = 10  # 最大优化店铺数量
@@ -48,7 +72,7 @@ CORS(app, supports_credentials=True, resources={
     }
 })
 app.config['SECRET_KEY'] = os.urandom(24) # Replace with a strong secret key in production
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///travel_planner.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///travel_planner.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['AMAP_API_KEY'] = '68778fb7fc7baf898edd94a8fc683768' # Added Amap API Key
 
@@ -71,25 +95,420 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # QPS控制：记录每个API的最后调用时间
-from collections import defaultdict
+from collections import defaultdict, deque, OrderedDict
 import threading
-api_call_times = defaultdict(float)
-api_call_lock = threading.Lock()
+import contextvars
+from contextlib import contextmanager
+import sqlite3
+import urllib3
+import requests.adapters
 
-def smart_qps_control(api_name="transit", min_interval=0.3):
-    """智能QPS控制，确保API调用间隔"""
-    with api_call_lock:
-        current_time = time.time()
-        last_call_time = api_call_times[api_name]
-        
-        if last_call_time > 0:
-            elapsed = current_time - last_call_time
-            if elapsed < min_interval:
-                sleep_time = min_interval - elapsed
-                logger.debug(f"QPS控制：{api_name} API需要等待{sleep_time:.2f}秒")
-                time.sleep(sleep_time)
-        
-        api_call_times[api_name] = time.time()
+# --- JSON Codec ---
+# 高德响应解析、接口响应编码和缓存持久化共用的编解码器；JSON_CODEC=json 可切回标准库对比耗时
+JSON_CODEC = os.environ.get('JSON_CODEC', 'orjson' if ORJSON_AVAILABLE else 'json')
+
+def _json_default(obj):
+    """
+    两种编解码器都交给这里序列化的类型，保证 orjson 和标准库输出一致：
+    日期时间与 Flask DefaultJSONProvider 相同（HTTP日期格式），numpy 转原生数值，集合转列表，其余转字符串
+    """
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, date):
+        return http_date(obj)
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    return str(obj)
+
+class JSONCodecStats:
+    """按用途（amap_parse / response / request / cache_load / cache_save）统计次数、字节数和耗时"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = defaultdict(lambda: {'count': 0, 'bytes': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+    
+    def record(self, kind, seconds, size):
+        ms = seconds * 1000
+        with self.lock:
+            entry = self.stats[kind]
+            entry['count'] += 1
+            entry['bytes'] += size
+            entry['total_ms'] += ms
+            entry['max_ms'] = max(entry['max_ms'], ms)
+    
+    def get_stats(self):
+        with self.lock:
+            return {
+                kind: {
+                    'count': entry['count'],
+                    'bytes': entry['bytes'],
+                    'total_ms': round(entry['total_ms'], 3),
+                    'avg_ms': round(entry['total_ms'] / entry['count'], 4) if entry['count'] else 0.0,
+                    'max_ms': round(entry['max_ms'], 3)
+                }
+                for kind, entry in self.stats.items()
+            }
+
+class JSONCodec:
+    """JSON编解码：优先 orjson（直接处理UTF-8字节），不可用时退回标准库 json；dumps 始终返回UTF-8字节"""
+    
+    def __init__(self, name=JSON_CODEC):
+        if name == 'orjson' and not ORJSON_AVAILABLE:
+            logger.warning("orjson 不可用，使用标准库 json")
+            name = 'json'
+        self.name = name
+        self.stats = JSONCodecStats()
+    
+    def loads(self, data, kind=None):
+        start = time.perf_counter()
+        if self.name == 'orjson':
+            result = orjson.loads(data)
+        else:
+            result = json.loads(data)
+        if kind:
+            self.stats.record(kind, time.perf_counter() - start, len(data))
+        return result
+    
+    def dumps(self, obj, kind=None, indent=False, sort_keys=False):
+        start = time.perf_counter()
+        if self.name == 'orjson':
+            # 日期时间交给 _json_default，与标准库路径输出相同
+            option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_PASSTHROUGH_DATETIME
+            if indent:
+                option |= orjson.OPT_INDENT_2
+            if sort_keys:
+                option |= orjson.OPT_SORT_KEYS
+            data = orjson.dumps(obj, default=_json_default, option=option)
+        else:
+            data = json.dumps(
+                obj, ensure_ascii=False, default=_json_default, sort_keys=sort_keys,
+                indent=2 if indent else None, separators=None if indent else (',', ':')
+            ).encode('utf-8')
+        if kind:
+            self.stats.record(kind, time.perf_counter() - start, len(data))
+        return data
+    
+    def get_stats(self):
+        return {'codec': self.name, 'timings': self.stats.get_stats()}
+
+json_codec = JSONCodec()
+
+def parse_amap_json(response):
+    """解析高德响应体（直接解码字节，避免 response.json() 的编码探测和二次解码）"""
+    return json_codec.loads(response.content, 'amap_parse')
+
+class CodecJSONProvider(DefaultJSONProvider):
+    """
+    Flask JSON提供者：jsonify 和 request.get_json 使用共享的编解码器。
+    与 DefaultJSONProvider 一样遵循 sort_keys / compact 设置，日期时间格式相同；
+    非ASCII字符直接输出UTF-8（不转义为 \\uXXXX）。
+    """
+    
+    def dumps(self, obj, **kwargs):
+        # 带参数的调用（如会话Cookie序列化指定 separators）交给 Flask 默认实现，保证格式不变
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        # 不计入接口响应耗时
+        return json_codec.dumps(obj, sort_keys=self.sort_keys).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return json_codec.loads(s, 'request')
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            json_codec.dumps(obj, 'response', indent=indent, sort_keys=self.sort_keys), mimetype=self.mimetype
+        )
+
+app.json = CodecJSONProvider(app)
+
+# 各端点令牌桶配置: (每秒补充令牌数, 突发容量)
+AMAP_RATE_LIMITS = {
+    'transit': (3.0, 3),
+    'driving': (5.0, 5),
+    'place': (5.0, 5),
+    'geocode': (5.0, 5),
+    'inputtips': (5.0, 5),
+    'district': (3.0, 3),
+    'distance': (5.0, 5),
+    'default': (3.0, 3),
+}
+
+class MemoryRateLimitBackend:
+    """进程内令牌桶状态（默认后端，仅对单进程有效）"""
+    
+    name = 'memory'
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.state = {}  # bucket_key -> (tokens, updated)
+    
+    def reserve(self, bucket_key, rate, capacity, tokens=1):
+        """原子地补充并扣减令牌，返回扣减后的令牌数（可为负，表示透支）"""
+        with self.lock:
+            now = time.monotonic()
+            current, updated = self.state.get(bucket_key, (capacity, now))
+            current = min(capacity, current + (now - updated) * rate) - tokens
+            self.state[bucket_key] = (current, now)
+            return current
+    
+    def peek(self, bucket_key, rate, capacity):
+        with self.lock:
+            now = time.monotonic()
+            current, updated = self.state.get(bucket_key, (capacity, now))
+            return min(capacity, current + (now - updated) * rate)
+
+class SQLiteRateLimitBackend:
+    """同一主机多进程共享的令牌桶：状态保存在SQLite文件中，用 BEGIN IMMEDIATE 保证原子性"""
+    
+    name = 'sqlite'
+    
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets (name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+    
+    def _connect(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+    
+    def reserve(self, bucket_key, rate, capacity, tokens=1):
+        conn = self._connect()
+        now = time.time()  # 跨进程共享，必须使用墙上时钟
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE name = ?", (bucket_key,)).fetchone()
+            current, updated = row if row else (capacity, now)
+            current = min(capacity, current + max(0.0, now - updated) * rate) - tokens
+            conn.execute(
+                "INSERT OR REPLACE INTO rate_buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                (bucket_key, current, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return current
+    
+    def peek(self, bucket_key, rate, capacity):
+        row = self._connect().execute(
+            "SELECT tokens, updated FROM rate_buckets WHERE name = ?", (bucket_key,)
+        ).fetchone()
+        if not row:
+            return capacity
+        return min(capacity, row[0] + max(0.0, time.time() - row[1]) * rate)
+
+class LocalTokenStore:
+    """网络令牌存储的进程内替身，实现与 RedisTokenStore 相同的原子操作，用于测试和单机调试"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = {}
+    
+    def reserve_tokens(self, key, rate, capacity, tokens):
+        with self.lock:
+            now = time.time()
+            current, updated = self.data.get(key, (capacity, now))
+            current = min(capacity, current + max(0.0, now - updated) * rate) - tokens
+            self.data[key] = (current, now)
+            return current
+    
+    def peek_tokens(self, key, rate, capacity):
+        with self.lock:
+            if key not in self.data:
+                return capacity
+            current, updated = self.data[key]
+            return min(capacity, current + max(0.0, time.time() - updated) * rate)
+
+class RedisTokenStore:
+    """基于Redis的令牌存储，Lua脚本保证原子性并使用Redis服务器时钟避免主机间时钟偏差"""
+    
+    RESERVE_SCRIPT = """
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local need = tonumber(ARGV[3])
+    local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+    local updated = tonumber(redis.call('HGET', KEYS[1], 'updated'))
+    if tokens == nil then
+        tokens = capacity
+        updated = now
+    end
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate) - need
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+    redis.call('EXPIRE', KEYS[1], 3600)
+    return tostring(tokens)
+    """
+    
+    def __init__(self, url):
+        if not REDIS_AVAILABLE:
+            raise RuntimeError("redis package not installed")
+        self.client = redis.Redis.from_url(url, socket_timeout=1, socket_connect_timeout=1)
+        self.script = self.client.register_script(self.RESERVE_SCRIPT)
+    
+    def reserve_tokens(self, key, rate, capacity, tokens):
+        return float(self.script(keys=[key], args=[rate, capacity, tokens]))
+    
+    def peek_tokens(self, key, rate, capacity):
+        return float(self.script(keys=[key], args=[rate, capacity, 0]))
+
+class NetworkRateLimitBackend:
+    """多主机共享的令牌桶：所有进程通过可插拔的网络存储（RedisTokenStore 或本地替身 LocalTokenStore）扣减同一份配额"""
+    
+    name = 'network'
+    
+    def __init__(self, store):
+        self.store = store
+    
+    def reserve(self, bucket_key, rate, capacity, tokens=1):
+        return self.store.reserve_tokens(bucket_key, rate, capacity, tokens)
+    
+    def peek(self, bucket_key, rate, capacity):
+        return self.store.peek_tokens(bucket_key, rate, capacity)
+
+def create_rate_limit_backend():
+    """
+    根据环境变量 AMAP_RATE_LIMIT_BACKEND (memory/sqlite/redis/local) 创建限流后端。
+    local 使用网络后端的代码路径，但令牌存放在进程内的 LocalTokenStore 中，便于不依赖Redis调试。
+    """
+    backend_name = os.environ.get('AMAP_RATE_LIMIT_BACKEND', 'memory').lower()
+    try:
+        if backend_name == 'sqlite':
+            db_path = os.environ.get('AMAP_RATE_LIMIT_SQLITE_PATH', './instance/amap_rate_limit.db')
+            return SQLiteRateLimitBackend(db_path)
+        if backend_name == 'redis':
+            return NetworkRateLimitBackend(RedisTokenStore(os.environ.get('AMAP_RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')))
+        if backend_name == 'local':
+            return NetworkRateLimitBackend(LocalTokenStore())
+    except Exception as e:
+        logger.error(f"创建限流后端 {backend_name} 失败，回退到进程内限流: {e}")
+    return MemoryRateLimitBackend()
+
+class TokenBucket:
+    """令牌桶：状态存放在可共享的后端中，允许透支预留，调用方在锁外等待"""
+    
+    def __init__(self, bucket_key, rate, capacity, backend=None, window_seconds=10.0):
+        self.bucket_key = bucket_key
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.backend = backend or MemoryRateLimitBackend()
+        self.fallback_backend = None
+        self.lock = threading.Lock()  # 仅保护本进程的统计信息
+        self.window_seconds = window_seconds
+        self.recent_grants = deque()  # 最近窗口内的放行时间，用于计算利用率
+        self.total_granted = 0
+        self.total_wait_seconds = 0.0
+        self.backend_errors = 0
+    
+    def _reserve_tokens(self, tokens):
+        try:
+            return self.backend.reserve(self.bucket_key, self.rate, self.capacity, tokens)
+        except Exception as e:
+            # 共享后端不可用时退回进程内限流，避免整个服务不可用
+            with self.lock:
+                self.backend_errors += 1
+                if self.fallback_backend is None:
+                    self.fallback_backend = MemoryRateLimitBackend()
+            logger.warning(f"限流后端异常，使用进程内限流: {e}")
+            return self.fallback_backend.reserve(self.bucket_key, self.rate, self.capacity, tokens)
+    
+    def reserve(self, tokens=1):
+        """预留令牌，返回需要等待的秒数（不在任何锁内sleep）"""
+        remaining = self._reserve_tokens(tokens)
+        wait = -remaining / self.rate if remaining < 0 else 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.recent_grants.append(now + wait)
+            while self.recent_grants and self.recent_grants[0] < now - self.window_seconds:
+                self.recent_grants.popleft()
+            self.total_granted += tokens
+            self.total_wait_seconds += wait
+        return wait
+    
+    def available(self):
+        """当前可用令牌数（可能为负，表示已有排队的预留）"""
+        try:
+            return self.backend.peek(self.bucket_key, self.rate, self.capacity)
+        except Exception:
+            return 0.0
+    
+    def get_stats(self):
+        try:
+            available = self.backend.peek(self.bucket_key, self.rate, self.capacity)
+        except Exception:
+            available = None
+        with self.lock:
+            now = time.monotonic()
+            granted_in_window = sum(1 for t in self.recent_grants if now - self.window_seconds <= t <= now)
+            return {
+                'rate_per_second': self.rate,
+                'burst': self.capacity,
+                'available_tokens': round(max(available, 0.0), 2) if available is not None else None,
+                'queued': max(0, -int(available // 1)) if available is not None else None,
+                'utilisation': round(granted_in_window / (self.rate * self.window_seconds), 3),  # 本进程的利用率
+                'total_granted': self.total_granted,
+                'avg_wait_ms': round(self.total_wait_seconds / self.total_granted * 1000, 1) if self.total_granted else 0,
+                'backend_errors': self.backend_errors
+            }
+
+class AmapRateLimiter:
+    """高德API统一限流器：按端点分桶，并受API Key总QPS约束"""
+    
+    def __init__(self, limits=None, global_qps=None, backend=None, namespace='amap'):
+        limits = limits or AMAP_RATE_LIMITS
+        self.backend = backend or MemoryRateLimitBackend()
+        self.namespace = namespace
+        self.buckets = {
+            name: TokenBucket(f"{namespace}:{name}", rate, burst, self.backend)
+            for name, (rate, burst) in limits.items()
+        }
+        self.global_bucket = TokenBucket(f"{namespace}:key_total", global_qps, max(1, int(global_qps)), self.backend) if global_qps else None
+    
+    def reserve(self, endpoint='default'):
+        """预留一个令牌，返回需要等待的秒数（不sleep）"""
+        bucket = self.buckets.get(endpoint) or self.buckets['default']
+        wait = bucket.reserve()
+        if self.global_bucket is not None:
+            wait = max(wait, self.global_bucket.reserve())
+        return wait
+    
+    def acquire(self, endpoint='default'):
+        """获取一个令牌，必要时等待；返回实际等待秒数"""
+        wait = self.reserve(endpoint)
+        if wait > 0:
+            logger.debug(f"QPS控制：{endpoint} API需要等待{wait:.2f}秒")
+            time.sleep(wait)
+        return wait
+    
+    def get_stats(self):
+        stats = {
+            'backend': self.backend.name,
+            'endpoints': {name: bucket.get_stats() for name, bucket in self.buckets.items()}
+        }
+        if self.global_bucket is not None:
+            stats['key_total'] = self.global_bucket.get_stats()
+        return stats
+
+def smart_qps_control(api_name="transit", min_interval=None):
+    """智能QPS控制（兼容旧接口），委托给Key池的令牌桶限流器"""
+    return amap_manager.key_pool.acquire(api_name)[1]
 
 def amap_api_handler(api_name="Unknown API"):
     """通用的高德API错误处理装饰器"""
@@ -113,36 +532,874 @@ def amap_api_handler(api_name="Unknown API"):
         return wrapper
     return decorator
 
+# 各高德端点的 (连接超时, 读取超时)，单位秒
+AMAP_ENDPOINT_TIMEOUTS = {
+    'geocode': (10, 15),
+    'place': (5, 5),
+    'driving': (5, 15),
+    'transit': (5, 15),
+    'inputtips': (5, 10),
+    'district': (5, 10),
+    'distance': (5, 10),
+    'default': (10, 30),
+}
+AMAP_HTTP_POOL_SIZE = int(os.environ.get('AMAP_HTTP_POOL_SIZE', '32'))  # 每个主机的最大保持连接数
+
+# 离线测试：AMAP_BASE_URL 指向桩服务；AMAP_CASSETTE_MODE=record 录制真实响应，=replay 在进程内回放（见 amap_stub.py）
+AMAP_DEFAULT_BASE_URL = 'https://restapi.amap.com'
+AMAP_BASE_URL = os.environ.get('AMAP_BASE_URL', AMAP_DEFAULT_BASE_URL).rstrip('/')
+AMAP_CASSETTE_MODE = os.environ.get('AMAP_CASSETTE_MODE', '').lower()
+AMAP_CASSETTE_PATH = os.environ.get('AMAP_CASSETTE_PATH', './instance/amap_cassette.jsonl')
+
+class AmapConnectionStats:
+    """高德HTTP连接统计：新建连接数、握手耗时、各端点请求数与延迟"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections_opened = 0
+        self.handshake_total_seconds = 0.0
+        self.handshake_max_seconds = 0.0
+        self.endpoints = defaultdict(lambda: {'requests': 0, 'errors': 0, 'total_seconds': 0.0})
+    
+    def record_connect(self, seconds):
+        with self.lock:
+            self.connections_opened += 1
+            self.handshake_total_seconds += seconds
+            self.handshake_max_seconds = max(self.handshake_max_seconds, seconds)
+    
+    def record_request(self, endpoint, seconds, error=False):
+        with self.lock:
+            stats = self.endpoints[endpoint]
+            stats['requests'] += 1
+            stats['total_seconds'] += seconds
+            if error:
+                stats['errors'] += 1
+    
+    def snapshot(self):
+        with self.lock:
+            total_requests = sum(s['requests'] for s in self.endpoints.values())
+            return {
+                'connections_opened': self.connections_opened,
+                'connections_reused': max(0, total_requests - self.connections_opened),
+                'avg_handshake_ms': round(self.handshake_total_seconds / self.connections_opened * 1000, 1) if self.connections_opened else 0,
+                'max_handshake_ms': round(self.handshake_max_seconds * 1000, 1),
+                'total_requests': total_requests,
+                'endpoints': {
+                    name: {
+                        'requests': s['requests'],
+                        'errors': s['errors'],
+                        'avg_latency_ms': round(s['total_seconds'] / s['requests'] * 1000, 1) if s['requests'] else 0
+                    }
+                    for name, s in self.endpoints.items()
+                }
+            }
+
+def _make_timed_pool_classes(stats):
+    """构造记录TCP+TLS握手耗时的urllib3连接池类"""
+    
+    class TimedHTTPConnection(urllib3.connection.HTTPConnection):
+        def connect(self):
+            start = time.perf_counter()
+            super().connect()
+            stats.record_connect(time.perf_counter() - start)
+    
+    class TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+        def connect(self):
+            start = time.perf_counter()
+            super().connect()
+            stats.record_connect(time.perf_counter() - start)
+    
+    class TimedHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+        ConnectionCls = TimedHTTPConnection
+    
+    class TimedHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+        ConnectionCls = TimedHTTPSConnection
+    
+    return {'http': TimedHTTPConnectionPool, 'https': TimedHTTPSConnectionPool}
+
+class AmapHTTPAdapter(requests.adapters.HTTPAdapter):
+    """带连接统计的连接池适配器"""
+    
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+    
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = _make_timed_pool_classes(self.stats)
+
+# --- Circuit Breaker ---
+AMAP_BREAKER_WINDOW_SECONDS = 30.0      # 统计窗口
+AMAP_BREAKER_MIN_REQUESTS = 10          # 窗口内请求数达到该值才会判断是否熔断
+AMAP_BREAKER_ERROR_RATE = 0.5           # 错误率阈值
+AMAP_BREAKER_SLOW_CALL_SECONDS = 5.0    # 超过该耗时视为慢调用
+AMAP_BREAKER_SLOW_CALL_RATE = 0.8       # 慢调用比例阈值
+AMAP_BREAKER_OPEN_SECONDS = float(os.environ.get('AMAP_BREAKER_OPEN_SECONDS', '15'))  # 熔断后多久进入半开探测
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """端点熔断中，请求未发出"""
+
+class CircuitBreaker:
+    """
+    单个高德端点的熔断器：closed -> open（错误率或慢调用比例超限）-> half_open（放行一个探测请求）-> closed
+    """
+    
+    def __init__(self, name, window_seconds=AMAP_BREAKER_WINDOW_SECONDS, min_requests=AMAP_BREAKER_MIN_REQUESTS,
+                 error_rate=AMAP_BREAKER_ERROR_RATE, slow_call_seconds=AMAP_BREAKER_SLOW_CALL_SECONDS,
+                 slow_call_rate=AMAP_BREAKER_SLOW_CALL_RATE, open_seconds=AMAP_BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+        self.lock = threading.Lock()
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.probe_id = 0
+        self.calls = deque()  # (时间, 是否失败, 是否慢调用)
+        self.times_opened = 0
+        self.rejected = 0
+    
+    def is_open(self):
+        """熔断中且尚未到半开探测时间"""
+        with self.lock:
+            return self.state == 'open' and time.monotonic() - self.opened_at < self.open_seconds
+    
+    def before_request(self):
+        """
+        请求前检查：熔断中直接抛出 CircuitOpenError；半开状态只放行一个探测请求。
+        放行探测请求时返回探测编号，请求未实际发出（排队失败、预算用完等）时调用方须用 release_probe 归还，
+        否则熔断器会一直等待探测结果；非探测请求返回None。
+        """
+        with self.lock:
+            if self.state == 'closed':
+                return None
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.open_seconds:
+                self.state = 'half_open'
+                self.probe_in_flight = False
+            if self.state == 'half_open' and not self.probe_in_flight:
+                self.probe_in_flight = True
+                self.probe_id += 1
+                logger.info(f"熔断器[{self.name}]半开，放行探测请求")
+                return self.probe_id
+            self.rejected += 1
+        raise CircuitOpenError(f"高德{self.name}接口熔断中")
+    
+    def release_probe(self, probe_id):
+        """归还未发出的探测请求（已由 record 记录结果的探测不受影响），下一个请求可以重新探测"""
+        with self.lock:
+            if self.state == 'half_open' and self.probe_in_flight and self.probe_id == probe_id:
+                self.probe_in_flight = False
+    
+    def record(self, seconds, failed):
+        """记录一次请求结果"""
+        now = time.monotonic()
+        slow = seconds >= self.slow_call_seconds
+        with self.lock:
+            if self.state == 'half_open':
+                self.probe_in_flight = False
+                if failed or slow:
+                    self._open(now, '探测请求失败')
+                else:
+                    self.state = 'closed'
+                    self.calls.clear()
+                    logger.info(f"熔断器[{self.name}]探测成功，恢复正常")
+                return
+            
+            self.calls.append((now, failed, slow))
+            while self.calls and self.calls[0][0] < now - self.window_seconds:
+                self.calls.popleft()
+            total = len(self.calls)
+            if self.state != 'closed' or total < self.min_requests:
+                return
+            failures = sum(1 for _, f, _ in self.calls if f)
+            slow_calls = sum(1 for _, _, s in self.calls if s)
+            if failures / total >= self.error_rate:
+                self._open(now, f"错误率{failures}/{total}")
+            elif slow_calls / total >= self.slow_call_rate:
+                self._open(now, f"慢调用{slow_calls}/{total}")
+    
+    def _open(self, now, reason):
+        self.state = 'open'
+        self.opened_at = now
+        self.times_opened += 1
+        self.calls.clear()
+        logger.warning(f"熔断器[{self.name}]打开: {reason}，{self.open_seconds:.0f}秒后半开探测")
+    
+    def get_stats(self):
+        with self.lock:
+            return {
+                'state': self.state,
+                'window_requests': len(self.calls),
+                'window_failures': sum(1 for _, f, _ in self.calls if f),
+                'times_opened': self.times_opened,
+                'rejected': self.rejected
+            }
+
+ESTIMATE_REASON_MESSAGES = {
+    'circuit_open': '地图服务暂时不可用',
+    'deadline': '路线查询超出请求时间预算',
+}
+
+def build_estimated_leg(lat1, lng1, lat2, lng2, mode='driving', reason='circuit_open'):
+    """按直线距离估算路段（不调用API），结果带 is_estimated 标记，不写入缓存"""
+    # calculate_haversine_distance 返回公里，路段与高德结果一样以米/秒计
+    distance_m = calculate_haversine_distance(lat1, lng1, lat2, lng2) * 1000
+    leg = {
+        'distance': int(distance_m),
+        'duration': int(max(300, distance_m / (40 / 3.6))),  # 最少5分钟，按40km/h估算
+        'polyline': '',
+        'steps': [{
+            'type': 'estimated',
+            'instruction': f"⚠️ {ESTIMATE_REASON_MESSAGES.get(reason, '路线信息不可用')}，按直线距离估算（{distance_m/1000:.1f}公里）"
+        }],
+        'is_estimated': True,
+        'estimate_reason': reason
+    }
+    if mode == 'public_transit':
+        leg['segments'] = []
+    return leg
+
+# --- Request Deadlines ---
+OPTIMIZATION_DEFAULT_BUDGET_SECONDS = float(os.environ.get('OPTIMIZATION_LATENCY_BUDGET', '60'))
+OPTIMIZATION_MAX_BUDGET_SECONDS = 180.0
+DEADLINE_FETCH_FRACTION = 0.6   # 搜索和矩阵获取最多使用预算的60%，其余留给求解和整理结果
+DEADLINE_SOLVER_FRACTION = 0.7  # 求解最多使用获取阶段结束后剩余时间的70%，留出路线详情补充的时间
+
+class DeadlineExceededError(requests.exceptions.RequestException):
+    """请求的时间预算已用完，不再发起新的高德请求"""
+
+class Deadline:
+    """
+    单个优化请求的时间预算。获取阶段（搜索、矩阵）在预算的 DEADLINE_FETCH_FRACTION 处截止，
+    截止后缺失的路段用估算值补齐，立即开始求解。
+    """
+    
+    def __init__(self, budget_seconds):
+        self.budget_seconds = budget_seconds
+        self.started = time.monotonic()
+        self.expires_at = self.started + budget_seconds
+        self.fetch_expires_at = self.started + budget_seconds * DEADLINE_FETCH_FRACTION
+        self.fetching = True
+    
+    def remaining(self):
+        """当前阶段剩余秒数：获取阶段按获取截止时间计算"""
+        expires_at = self.fetch_expires_at if self.fetching else self.expires_at
+        return max(0.0, expires_at - time.monotonic())
+    
+    def expired(self):
+        return self.remaining() <= 0
+    
+    def fetch_expired(self):
+        return time.monotonic() >= self.fetch_expires_at
+    
+    def finish_fetch(self):
+        """矩阵获取结束，后续请求（路线详情补充）使用整体预算"""
+        self.fetching = False
+    
+    def solver_seconds(self, default_seconds):
+        """求解可用秒数（不超过默认值，至少1秒）"""
+        available = max(0.0, self.expires_at - time.monotonic()) * DEADLINE_SOLVER_FRACTION
+        return max(1, int(min(default_seconds, available)))
+    
+    def get_stats(self):
+        elapsed = time.monotonic() - self.started
+        return {
+            'budget_seconds': self.budget_seconds,
+            'elapsed_seconds': round(elapsed, 3),
+            'fetch_deadline_reached': time.monotonic() >= self.fetch_expires_at
+        }
+
+_request_deadline_var = contextvars.ContextVar('request_deadline', default=None)
+
+def get_request_deadline():
+    return _request_deadline_var.get()
+
+@contextmanager
+def request_deadline(budget_seconds):
+    """在当前上下文中设置请求截止时间，高德请求、矩阵等待和求解器都会据此收紧超时"""
+    deadline = Deadline(budget_seconds)
+    token = _request_deadline_var.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _request_deadline_var.reset(token)
+
+def deadline_timeout(default_seconds):
+    """等待超时：没有截止时间时使用默认值，否则不超过当前阶段剩余时间"""
+    deadline = get_request_deadline()
+    if deadline is None:
+        return default_seconds
+    return min(default_seconds, deadline.remaining())
+
+def deadline_solver_seconds(default_seconds):
+    deadline = get_request_deadline()
+    return default_seconds if deadline is None else deadline.solver_seconds(default_seconds)
+
+def finish_fetch_phase():
+    deadline = get_request_deadline()
+    if deadline is not None:
+        deadline.finish_fetch()
+
+def fetch_deadline_reached():
+    deadline = get_request_deadline()
+    return deadline is not None and deadline.fetch_expired()
+
+def wait_for_leg(task, timeout=30):
+    """
+    等待路段Future，返回 (结果, 是否因截止时间放弃)。
+    获取阶段截止后仍未完成（或因截止时间失败）的路段取消任务并返回 (None, True)，由调用方用估算值补齐。
+    """
+    deadline = get_request_deadline()
+    if deadline is None:
+        return task.result(timeout=timeout), False
+    try:
+        result = task.result(timeout=min(timeout, deadline.remaining()))
+    except concurrent.futures.TimeoutError:
+        if not deadline.fetch_expired():
+            raise
+        task.cancel()
+        return None, True
+    except DeadlineExceededError:
+        return None, True
+    if result is None and deadline.fetch_expired():
+        return None, True
+    return result, False
+
+def collect_estimated_legs(points, cost_matrix):
+    """列出代价矩阵中使用估算值的路段（每对点一次）"""
+    estimated = []
+    for i in range(len(points)):
+        for j in range(i + 1, len(points)):
+            leg = cost_matrix[i][j]
+            if leg and leg.get('is_estimated'):
+                estimated.append({
+                    'from_id': points[i].get('id', 'unknown'),
+                    'to_id': points[j].get('id', 'unknown'),
+                    'from_name': points[i].get('name', 'Unknown'),
+                    'to_name': points[j].get('name', 'Unknown'),
+                    'reason': leg.get('estimate_reason')
+                })
+    return estimated
+
+def parse_latency_budget(value):
+    """校验请求中的 latency_budget（秒），缺省时使用默认预算"""
+    if value is None:
+        return OPTIMIZATION_DEFAULT_BUDGET_SECONDS
+    if isinstance(value, bool):
+        raise ValueError('latency_budget must be a number of seconds')
+    budget = float(value)
+    if not budget > 0:
+        raise ValueError('latency_budget must be positive')
+    return min(budget, OPTIMIZATION_MAX_BUDGET_SECONDS)
+
+def with_latency_budget(func):
+    """视图装饰器：按请求体中的 latency_budget 设置截止时间，传递给搜索、矩阵获取和求解"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        data = request.get_json(silent=True, force=True) or {}
+        try:
+            budget = parse_latency_budget(data.get('latency_budget') if isinstance(data, dict) else None)
+        except (TypeError, ValueError):
+            return jsonify({'message': 'latency_budget must be a positive number of seconds'}), 400
+        with request_deadline(budget):
+            return func(*args, **kwargs)
+    return wrapper
+
+# --- Adaptive Concurrency (AIMD) + Priority Scheduling ---
+AMAP_MIN_CONCURRENCY = int(os.environ.get('AMAP_MIN_CONCURRENCY', '2'))
+AMAP_MAX_CONCURRENCY = int(os.environ.get('AMAP_MAX_CONCURRENCY', '32'))
+AMAP_INITIAL_CONCURRENCY = int(os.environ.get('AMAP_INITIAL_CONCURRENCY', '8'))
+AMAP_CONCURRENCY_LATENCY_TARGET = float(os.environ.get('AMAP_CONCURRENCY_LATENCY_TARGET', '2.0'))  # 秒
+
+# 优先级类别及其加权公平队列权重：权重越大，分到的并发名额越多
+AMAP_PRIORITY_WEIGHTS = {
+    'interactive': 8,   # 用户正在输入/等待的查询（地址联想、地理编码搜索）
+    'optimization': 4,  # 路线优化中的矩阵与搜索请求（默认）
+    'prefetch': 2,      # 预取、缓存预热
+    'benchmark': 1,     # 算法基准测试
+}
+AMAP_DEFAULT_PRIORITY = 'optimization'
+AMAP_PRIORITY_MAX_WAIT = float(os.environ.get('AMAP_PRIORITY_MAX_WAIT', '5.0'))  # 秒，超过后无论权重优先放行，防止饿死
+
+_amap_priority_var = contextvars.ContextVar('amap_priority', default=AMAP_DEFAULT_PRIORITY)
+
+def get_amap_priority():
+    return _amap_priority_var.get()
+
+@contextmanager
+def amap_priority(priority):
+    """在当前上下文中为高德请求指定优先级类别"""
+    token = _amap_priority_var.set(priority if priority in AMAP_PRIORITY_WEIGHTS else AMAP_DEFAULT_PRIORITY)
+    try:
+        yield
+    finally:
+        _amap_priority_var.reset(token)
+
+def amap_request_priority(priority):
+    """视图装饰器：该接口发起的所有高德请求（包括线程池中的）都使用指定优先级"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with amap_priority(priority):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """提交任务时复制调用方的 contextvars，使工作线程继承请求的优先级等上下文"""
+    
+    def submit(self, fn, *args, **kwargs):
+        ctx = contextvars.copy_context()
+        return super().submit(ctx.run, fn, *args, **kwargs)
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD自适应并发控制：所有高德请求共享同一个在途请求上限。
+    延迟低于目标且无错误时，每完成一个"窗口"（等于当前上限）的请求上限加1；
+    出现QPS超限或超时时上限减半（每个冷却间隔最多减一次，避免同一批失败连续减半）。
+    
+    名额按优先级类别排队，空出的名额用加权公平队列（WFQ）分配；
+    某类队首等待超过 max_wait 秒时优先放行，保证低优先级请求不会饿死。
+    """
+    
+    def __init__(self, min_limit=AMAP_MIN_CONCURRENCY, max_limit=AMAP_MAX_CONCURRENCY, initial_limit=AMAP_INITIAL_CONCURRENCY,
+                 latency_target=AMAP_CONCURRENCY_LATENCY_TARGET, decrease_factor=0.5, decrease_cooldown=1.0,
+                 weights=None, max_wait=AMAP_PRIORITY_MAX_WAIT):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.decrease_cooldown = decrease_cooldown
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.successes_in_window = 0
+        self.last_decrease = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.peak_in_flight = 0
+        # 优先级队列
+        self.weights = weights or AMAP_PRIORITY_WEIGHTS
+        self.max_wait = max_wait
+        self.queues = {name: deque() for name in self.weights}
+        self.finish_tags = {name: 0.0 for name in self.weights}
+        self.virtual_time = 0.0
+        self.class_stats = {name: {'granted': 0, 'aged': 0, 'max_wait_ms': 0.0} for name in self.weights}
+    
+    def _next_class(self, now):
+        """选出下一个获得名额的类别：先看是否有饿死的队首，否则取虚拟完成时间最小的类别"""
+        starved = [(queue[0][0], name) for name, queue in self.queues.items()
+                   if queue and now - queue[0][0] >= self.max_wait]
+        if starved:
+            return min(starved)[1], True
+        best = None
+        for name, queue in self.queues.items():
+            if not queue:
+                continue
+            tag = max(self.virtual_time, self.finish_tags[name]) + 1.0 / self.weights[name]
+            if best is None or tag < best[0]:
+                best = (tag, name)
+        return (best[1], False) if best else (None, False)
+    
+    def acquire(self, priority=None):
+        """按优先级排队占用一个在途名额，超过当前上限时等待；返回排队秒数"""
+        priority = priority if priority in self.queues else AMAP_DEFAULT_PRIORITY
+        enqueued = time.monotonic()
+        ticket = (enqueued, object())
+        with self.condition:
+            queue = self.queues[priority]
+            queue.append(ticket)
+            while True:
+                if self.in_flight < int(self.limit) and queue[0] is ticket:
+                    now = time.monotonic()
+                    chosen, aged = self._next_class(now)
+                    if chosen == priority:
+                        break
+                self.condition.wait()
+            queue.popleft()
+            start_tag = max(self.virtual_time, self.finish_tags[priority])
+            self.finish_tags[priority] = start_tag + 1.0 / self.weights[priority]
+            self.virtual_time = start_tag
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            waited = now - enqueued
+            stats = self.class_stats[priority]
+            stats['granted'] += 1
+            stats['aged'] += 1 if aged else 0
+            stats['max_wait_ms'] = max(stats['max_wait_ms'], waited * 1000)
+            # 可能还有空闲名额，唤醒其他等待者重新判断
+            self.condition.notify_all()
+        return waited
+    
+    def record(self, latency, overloaded=False):
+        """根据一次上游调用的结果调整上限：overloaded 表示QPS超限或超时"""
+        with self.condition:
+            now = time.monotonic()
+            if overloaded:
+                if now - self.last_decrease >= self.decrease_cooldown:
+                    old_limit = self.limit
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self.last_decrease = now
+                    self.successes_in_window = 0
+                    self.decreases += 1
+                    logger.warning(f"高德并发上限下调: {old_limit:.0f} -> {self.limit:.0f}")
+            elif latency <= self.latency_target:
+                self.successes_in_window += 1
+                if self.successes_in_window >= int(self.limit) and self.limit < self.max_limit:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self.successes_in_window = 0
+                    self.increases += 1
+                    self.condition.notify_all()
+    
+    def release(self):
+        """释放名额"""
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+    
+    def get_stats(self):
+        with self.condition:
+            return {
+                'limit': int(self.limit),
+                'min_limit': self.min_limit,
+                'max_limit': self.max_limit,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'increases': self.increases,
+                'decreases': self.decreases,
+                'priorities': {
+                    name: dict(stats, waiting=len(self.queues[name]), weight=self.weights[name])
+                    for name, stats in self.class_stats.items()
+                }
+            }
+
+# --- Amap API Key Pool ---
+AMAP_KEY_DAILY_QUOTA = int(os.environ.get('AMAP_KEY_DAILY_QUOTA', '0'))  # 每个Key的日配额，0表示不限制（仍统计用量）
+AMAP_KEY_QPS_COOLDOWN_SECONDS = float(os.environ.get('AMAP_KEY_QPS_COOLDOWN_SECONDS', '2'))
+AMAP_QPS_ERROR_MARKERS = (b'CUQPS_HAS_EXCEEDED_THE_LIMIT', b'ACCESS_TOO_FREQUENT')
+AMAP_DAILY_QUOTA_ERROR_MARKERS = (b'DAILY_QUERY_OVER_LIMIT',)  # 同时匹配 USER_DAILY_QUERY_OVER_LIMIT
+
+def _mask_api_key(api_key):
+    """日志和统计中只显示Key的首尾字符"""
+    return f"{api_key[:4]}...{api_key[-4:]}" if len(api_key) > 8 else '***'
+
+class AmapKey:
+    """单个API Key：独立的按端点限流器、日配额计数和冷却状态"""
+    
+    def __init__(self, api_key, limits, global_qps, backend, daily_quota=0):
+        self.api_key = api_key
+        # 配额属于API Key，因此桶按Key命名，所有共享同一后端的进程从同一预算中扣减
+        self.rate_limiter = AmapRateLimiter(
+            limits,
+            global_qps=global_qps,
+            backend=backend,
+            namespace=f"amap:{hashlib.md5(api_key.encode('utf-8')).hexdigest()[:8]}"
+        )
+        self.daily_quota = daily_quota
+        self.lock = threading.Lock()
+        self.day = datetime.now().date()
+        self.used_today = 0
+        self.total_requests = 0
+        self.quota_errors = 0
+        self.cooldown_until = 0.0  # time.monotonic()
+        self.cooldown_reason = None
+    
+    def _roll_day(self):
+        today = datetime.now().date()
+        if today != self.day:
+            self.day = today
+            self.used_today = 0
+    
+    def is_available(self, now=None):
+        return (now or time.monotonic()) >= self.cooldown_until and self.daily_remaining() != 0
+    
+    def daily_remaining(self):
+        """今日剩余配额；未配置日配额时返回None"""
+        with self.lock:
+            self._roll_day()
+            if not self.daily_quota:
+                return None
+            return max(0, self.daily_quota - self.used_today)
+    
+    def headroom(self, endpoint):
+        """可用余量：(端点与Key总量中较小的可用令牌数, 今日剩余配额比例)"""
+        limiter = self.rate_limiter
+        bucket = limiter.buckets.get(endpoint) or limiter.buckets['default']
+        tokens = bucket.available()
+        if limiter.global_bucket is not None:
+            tokens = min(tokens, limiter.global_bucket.available())
+        remaining = self.daily_remaining()
+        quota_ratio = 1.0 if remaining is None else remaining / self.daily_quota
+        return tokens, quota_ratio
+    
+    def record_use(self):
+        with self.lock:
+            self._roll_day()
+            self.used_today += 1
+            self.total_requests += 1
+    
+    def cooldown(self, seconds, reason):
+        with self.lock:
+            self.quota_errors += 1
+            self.cooldown_until = max(self.cooldown_until, time.monotonic() + seconds)
+            self.cooldown_reason = reason
+        logger.warning(f"API Key {_mask_api_key(self.api_key)} 暂停使用{seconds:.0f}秒: {reason}")
+    
+    def get_stats(self):
+        remaining = self.daily_remaining()
+        cooldown_left = self.cooldown_until - time.monotonic()
+        return {
+            'key': _mask_api_key(self.api_key),
+            'available': self.is_available(),
+            'used_today': self.used_today,
+            'daily_quota': self.daily_quota or None,
+            'daily_remaining': remaining,
+            'total_requests': self.total_requests,
+            'quota_errors': self.quota_errors,
+            'cooldown_seconds_left': round(cooldown_left, 1) if cooldown_left > 0 else 0,
+            'cooldown_reason': self.cooldown_reason if cooldown_left > 0 else None,
+            'rate_limiter': self.rate_limiter.get_stats()
+        }
+
+class AmapKeyPool:
+    """API Key池：每次请求选择余量最大的可用Key，配额错误的Key临时移出轮换"""
+    
+    def __init__(self, api_keys, limits=None, global_qps=None, backend=None, daily_quota=AMAP_KEY_DAILY_QUOTA):
+        backend = backend or create_rate_limit_backend()
+        self.keys = [AmapKey(k, limits or AMAP_RATE_LIMITS, global_qps, backend, daily_quota) for k in dict.fromkeys(api_keys) if k]
+        if not self.keys:
+            self.keys = [AmapKey('', limits or AMAP_RATE_LIMITS, global_qps, backend, daily_quota)]
+        self.lock = threading.Lock()  # 只保护选Key和 pending 计数
+        self.pending = defaultdict(int)  # Key -> 已选中但尚未完成令牌预留的请求数
+    
+    def acquire(self, endpoint='default', exclude=None):
+        """
+        选择Key并预留令牌，在锁外等待；返回 (AmapKey, 等待秒数)。
+        各Key的余量在池锁外读取（SQLite/Redis 后端的读取是I/O），令牌预留也在锁外进行；
+        锁内只按 "余量快照 - 已选中未预留的请求数" 选Key，避免并发请求挤向同一个Key。
+        """
+        now = time.monotonic()
+        candidates = [k for k in self.keys if k is not exclude and k.is_available(now)]
+        headroom = {k: k.headroom(endpoint) for k in candidates} if len(candidates) > 1 else {}
+        with self.lock:
+            if len(candidates) > 1:
+                chosen = max(candidates, key=lambda k: (headroom[k][0] - self.pending[k], headroom[k][1]))
+            elif candidates:
+                chosen = candidates[0]
+            else:
+                # 所有Key都在冷却中：使用最早恢复的Key，而不是直接失败
+                chosen = min((k for k in self.keys if k is not exclude), key=lambda k: k.cooldown_until, default=self.keys[0])
+            self.pending[chosen] += 1
+        try:
+            wait = chosen.rate_limiter.reserve(endpoint)
+        finally:
+            with self.lock:
+                self.pending[chosen] -= 1
+        chosen.record_use()
+        if wait > 0:
+            logger.debug(f"QPS控制：{endpoint} API需要等待{wait:.2f}秒")
+            time.sleep(wait)
+        return chosen, wait
+    
+    def has_alternative(self, amap_key):
+        now = time.monotonic()
+        return any(k is not amap_key and k.is_available(now) for k in self.keys)
+    
+    def inspect_response(self, amap_key, response):
+        """扫描响应字节中的配额错误（不解析JSON），必要时让Key进入冷却；返回 'daily'、'qps' 或 None"""
+        content = response.content or b''
+        if any(marker in content for marker in AMAP_DAILY_QUOTA_ERROR_MARKERS):
+            tomorrow = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+            amap_key.cooldown((tomorrow - datetime.now()).total_seconds(), '日配额已用完')
+            return 'daily'
+        if any(marker in content for marker in AMAP_QPS_ERROR_MARKERS):
+            amap_key.cooldown(AMAP_KEY_QPS_COOLDOWN_SECONDS, 'QPS超限')
+            return 'qps'
+        return None
+    
+    def get_stats(self):
+        return [k.get_stats() for k in self.keys]
+
+def _load_amap_api_keys():
+    """读取Key池：AMAP_API_KEYS（逗号分隔）优先，否则使用 app.config['AMAP_API_KEY']"""
+    keys = [k.strip() for k in os.environ.get('AMAP_API_KEYS', '').split(',') if k.strip()]
+    return keys or [app.config.get('AMAP_API_KEY', '')]
+
 class AmapAPIManager:
     """高德API管理器，处理QPS限制和重试逻辑"""
     
-    def __init__(self, api_key, max_qps=20):
+    def __init__(self, api_key, max_qps=20, pool_size=AMAP_HTTP_POOL_SIZE, api_keys=None):
         self.api_key = api_key
-        self.max_qps = max_qps
-        self.request_times = []
-        self.executor = ThreadPoolExecutor(max_workers=5)
-        self.session = requests.Session()  # 创建持久连接会话
-    
-    def _check_qps_limit(self):
-        """检查QPS限制"""
-        now = time.time()
-        # 清理1秒前的请求记录
-        self.request_times = [t for t in self.request_times if now - t < 1.0]
-        
-        if len(self.request_times) >= self.max_qps:
-            sleep_time = 1.0 - (now - self.request_times[0])
-            if sleep_time > 0:
-                time.sleep(sleep_time)
-    
-    def _record_request(self):
-        """记录请求时间"""
-        self.request_times.append(time.time())
-    
-    def apply_rate_limit(self):
-        """应用速率限制 - 统一的延迟管理"""
-        self._check_qps_limit()
-        self._record_request()
-        time.sleep(0.15)  # 增加基础延迟，防止QPS超限
+        self.max_qps = max_qps  # 每个Key的总QPS
+        # 每个Key独立限流，吞吐量随Key数量线性增长；请求中的key参数由Key池统一替换
+        self.key_pool = AmapKeyPool(api_keys or [api_key], AMAP_RATE_LIMITS, global_qps=max_qps)
+        self.breakers = {}  # 端点 -> CircuitBreaker
+        self.breakers_lock = threading.Lock()
+        # 所有调用方共享的自适应并发上限；线程池按上限的最大值配置，实际在途请求由控制器约束
+        self.concurrency = AdaptiveConcurrencyLimiter()
+        self.executor = ContextThreadPoolExecutor(max_workers=AMAP_MAX_CONCURRENCY, thread_name_prefix='amap')
+        # POI分页请求的独立线程池：搜索可能运行在 executor 的工作线程中，若分页也提交到 executor，
+        # 等待排在其后的分页会在高负载时占满线程池而死锁；分页任务本身不再等待其他任务
+        self.page_executor = ContextThreadPoolExecutor(max_workers=AMAP_MAX_CONCURRENCY, thread_name_prefix='amap-page')
+        self.pool_size = pool_size
+        self.connection_stats = AmapConnectionStats()
+        self.cassette = None  # 录制模式下的磁带
+        self.replay_responder = None
+        self.session = self._create_session(pool_size)  # 所有高德请求共享的持久连接会话
+    
+    def _create_session(self, pool_size):
+        """创建带连接池和keep-alive的共享会话"""
+        session = requests.Session()
+        adapter = AmapHTTPAdapter(
+            self.connection_stats,
+            pool_connections=4,
+            pool_maxsize=pool_size,
+            max_retries=0  # 重试由调用方自行处理
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        session.headers.update({'Connection': 'keep-alive'})
+        self._setup_cassette(session)
+        return session
+    
+    def _setup_cassette(self, session):
+        """按 AMAP_CASSETTE_MODE 开启录制，或挂载进程内回放适配器"""
+        if AMAP_CASSETTE_MODE not in ('record', 'replay'):
+            return
+        if not AMAP_STUB_AVAILABLE:
+            logger.error("amap_stub 模块不可用，忽略 AMAP_CASSETTE_MODE")
+            return
+        if AMAP_CASSETTE_MODE == 'record':
+            os.makedirs(os.path.dirname(AMAP_CASSETTE_PATH) or '.', exist_ok=True)
+            self.cassette = Cassette(AMAP_CASSETTE_PATH)
+            logger.info(f"高德API录制模式：响应写入 {AMAP_CASSETTE_PATH}")
+            return
+        try:
+            cassette = Cassette.load(AMAP_CASSETTE_PATH)
+        except OSError as e:
+            logger.error(f"无法加载高德API磁带 {AMAP_CASSETTE_PATH}: {e}")
+            return
+        self.replay_responder = ReplayResponder(
+            cassette,
+            latency_ms=float(os.environ.get('AMAP_STUB_LATENCY_MS', '0')),
+            jitter_ms=float(os.environ.get('AMAP_STUB_JITTER_MS', '0')),
+            error_rate=float(os.environ.get('AMAP_STUB_ERROR_RATE', '0')),
+            qps_limit=int(os.environ.get('AMAP_STUB_QPS', '0'))
+        )
+        session.mount(AMAP_BASE_URL + '/', CassetteReplayAdapter(self.replay_responder))
+        logger.info(f"高德API回放模式：从 {AMAP_CASSETTE_PATH} 回放 {len(cassette)} 条记录，不访问网络")
+    
+    def get_timeout(self, endpoint):
+        """获取端点的 (连接超时, 读取超时)"""
+        return AMAP_ENDPOINT_TIMEOUTS.get(endpoint, AMAP_ENDPOINT_TIMEOUTS['default'])
+    
+    def _apply_key(self, api_key, params, json_body):
+        """把请求参数（以及批量子请求URL）中的key替换为选中的Key"""
+        if params is not None and 'key' in params:
+            params = dict(params, key=api_key)
+        if json_body and json_body.get('ops'):
+            json_body = dict(json_body, ops=[
+                dict(op, url=re.sub(r'(?<=[?&])key=[^&]*', f'key={api_key}', op['url'])) for op in json_body['ops']
+            ])
+        return params, json_body
+    
+    def get_breaker(self, endpoint):
+        """获取端点的熔断器（按需创建）"""
+        with self.breakers_lock:
+            breaker = self.breakers.get(endpoint)
+            if breaker is None:
+                breaker = self.breakers[endpoint] = CircuitBreaker(endpoint)
+            return breaker
+    
+    def is_circuit_open(self, endpoint):
+        """端点是否熔断中（矩阵构建据此直接使用估算路段）"""
+        return self.get_breaker(endpoint).is_open()
+    
+    def request(self, endpoint, url, params=None, timeout=None, method='GET', json_body=None):
+        """所有高德API流量的统一入口：熔断检查、按优先级排队、Key池选Key限流、共享连接池、按端点设置超时并记录统计"""
+        deadline = get_request_deadline()
+        if deadline is not None and deadline.expired():
+            raise DeadlineExceededError(f"请求时间预算已用完，跳过{endpoint}请求")
+        if AMAP_BASE_URL != AMAP_DEFAULT_BASE_URL and url.startswith(AMAP_DEFAULT_BASE_URL):
+            url = AMAP_BASE_URL + url[len(AMAP_DEFAULT_BASE_URL):]
+        breaker = self.get_breaker(endpoint)
+        probe_id = breaker.before_request()  # 熔断中直接抛出 CircuitOpenError，不消耗令牌
+        try:
+            # 先按优先级获得并发名额再预留令牌：排在令牌桶前面的请求数受并发上限约束，
+            # 交互式请求只需等待名额轮转，而不是排在几百个后台矩阵请求的令牌预留之后
+            self.concurrency.acquire(get_amap_priority())
+            try:
+                amap_key, _ = self.key_pool.acquire(endpoint)
+                response, quota_error = self._send(endpoint, url, amap_key, params, timeout, method, json_body)
+                # 配额错误：该Key进入冷却，如有其他可用Key则换Key重试一次
+                if quota_error and self.key_pool.has_alternative(amap_key):
+                    amap_key, _ = self.key_pool.acquire(endpoint, exclude=amap_key)
+                    response, _ = self._send(endpoint, url, amap_key, params, timeout, method, json_body)
+                return response
+            finally:
+                self.concurrency.release()
+        finally:
+            # 探测请求在发出前失败（排队、选Key异常或预算在等待中用完）时归还探测名额
+            if probe_id is not None:
+                breaker.release_probe(probe_id)
+    
+    def _send(self, endpoint, url, amap_key, params, timeout, method, json_body):
+        """发送一次请求并把结果反馈给自适应并发控制，返回 (响应, 配额错误类型)"""
+        params, json_body = self._apply_key(amap_key.api_key, params, json_body)
+        breaker = self.get_breaker(endpoint)
+        timeout = timeout or self.get_timeout(endpoint)
+        # 有请求截止时间时，读超时不超过剩余预算（排队和令牌等待之后重新计算）
+        deadline = get_request_deadline()
+        capped = False
+        if deadline is not None:
+            remaining = deadline.remaining()
+            if remaining <= 0:
+                raise DeadlineExceededError(f"请求时间预算已用完，跳过{endpoint}请求")
+            connect_timeout, read_timeout = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+            if read_timeout > remaining:
+                timeout = (min(connect_timeout, remaining), remaining)
+                capped = True
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, url, params=params, json=json_body, timeout=timeout
+            )
+        except requests.exceptions.RequestException as e:
+            elapsed = time.perf_counter() - start
+            # 因截止时间收紧而超时不代表上游过载，不触发并发上限下调
+            self.concurrency.record(elapsed, overloaded=isinstance(e, requests.exceptions.Timeout) and not capped)
+            self.connection_stats.record_request(endpoint, elapsed, error=True)
+            breaker.record(elapsed, failed=True)
+            raise
+        elapsed = time.perf_counter() - start
+        if self.cassette is not None:
+            self.cassette.record(method, url, params, json_body, response.status_code, response.text, elapsed,
+                                 response.headers.get('Content-Type', 'application/json'))
+        quota_error = self.key_pool.inspect_response(amap_key, response)
+        self.concurrency.record(elapsed, overloaded=quota_error == 'qps')
+        self.connection_stats.record_request(endpoint, elapsed, error=response.status_code >= 400)
+        breaker.record(elapsed, failed=response.status_code >= 500)  # 业务错误（如无路线）不计入熔断
+        return response, quota_error
+    
+    def get_stats(self):
+        """获取客户端统计信息"""
+        return {
+            'pool_size': self.pool_size,
+            'connections': self.connection_stats.snapshot(),
+            'keys': self.key_pool.get_stats(),
+            'json_codec': json_codec.get_stats(),
+            'replay': self.replay_responder.get_stats() if self.replay_responder else None,
+            'concurrency': self.concurrency.get_stats(),
+            'circuit_breakers': {name: breaker.get_stats() for name, breaker in list(self.breakers.items())}
+        }
+    
+    def apply_rate_limit(self, endpoint='default'):
+        """应用速率限制 - 统一的令牌桶限流"""
+        return self.key_pool.acquire(endpoint)[1]
     
     def with_retry(self, max_retries=5, backoff_factor=1.5):
         """重试装饰器 - 增强版本，特别处理QPS和SSL错误"""
@@ -152,9 +1409,10 @@ class AmapAPIManager:
                 last_exception = None
                 for attempt in range(max_retries):
                     try:
-                        self.apply_rate_limit()
-                        result = func(*args, **kwargs)
+                        result = func(*args, **kwargs)  # 限流在 request() 中统一进行
                         return result
+                    except (CircuitOpenError, DeadlineExceededError):
+                        raise  # 熔断中或预算已用完时重试没有意义，直接交给调用方降级
                     except requests.exceptions.SSLError as e:
                         last_exception = e
                         if attempt < max_retries - 1:
@@ -198,15 +1456,10 @@ class AmapAPIManager:
             return wrapper
         return decorator
     
-    def safe_request(self, url, params=None, timeout=30):
+    def safe_request(self, url, params=None, timeout=None, endpoint='default'):
         """统一的安全API请求方法"""
         try:
-            response = self.session.get(
-                url, 
-                params=params, 
-                timeout=(10, timeout),  # (连接超时, 读取超时)
-                verify=True
-            )
+            response = self.request(endpoint, url, params=params, timeout=timeout)
             response.raise_for_status()
             return response
         except requests.exceptions.RequestException as e:
@@ -216,7 +1469,7 @@ class AmapAPIManager:
 class DistanceCache:
     """距离缓存管理器，用于缓存API调用结果以提高性能，支持持久化存储"""
     
-    def __init__(self, cache_duration_hours=24, persistent_cache=False, cache_file_path=None):
+    def __init__(self, cache_duration_hours=24, persistent_cache=False, cache_file_path=None, access_log_path=None):
         self.cache = {}  # 内存缓存
         self.cache_duration = timedelta(hours=cache_duration_hours)
         self.hit_count = 0
@@ -224,6 +1477,17 @@ class DistanceCache:
         self.persistent_cache = persistent_cache
         self.cache_file_path = cache_file_path or 'distance_cache.json'
         
+        # 可选的访问日志，供 cache_simulator.py 离线回放
+        self.access_log_path = access_log_path
+        self._access_log_file = None
+        self._access_log_lock = threading.Lock()
+        if self.access_log_path:
+            try:
+                self._access_log_file = open(self.access_log_path, 'a', encoding='utf-8', buffering=1)
+                logger.info(f"缓存访问日志已启用: {self.access_log_path}")
+            except OSError as e:
+                logger.warning(f"无法打开缓存访问日志 {self.access_log_path}: {e}")
+        
         # 如果启用持久化缓存，尝试加载现有缓存
         if self.persistent_cache:
             self._load_cache_from_file()
@@ -232,8 +1496,8 @@ class DistanceCache:
         """从文件加载缓存数据"""
         try:
             if os.path.exists(self.cache_file_path):
-                with open(self.cache_file_path, 'r', encoding='utf-8') as f:
-                    file_data = json.load(f)
+                with open(self.cache_file_path, 'rb') as f:
+                    file_data = json_codec.loads(f.read(), 'cache_load')
                     
                 # 转换时间戳字符串回datetime对象
                 for key, value in file_data.items():
@@ -262,8 +1526,8 @@ class DistanceCache:
             
             # 使用临时文件确保原子性写入
             temp_file = self.cache_file_path + '.tmp'
-            with open(temp_file, 'w', encoding='utf-8') as f:
-                json.dump(serializable_cache, f, ensure_ascii=False, indent=2)
+            with open(temp_file, 'wb') as f:
+                f.write(json_codec.dumps(serializable_cache, 'cache_save', indent=True))
             
             # 原子性替换
             os.replace(temp_file, self.cache_file_path)
@@ -286,6 +1550,36 @@ class DistanceCache:
         key_string = json.dumps(key_data, sort_keys=True)
         return hashlib.md5(key_string.encode('utf-8')).hexdigest()
     
+    def _payload_size(self, data):
+        """估算缓存数据的序列化大小（字节）"""
+        try:
+            return len(json_codec.dumps(data))
+        except (TypeError, ValueError):
+            return 0
+    
+    def _log_access(self, event, cache_key, lat1, lng1, lat2, lng2, mode, city, size=None):
+        """向访问日志追加一条紧凑记录（每行一个JSON对象）"""
+        if self._access_log_file is None:
+            return
+        if (lat1, lng1) > (lat2, lng2):
+            lat1, lng1, lat2, lng2 = lat2, lng2, lat1, lng1
+        record = {
+            't': round(time.time(), 3),
+            'e': event,  # hit / miss / set
+            'k': cache_key[:16],
+            'm': mode,
+            'c': city,
+            'p': [round(lat1, 6), round(lng1, 6), round(lat2, 6), round(lng2, 6)],
+        }
+        if size is not None:
+            record['s'] = size
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+        try:
+            with self._access_log_lock:
+                self._access_log_file.write(line + '\n')
+        except (OSError, ValueError) as e:
+            logger.warning(f"写入缓存访问日志失败: {e}")
+    
     def get(self, lat1, lng1, lat2, lng2, mode='driving', city=None):
         """从缓存获取距离信息"""
         cache_key = self._generate_cache_key(lat1, lng1, lat2, lng2, mode, city)
@@ -293,24 +1587,41 @@ class DistanceCache:
         if cache_key in self.cache:
             cached_data = self.cache[cache_key]
             # 检查缓存是否过期
-            if datetime.now() - cached_data['timestamp'] < self.cache_duration:
+            if datetime.now() - cached_data['timestamp'] < self._entry_duration(cached_data):
                 self.hit_count += 1
                 logger.debug(f"缓存命中: {cache_key[:8]}...")
+                if self._access_log_file is not None:
+                    size = cached_data.get('size')
+                    if size is None:
+                        size = self._payload_size(cached_data['data'])
+                    self._log_access('hit', cache_key, lat1, lng1, lat2, lng2, mode, city, size)
                 return cached_data['data']
             else:
                 # 缓存过期，删除
                 del self.cache[cache_key]
                 
         self.miss_count += 1
+        self._log_access('miss', cache_key, lat1, lng1, lat2, lng2, mode, city)
         return None
     
-    def set(self, lat1, lng1, lat2, lng2, data, mode='driving', city=None):
-        """将距离信息存入缓存"""
+    def _entry_duration(self, entry):
+        """条目的有效期：优先使用条目自带的TTL（秒），否则使用全局有效期"""
+        ttl = entry.get('ttl')
+        return timedelta(seconds=ttl) if ttl else self.cache_duration
+    
+    def set(self, lat1, lng1, lat2, lng2, data, mode='driving', city=None, ttl_seconds=None):
+        """将距离信息存入缓存，ttl_seconds 可为单个条目指定更短的有效期"""
         cache_key = self._generate_cache_key(lat1, lng1, lat2, lng2, mode, city)
         self.cache[cache_key] = {
             'data': data,
             'timestamp': datetime.now()
         }
+        if ttl_seconds:
+            self.cache[cache_key]['ttl'] = ttl_seconds
+        if self._access_log_file is not None:
+            size = self._payload_size(data)
+            self.cache[cache_key]['size'] = size
+            self._log_access('set', cache_key, lat1, lng1, lat2, lng2, mode, city, size)
         logger.debug(f"缓存存储: {cache_key[:8]}...")
         
         # 定期保存到文件（每10次写入保存一次）
@@ -325,7 +1636,7 @@ class DistanceCache:
         # 计算缓存大小
         cache_size_bytes = 0
         try:
-            cache_size_bytes = len(json.dumps(self.cache, default=str).encode('utf-8'))
+            cache_size_bytes = len(json_codec.dumps(self.cache))
         except:
             pass
         
@@ -344,7 +1655,7 @@ class DistanceCache:
         now = datetime.now()
         expired_keys = []
         for key, value in self.cache.items():
-            if now - value['timestamp'] >= self.cache_duration:
+            if now - value['timestamp'] >= self._entry_duration(value):
                 expired_keys.append(key)
         
         for key in expired_keys:
@@ -385,14 +1696,46 @@ class DistanceCache:
             'current_size': len(self.cache)
         }
         
+    def clear_fallback_entries(self):
+        """清除所有备选路线和估算数据的缓存条目，返回清除数量"""
+        keys_to_remove = []
+        
+        # 查找所有包含备选数据的缓存条目
+        for key, value in self.cache.items():
+            if isinstance(value, dict) and 'data' in value:
+                data = value['data']
+                # 公交备选方案缓存的是路线列表，不属于备选/估算数据
+                if not isinstance(data, dict):
+                    continue
+                if (data.get('is_fallback') or 
+                    data.get('mode') in ['driving_fallback', 'unavailable'] or
+                    any(step.get('type') in ['fallback', 'unavailable'] for step in data.get('steps', []))):
+                    keys_to_remove.append(key)
+        
+        # 删除找到的备选数据缓存
+        for key in keys_to_remove:
+            del self.cache[key]
+        
+        return len(keys_to_remove)
+        
     def __del__(self):
         """析构函数，确保缓存在对象销毁时保存"""
         if self.persistent_cache and hasattr(self, 'cache'):
             self._save_cache_to_file()
+        if getattr(self, '_access_log_file', None) is not None:
+            try:
+                self._access_log_file.close()
+            except OSError:
+                pass
 
 # 初始化全局缓存管理器
-distance_cache = DistanceCache(cache_duration_hours=24, persistent_cache=True, cache_file_path="./instance/distance_cache.json")
-amap_manager = AmapAPIManager(app.config.get('AMAP_API_KEY', ''), max_qps=8)  # 降低QPS限制
+distance_cache = DistanceCache(
+    cache_duration_hours=24,
+    persistent_cache=True,
+    cache_file_path="./instance/distance_cache.json",
+    access_log_path=os.environ.get('DISTANCE_CACHE_ACCESS_LOG')  # 设置后记录缓存访问日志
+)
+amap_manager = AmapAPIManager(app.config.get('AMAP_API_KEY', ''), max_qps=8, api_keys=_load_amap_api_keys())  # 每个Key限制8 QPS
 
 class TSPWithCategoriesOptimizer:
     """
@@ -400,7 +1743,8 @@ class TSPWithCategoriesOptimizer:
     解决从每个类别（连锁店品牌）中选择恰好一个节点以最小化总行程长度的问题
     """
     
-    def __init__(self, home_location, chain_categories, private_shops=None, api_key=None, city=None):
+    def __init__(self, home_location, chain_categories, private_shops=None, api_key=None, city=None,
+                 matrix_mode=None, detail_level='full'):
         """
         初始化优化器
         
@@ -410,12 +1754,17 @@ class TSPWithCategoriesOptimizer:
             private_shops: 私人店铺列表（可选）
             api_key: 高德API密钥
             city: 城市名称
+            matrix_mode: 'distance_api' 时驾车矩阵先用距离测量接口构建摘要，'summary' 时路段只请求基本信息（默认 DEFAULT_MATRIX_MODE）
+            detail_level: 'summary' 时不为候选路线获取路线详情
         """
         self.home_location = home_location
         self.chain_categories = chain_categories
         self.private_shops = private_shops or []
         self.api_key = api_key
         self.city = city
+        self.matrix_mode = matrix_mode or DEFAULT_MATRIX_MODE
+        self.detail_level = detail_level
+        self.travel_mode = 'driving'
         
         # 创建所有点的索引映射
         self.all_points = []
@@ -468,8 +1817,11 @@ class TSPWithCategoriesOptimizer:
         try:
             logger.info(f"开始TSP with Categories优化: {len(self.chain_categories)}个品牌, {len(self.all_points)}个总点数")
             
-            # 构建距离矩阵
+            # 构建距离矩阵（有请求截止时间时，获取阶段截止后缺失路段用估算值补齐）
+            self.travel_mode = travel_mode
             cost_matrix = await self._build_cost_matrix(travel_mode)
+            finish_fetch_phase()
+            max_time_seconds = deadline_solver_seconds(max_time_seconds)
             
             # 执行优化算法
             if not self.chain_categories and self.private_shops:
@@ -489,7 +1841,12 @@ class TSPWithCategoriesOptimizer:
                 logger.warning("优化算法返回None，使用后备结果")
                 return self._create_fallback_result()
                 
-            return self._format_result(result, cost_matrix)
+            formatted = self._format_result(result, cost_matrix)
+            formatted['estimated_legs'] = collect_estimated_legs(self.all_points, cost_matrix)
+            deadline = get_request_deadline()
+            if deadline is not None:
+                formatted['deadline'] = deadline.get_stats()
+            return formatted
             
         except Exception as e:
             logger.error(f"TSP with Categories优化失败: {str(e)}", exc_info=True)
@@ -501,8 +1858,12 @@ class TSPWithCategoriesOptimizer:
         cost_matrix = [[None for _ in range(n_points)] for _ in range(n_points)]
         
         # 并行构建距离矩阵
-        tasks = []
-        with ThreadPoolExecutor(max_workers=5) as executor:
+        missing_pairs = []
+        use_summary_matrix = travel_mode == 'driving' and self.matrix_mode == 'distance_api'
+        summary_legs = self.matrix_mode != 'full'  # 矩阵路段只取距离和时间，入选路线的路段在 _format_result 中补充详情
+        summary_cache_mode = 'public_transit_summary' if travel_mode == 'public_transit' else 'driving_summary'
+        # 线程数按并发上限的最大值配置，实际在途请求由 amap_manager.concurrency 自适应约束
+        with ContextThreadPoolExecutor(max_workers=AMAP_MAX_CONCURRENCY) as executor:
             for i in range(n_points):
                 for j in range(i + 1, n_points):
                     p1 = self.all_points[i]
@@ -516,40 +1877,68 @@ class TSPWithCategoriesOptimizer:
                         cache_key, self.city
                     )
                     
+                    if not cached_result and summary_legs:
+                        cached_result = distance_cache.get(
+                            p1['latitude'], p1['longitude'],
+                            p2['latitude'], p2['longitude'],
+                            summary_cache_mode, self.city if travel_mode == 'public_transit' else None
+                        )
+                    
                     if cached_result:
                         cost_matrix[i][j] = cached_result
                         cost_matrix[j][i] = cached_result
                     else:
                         # 需要API调用
-                        if travel_mode == 'public_transit':
-                            task = executor.submit(
-                                get_public_transit_segment_details,
-                                self.api_key, p1['latitude'], p1['longitude'],
-                                p2['latitude'], p2['longitude'], self.city
-                            )
-                        else:
-                            task = executor.submit(
-                                get_driving_route_segment_details,
-                                self.api_key, p1['latitude'], p1['longitude'],
-                                p2['latitude'], p2['longitude']
-                            )
-                        tasks.append((i, j, task))
+                        missing_pairs.append((i, j))
+            
+            all_coords = [(p['latitude'], p['longitude']) for p in self.all_points]
+            
+            # 第一阶段：驾车矩阵只获取距离和时间
+            if use_summary_matrix and missing_pairs:
+                missing_pairs = build_summary_matrix_via_distance_api(executor, self.api_key, all_coords, cost_matrix, missing_pairs)
+            
+            # 路线端点熔断中或获取阶段预算已用完：直接使用估算路段
+            leg_endpoint = 'transit' if travel_mode == 'public_transit' else 'driving'
+            estimate_reason = 'circuit_open' if amap_manager.is_circuit_open(leg_endpoint) else 'deadline' if fetch_deadline_reached() else None
+            if missing_pairs and estimate_reason:
+                logger.warning(f"{leg_endpoint}路段使用直线距离估算（{estimate_reason}）: {len(missing_pairs)}个")
+                for i, j in missing_pairs:
+                    estimated = build_estimated_leg(*all_coords[i], *all_coords[j], travel_mode, estimate_reason)
+                    cost_matrix[i][j] = estimated
+                    cost_matrix[j][i] = estimated
+                missing_pairs = []
+            
+            # 未命中的路段合并为批量请求
+            legs = [
+                (self.all_points[i]['latitude'], self.all_points[i]['longitude'],
+                 self.all_points[j]['latitude'], self.all_points[j]['longitude'])
+                for i, j in missing_pairs
+            ]
+            leg_futures = submit_route_legs(executor, self.api_key, legs, travel_mode, self.city, summary_only=summary_legs)
+            tasks = [(i, j, task) for (i, j), task in zip(missing_pairs, leg_futures)]
             
             # 等待所有API调用完成
             for i, j, task in tasks:
                 try:
-                    result = task.result(timeout=30)
+                    result, deadline_reached = wait_for_leg(task, timeout=30)
+                    if deadline_reached:
+                        # 获取阶段预算用完：用估算值补齐，直接开始求解
+                        estimated = build_estimated_leg(*all_coords[i], *all_coords[j], travel_mode, 'deadline')
+                        cost_matrix[i][j] = estimated
+                        cost_matrix[j][i] = estimated
+                        continue
                     if result:
                         cost_matrix[i][j] = result
                         cost_matrix[j][i] = result
                         
-                        # 缓存结果
-                        cache_key = travel_mode if travel_mode != 'public_transit' else f'public_transit_{self.city}'
-                        distance_cache.set(
-                            self.all_points[i]['latitude'], self.all_points[i]['longitude'],
-                            self.all_points[j]['latitude'], self.all_points[j]['longitude'],
-                            result, cache_key, self.city
-                        )
+                        # 缓存结果（摘要条目已由查询函数缓存在摘要键下，不能写入完整路线的键）
+                        if not result.get('summary_only'):
+                            cache_key = travel_mode if travel_mode != 'public_transit' else f'public_transit_{self.city}'
+                            distance_cache.set(
+                                self.all_points[i]['latitude'], self.all_points[i]['longitude'],
+                                self.all_points[j]['latitude'], self.all_points[j]['longitude'],
+                                result, cache_key, self.city
+                            )
                     else:
                         # 使用直线距离作为备选
                         distance = calculate_haversine_distance(
@@ -1214,6 +2603,7 @@ class TSPWithCategoriesOptimizer:
         distance_ranked_candidates = sorted(selected_candidates, key=lambda x: x.get('total_distance_cost', float('inf')))
 
         seen_routes = set()
+        pending_legs = {}  # 只有摘要信息的路段，多条候选路线共享时只请求一次
 
         def format_candidate(candidate, optimization_type, rank):
             route_indices = candidate['route_indices']
@@ -1252,6 +2642,14 @@ class TSPWithCategoriesOptimizer:
                 }
                 if 'segments' in segment_info:
                     segment_data['transit_segments'] = segment_info['segments']
+                if segment_info.get('is_estimated'):
+                    segment_data['is_estimated'] = True
+                    segment_data['estimate_reason'] = segment_info.get('estimate_reason')
+                if segment_info.get('summary_only'):
+                    segment_data['summary_only'] = True
+                    p1, p2 = self.all_points[from_idx], self.all_points[to_idx]
+                    leg = (p1['latitude'], p1['longitude'], p2['latitude'], p2['longitude'])
+                    pending_legs.setdefault(leg, []).append(segment_data)
                 route_segments.append(segment_data)
 
             total_travel_time = candidate['total_time_cost']
@@ -1285,6 +2683,11 @@ class TSPWithCategoriesOptimizer:
             if formatted:
                 route_candidates_list.append(formatted)
 
+        # 第二阶段：只为入选候选路线的路段获取路线详情
+        if pending_legs and self.detail_level != 'summary':
+            with ContextThreadPoolExecutor(max_workers=AMAP_MAX_CONCURRENCY) as executor:
+                enrich_route_segments(executor, self.api_key, pending_legs, self.travel_mode, self.city)
+
         return {
             'success': True,
             'routes': route_candidates_list,
@@ -1716,50 +3119,322 @@ class TSPOptimizer:
             logger.info("使用启发式+2-opt算法（>25个店铺）")
             return self._heuristic_tsp_solution(list(range(1, self.num_points)))
 
-@amap_api_handler("geocode_address")
-def geocode_address(api_key, address, city=None):
+# --- Geocode Cache ---
+GEOCODE_CACHE_TTL_DAYS = int(os.environ.get('GEOCODE_CACHE_TTL_DAYS', '90'))
+GEOCODE_BATCH_SIZE = 10  # 高德地理编码批量模式（batch=true）单次最多10个地址
+GEOCODE_BATCH_MAX_ADDRESSES = 200  # /api/geocode/batch 单次请求允许的最多地址数
+
+def normalize_geocode_address(address):
+    """地理编码缓存键：全角转半角、去掉空白、英文小写"""
+    return re.sub(r'\s+', '', unicodedata.normalize('NFKC', address or '')).lower()
+
+class GeocodeCache:
     """
-    安全的地理编码函数，带重试和QPS控制
+    地理编码持久化缓存，存储在数据库表 geocode_cache_entry 中，
+    以 (规范化地址, 城市) 为键，跨用户、跨会话、跨进程重启复用。
+    只缓存成功的结果，地址写错的请求下次仍会重新解析。
+    读写使用独立的数据库会话，不会提交或回滚调用方（视图函数）的 db.session 中未提交的修改。
     """
-    if not api_key or not address:
+    
+    def __init__(self, ttl_days=GEOCODE_CACHE_TTL_DAYS):
+        self.ttl = timedelta(days=ttl_days)
+        self.lock = threading.Lock()
+        self.stats = defaultdict(int)
+    
+    def _record(self, name, count=1):
+        with self.lock:
+            self.stats[name] += count
+    
+    @contextmanager
+    def _session(self):
+        """独立的数据库会话；后台线程中调用时没有应用上下文，需要临时推入"""
+        if has_app_context():
+            with SQLAlchemySession(db.engine) as session:
+                yield session
+        else:
+            with app.app_context(), SQLAlchemySession(db.engine) as session:
+                yield session
+    
+    def get_many(self, keys, city=''):
+        """批量查询，返回 {规范化地址: 结果}；数据库异常时视为未命中"""
+        if not keys:
+            return {}
+        cutoff = datetime.utcnow() - self.ttl
+        found = {}
+        try:
+            with self._session() as session:
+                entries = session.query(GeocodeCacheEntry).filter(
+                    GeocodeCacheEntry.city == city,
+                    GeocodeCacheEntry.address_key.in_(list(keys)),
+                    GeocodeCacheEntry.updated_at >= cutoff
+                ).all()
+                for entry in entries:
+                    found[entry.address_key] = {
+                        'latitude': entry.latitude,
+                        'longitude': entry.longitude,
+                        'formatted_address': entry.formatted_address
+                    }
+        except SQLAlchemyError as e:
+            logger.warning(f"读取地理编码缓存失败: {e}")
+        self._record('hits', len(found))
+        self._record('misses', len(set(keys)) - len(found))
+        return found
+    
+    def set_many(self, results, city=''):
+        """写入 {规范化地址: 结果}，已存在的条目就地更新"""
+        if not results:
+            return
+        now = datetime.utcnow()
+        with self._session() as session:
+            try:
+                existing = {
+                    entry.address_key: entry
+                    for entry in session.query(GeocodeCacheEntry).filter(
+                        GeocodeCacheEntry.city == city,
+                        GeocodeCacheEntry.address_key.in_(list(results))
+                    ).all()
+                }
+                for key, result in results.items():
+                    entry = existing.get(key)
+                    if entry is None:
+                        entry = GeocodeCacheEntry(address_key=key, city=city)
+                        session.add(entry)
+                    entry.latitude = result['latitude']
+                    entry.longitude = result['longitude']
+                    entry.formatted_address = result.get('formatted_address')
+                    entry.updated_at = now
+                session.commit()
+                self._record('stored', len(results))
+            except SQLAlchemyError as e:
+                # 并发写入同一地址时唯一约束冲突，丢弃本次写入即可
+                session.rollback()
+                logger.warning(f"写入地理编码缓存失败: {e}")
+    
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        stats['hit_rate'] = round(stats.get('hits', 0) / lookups * 100, 2) if lookups else 0.0
+        return stats
+
+geocode_cache = GeocodeCache()
+
+def _parse_geocode_info(geocode_info):
+    """解析单条 geocodes 记录；批量模式下解析失败的地址 location 为空"""
+    location_str = geocode_info.get("location")
+    if not location_str or not isinstance(location_str, str):
         return None
+    lon, lat = map(float, location_str.split(','))
+    formatted_address = geocode_info.get("formatted_address")
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "formatted_address": formatted_address if isinstance(formatted_address, str) else None
+    }
+
+def _request_geocode_batch(api_key, addresses, city=None):
+    """
+    一次高德请求解析最多 GEOCODE_BATCH_SIZE 个地址，返回与输入对齐的结果列表。
+    单个地址时使用普通模式；批量返回条数与输入不一致时无法对齐，改为逐个请求。
+    """
     url = "https://restapi.amap.com/v3/geocode/geo"
     params = {
         "key": api_key,
-        "address": address,
+        "address": addresses[0] if len(addresses) == 1 else '|'.join(addresses),
     }
+    if len(addresses) > 1:
+        params["batch"] = "true"
     if city:
         params["city"] = city
-    try:
-        response = amap_manager.safe_request(url, params=params, timeout=15)
-        data = response.json()
-        if data.get("status") == "1" and data.get("geocodes"):
-            geocode_info = data["geocodes"][0]
-            location_str = geocode_info.get("location")
-            if location_str:
-                lon, lat = map(float, location_str.split(','))
-                return {
-                    "latitude": lat,
-                    "longitude": lon,
-                    "formatted_address": geocode_info.get("formatted_address")
-                }
+    response = amap_manager.safe_request(url, params=params, endpoint='geocode')
+    data = parse_amap_json(response)
+    if data.get("status") != "1":
+        logger.warning(f"地理编码失败: {data.get('info')} for address: {params['address']}")
+        return [None] * len(addresses)
+    geocodes = data.get("geocodes") or []
+    if len(addresses) == 1:
+        geocodes = geocodes[:1]
+    elif len(geocodes) != len(addresses):
+        logger.warning(f"批量地理编码返回{len(geocodes)}条，请求{len(addresses)}条，改为逐个解析")
+        return [_request_geocode_batch(api_key, [address], city)[0] for address in addresses]
+    results = []
+    for address, geocode_info in zip(addresses, geocodes):
+        try:
+            results.append(_parse_geocode_info(geocode_info))
+        except ValueError:
+            logger.warning(f"地理编码响应解析错误: {address}")
+            results.append(None)
+    return results or [None]
+
+def geocode_addresses(api_key, addresses, city=None):
+    """
+    批量地理编码，返回与 addresses 对齐的结果列表（失败为None）。
+    先查持久化缓存，未命中的地址去重后按 GEOCODE_BATCH_SIZE 分批请求高德，成功结果写回缓存。
+    某一批请求失败只影响该批地址。
+    """
+    if not api_key or not addresses:
+        return [None] * len(addresses or [])
+    city_key = (city or '').strip()
+    keys = [normalize_geocode_address(address) for address in addresses]
+    resolved = geocode_cache.get_many({key for key in keys if key}, city_key)
+    
+    pending = {}  # 规范化地址 -> 原始地址（保留用户输入形式发给高德）
+    for key, address in zip(keys, addresses):
+        if key and key not in resolved and key not in pending:
+            pending[key] = address.strip()
+    
+    fetched = {}
+    pending_items = list(pending.items())
+    for start in range(0, len(pending_items), GEOCODE_BATCH_SIZE):
+        chunk = pending_items[start:start + GEOCODE_BATCH_SIZE]
+        try:
+            chunk_results = _request_geocode_batch(api_key, [address for _, address in chunk], city)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"地理编码请求失败: {e}")
+            continue
+        for (key, _), result in zip(chunk, chunk_results):
+            if result:
+                fetched[key] = result
+    
+    geocode_cache.set_many(fetched, city_key)
+    resolved.update(fetched)
+    return [dict(resolved[key]) if key in resolved else None for key in keys]
+
+@amap_api_handler("geocode_address")
+def geocode_address(api_key, address, city=None):
+    """
+    安全的地理编码函数，带持久化缓存、重试和QPS控制
+    """
+    if not api_key or not address:
+        return None
+    return geocode_addresses(api_key, [address], city)[0]
+
+def _build_driving_params(api_key, origin_lat, origin_lng, dest_lat, dest_lng, strategy=5, departure_time=None, summary_only=False):
+    """构造驾车路线规划请求参数；summary_only 时使用 extensions=base 只取基本信息"""
+    params = {
+        "key": api_key,
+        "origin": f"{origin_lng},{origin_lat}",
+        "destination": f"{dest_lng},{dest_lat}",
+        "strategy": str(strategy),
+        "extensions": "base" if summary_only else "all",  # 修复：使用"all"获取详细的路线指导信息
+        "waypoints": "",  # 空的途经点
+    }
+    
+    # 添加实时路况支持
+    if departure_time:
+        # departure_time 格式: 'YYYY-MM-DD HH:MM:SS' 或时间戳
+        if isinstance(departure_time, str):
+            try:
+                departure_dt = datetime.strptime(departure_time, '%Y-%m-%d %H:%M:%S')
+                params["departure_time"] = int(departure_dt.timestamp())
+            except ValueError:
+                try:
+                    params["departure_time"] = int(departure_time)
+                except ValueError:
+                    logger.warning(f"无效的出发时间格式: {departure_time}")
         else:
-            logger.warning(f"地理编码失败: {data.get('info')} for address: {address}")
+            params["departure_time"] = int(departure_time)
+    return params
+
+def _parse_driving_route_response(data, departure_time=None):
+    """解析驾车路线规划响应，失败返回None"""
+    if data.get("status") == "1" and data.get("route") and data["route"].get("paths"):
+        path = data["route"]["paths"][0]
+        
+        # 处理驾车详细步骤
+        driving_steps = []
+        if path.get("steps"):
+            for step in path["steps"]:
+                instruction = step.get("instruction", "")
+                road_name = step.get("road", "")
+                distance = step.get("distance", "")
+                duration = step.get("duration", "")
+                action = step.get("action", "")
+                
+                # 构建更详细的指导文本
+                if instruction and road_name:
+                    detailed_instruction = f"{instruction}，沿{road_name}行驶"
+                elif instruction:
+                    detailed_instruction = instruction
+                elif road_name:
+                    detailed_instruction = f"沿{road_name}行驶"
+                else:
+                    detailed_instruction = action or "继续行驶"
+                
+                # 添加距离和时间信息
+                if distance:
+                    detailed_instruction += f"（{distance}米"
+                    if duration:
+                        detailed_instruction += f"，约{int(float(duration)/60)}分钟"
+                    detailed_instruction += "）"
+                
+                driving_steps.append({
+                    "type": "driving",
+                    "instruction": detailed_instruction,
+                    "action": action,
+                    "road": road_name,
+                    "distance": distance,
+                    "duration": duration
+                })
+        
+        return {
+            "distance": int(path.get("distance", 0)),
+            "duration": int(path.get("duration", 0)),
+            "polyline": path.get("polyline", ""),
+            "steps": driving_steps,  # 使用处理后的详细步骤
+            "traffic_lights": path.get("traffic_lights", 0),  # 红绿灯数量
+            "restriction": path.get("restriction", 0),  # 限行信息
+            "has_real_time": departure_time is not None,  # 是否使用实时路况
+            "tolls": path.get("tolls", 0),  # 过路费
+            "toll_distance": path.get("toll_distance", 0),  # 收费路段距离
+            "restrictions": path.get("restrictions", [])  # 限行信息
+        }
+    
+    error_msg = data.get('info', '未知错误')
+    logger.warning(f"路线规划失败: {error_msg}")
+    return None
+
+def _parse_route_summary(data, mode, origin=None):
+    """
+    从 extensions=base 的响应中只取首条方案的距离、时间（公交另含费用和步行距离），不解析步骤和折线。
+    结果带 summary_only 标记，选中展示时再获取完整路线。
+    """
+    route = data.get("route") if data.get("status") == "1" else None
+    if mode == 'public_transit':
+        if not route or not route.get("transits"):
             return None
-    except requests.exceptions.Timeout:
-        logger.error(f"地理编码请求超时: {address}")
-        raise
-    except requests.exceptions.RequestException as e:
-        logger.error(f"地理编码请求失败: {e}")
-        raise
-    except (ValueError, KeyError) as e:
-        logger.error(f"地理编码响应解析错误: {e}")
+        path = route["transits"][0]
+        summary = {
+            "distance": int(path.get("distance", 0)),
+            "duration": int(path.get("duration", 0)),
+            "polyline": "",
+            "steps": [],
+            "segments": [],  # 保留该键，下游据此识别为公交路段
+            "cost": float(path.get("cost") or 0),
+            "walking_distance": int(path.get("walking_distance", 0)),
+            "nightflag": path.get("nightflag", "0"),
+            "railway_flag": path.get("railway_flag", "0"),
+            "summary_only": True
+        }
+        if origin:
+            summary["origin"] = origin
+        return summary
+    if not route or not route.get("paths"):
         return None
+    path = route["paths"][0]
+    return {
+        "distance": int(path.get("distance", 0)),
+        "duration": int(path.get("duration", 0)),
+        "polyline": "",
+        "steps": [],
+        "summary_only": True
+    }
 
 @amap_api_handler("get_driving_route_segment_details")
-def get_driving_route_segment_details(api_key, origin_lat, origin_lng, dest_lat, dest_lng, strategy=5, departure_time=None):
+def get_driving_route_segment_details(api_key, origin_lat, origin_lng, dest_lat, dest_lng, strategy=5, departure_time=None, summary_only=False):
     """
     安全的驾车路线查询函数，支持缓存和实时路况
+    summary_only=True 时只请求基本信息（extensions=base），结果缓存为摘要条目；已有完整结果时直接复用
     """
     if not api_key:
         return None
@@ -1769,99 +3444,32 @@ def get_driving_route_segment_details(api_key, origin_lat, origin_lng, dest_lat,
     cached_result = distance_cache.get(origin_lat, origin_lng, dest_lat, dest_lng, f'driving{cache_key_suffix}')
     if cached_result:
         return cached_result
+    if summary_only:
+        cached_result = distance_cache.get(origin_lat, origin_lng, dest_lat, dest_lng, f'driving_summary{cache_key_suffix}')
+        if cached_result:
+            return cached_result
     
     # 缓存未命中，调用API
     @amap_api_handler("get_public_transit_segment_details")
-    def _api_call():
-        url = "https://restapi.amap.com/v3/direction/driving"
-        params = {
-            "key": api_key,
-            "origin": f"{origin_lng},{origin_lat}",
-            "destination": f"{dest_lng},{dest_lat}",
-            "strategy": str(strategy),
-            "extensions": "all",  # 修复：使用"all"获取详细的路线指导信息
-            "waypoints": "",  # 空的途经点
-        }
-        
-        # 添加实时路况支持
-        if departure_time:
-            # departure_time 格式: 'YYYY-MM-DD HH:MM:SS' 或时间戳
-            if isinstance(departure_time, str):
-                try:
-                    departure_dt = datetime.strptime(departure_time, '%Y-%m-%d %H:%M:%S')
-                    params["departure_time"] = int(departure_dt.timestamp())
-                except ValueError:
-                    try:
-                        params["departure_time"] = int(departure_time)
-                    except ValueError:
-                        logger.warning(f"无效的出发时间格式: {departure_time}")
-            else:
-                params["departure_time"] = int(departure_time)
+    def _api_call():
+        url = "https://restapi.amap.com/v3/direction/driving"
+        params = _build_driving_params(api_key, origin_lat, origin_lng, dest_lat, dest_lng, strategy, departure_time, summary_only)
         
         try:
-            response = requests.get(url, params=params, timeout=15)
+            response = amap_manager.request('driving', url, params=params)
             response.raise_for_status()
-            data = response.json()
-            if data.get("status") == "1" and data.get("route") and data["route"].get("paths"):
-                path = data["route"]["paths"][0]
-                
-                # 处理驾车详细步骤
-                driving_steps = []
-                if path.get("steps"):
-                    for step in path["steps"]:
-                        instruction = step.get("instruction", "")
-                        road_name = step.get("road", "")
-                        distance = step.get("distance", "")
-                        duration = step.get("duration", "")
-                        action = step.get("action", "")
-                        
-                        # 构建更详细的指导文本
-                        if instruction and road_name:
-                            detailed_instruction = f"{instruction}，沿{road_name}行驶"
-                        elif instruction:
-                            detailed_instruction = instruction
-                        elif road_name:
-                            detailed_instruction = f"沿{road_name}行驶"
-                        else:
-                            detailed_instruction = action or "继续行驶"
-                        
-                        # 添加距离和时间信息
-                        if distance:
-                            detailed_instruction += f"（{distance}米"
-                            if duration:
-                                detailed_instruction += f"，约{int(float(duration)/60)}分钟"
-                            detailed_instruction += "）"
-                        
-                        driving_steps.append({
-                            "type": "driving",
-                            "instruction": detailed_instruction,
-                            "action": action,
-                            "road": road_name,
-                            "distance": distance,
-                            "duration": duration
-                        })
-                
-                result = {
-                    "distance": int(path.get("distance", 0)),
-                    "duration": int(path.get("duration", 0)),
-                    "polyline": path.get("polyline", ""),
-                    "steps": driving_steps,  # 使用处理后的详细步骤
-                    "traffic_lights": path.get("traffic_lights", 0),  # 红绿灯数量
-                    "restriction": path.get("restriction", 0),  # 限行信息
-                    "has_real_time": departure_time is not None,  # 是否使用实时路况
-                    "tolls": path.get("tolls", 0),  # 过路费
-                    "toll_distance": path.get("toll_distance", 0),  # 收费路段距离
-                    "restrictions": path.get("restrictions", [])  # 限行信息
-                }
-                
+            data = parse_amap_json(response)
+            if summary_only:
+                result = _parse_route_summary(data, 'driving')
+                if result:
+                    distance_cache.set(origin_lat, origin_lng, dest_lat, dest_lng, result, f'driving_summary{cache_key_suffix}')
+                return result
+            result = _parse_driving_route_response(data, departure_time)
+            if result:
                 # 将结果存入缓存（实时路况的缓存时间较短）
                 cache_mode = f'driving{cache_key_suffix}'
                 distance_cache.set(origin_lat, origin_lng, dest_lat, dest_lng, result, cache_mode)
-                return result
-            else:
-                error_msg = data.get('info', '未知错误')
-                logger.warning(f"路线规划失败: {error_msg}")
-                return None
+            return result
         except requests.exceptions.Timeout:
             logger.error("路线规划请求超时")
             raise
@@ -1899,6 +3507,18 @@ class Trip(db.Model):
 
     user = db.relationship('User', backref=db.backref('trips', lazy=True))
 
+class GeocodeCacheEntry(db.Model):
+    """地理编码持久化缓存，见 GeocodeCache"""
+    id = db.Column(db.Integer, primary_key=True)
+    address_key = db.Column(db.String(255), nullable=False)  # normalize_geocode_address 的结果
+    city = db.Column(db.String(100), nullable=False, default='')
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    formatted_address = db.Column(db.String(255), nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (db.UniqueConstraint('address_key', 'city', name='uq_geocode_address_city'),)
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -1906,20 +3526,141 @@ def load_user(user_id):
 # --- Amap API Utility Functions ---
 # geocode_address function has been replaced with the safe version above
 
-@amap_api_handler("search_poi")
-def search_poi(api_key, keywords, city=None, location=None, radius=5000, types=None, max_results=25):
+POI_PAGE_SIZE = 25  # 高德关键字搜索每页最多25条
+POI_MAX_PAGES = 5   # 最多获取5页避免无限翻页
+POI_CACHE_TTL = int(os.environ.get('POI_CACHE_TTL', '3600'))  # 秒
+POI_CACHE_MAX_ENTRIES = 2000
+
+class POISearchCache:
     """
-    Searches for POIs using Amap Place Text Search API.
-    Returns a list of POI dictionaries or None.
+    关键字搜索结果缓存，键为 (关键字, 城市, 类型)，带TTL。
+    /v3/place/text 不按 location/radius 过滤结果，同样的关键字、城市和类型在任何位置得到的结果集相同，
+    因此缓存也不区分位置和半径，命中时按高德原始顺序返回。
+    被截断的条目（max_results 或分页上限）只能满足不超过其 max_results 的请求。
+    """
+    
+    def __init__(self, ttl_seconds=POI_CACHE_TTL, max_entries=POI_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> entry
+        self.lock = threading.Lock()
+        self.stats = defaultdict(int)
+    
+    @staticmethod
+    def _key(keywords, city, types):
+        keywords = '|'.join(
+            re.sub(r'\s+', ' ', unicodedata.normalize('NFKC', part)).strip().lower()
+            for part in keywords.split('|')
+        )
+        types = '|'.join(sorted(t.strip() for t in str(types).split('|') if t.strip())) if types else ''
+        return (keywords, (city or '').strip(), types)
+    
+    @staticmethod
+    def _limit(pois, max_results):
+        """与 iter_search_poi 一致：有效坐标的POI达到 max_results 条为止"""
+        limited = []
+        valid_count = 0
+        for poi in pois:
+            limited.append(dict(poi))
+            if poi['latitude'] is not None and poi['longitude'] is not None:
+                valid_count += 1
+                if valid_count >= max_results:
+                    break
+        return limited
+    
+    def get(self, keywords, city, types, max_results):
+        """返回缓存的POI列表（副本），无法复用时返回None"""
+        key = self._key(keywords, city, types)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['expires_at'] <= now:
+                del self.entries[key]
+                entry = None
+            if entry and (entry['complete'] or entry['max_results'] >= max_results):
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return self._limit(entry['pois'], max_results)
+            self.stats['misses'] += 1
+            return None
+    
+    def set(self, keywords, city, types, max_results, pois, complete):
+        """complete 表示高德已无更多结果（结果集未被截断）"""
+        key = self._key(keywords, city, types)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = {
+                'pois': [dict(poi) for poi in pois],
+                'max_results': max_results,
+                'complete': complete,
+                'expires_at': time.monotonic() + self.ttl_seconds
+            }
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.stats['stored'] += 1
+    
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+        lookups = stats.get('hits', 0) + stats.get('misses', 0)
+        stats['hit_rate'] = round(stats.get('hits', 0) / lookups * 100, 2) if lookups else 0.0
+        return stats
+
+poi_search_cache = POISearchCache()
+
+
+def _format_poi(poi):
+    """将高德POI转换为统一的字典格式"""
+    lon, lat = None, None
+    if poi.get("location"):
+        try:
+            lon, lat = map(float, poi["location"].split(','))
+        except ValueError:
+            pass # Could not parse location
+
+    return {
+        "id": poi.get("id"),
+        "name": poi.get("name"),
+        "type": poi.get("type"),
+        "typecode": poi.get("typecode"),
+        "address": poi.get("address"),
+        "latitude": lat,
+        "longitude": lon,
+        "tel": poi.get("tel"),
+        "distance": poi.get("distance"), # if location is provided
+        "business_area": poi.get("business_area"),  # 商圈信息
+        "province": poi.get("province"),  # 省份
+        "city": poi.get("city"),  # 城市
+        "district": poi.get("district"),  # 区县
+        "adname": poi.get("adname"),  # 行政区名称
+        "rating": poi.get("rating"),  # 评分
+        "cost": poi.get("cost"),  # 人均消费
+        "indoor_map": poi.get("indoor_map"),  # 是否有室内地图
+        "photos": poi.get("photos", [])  # 照片信息
+    }
+
+def _fetch_poi_page(url, params, page):
+    """获取关键字搜索的单页结果，返回原始响应数据"""
+    page_params = dict(params, page=page)
+    response = amap_manager.request('place', url, params=page_params)
+    response.raise_for_status()
+    return parse_amap_json(response)
+
+def _iter_search_poi_remote(api_key, keywords, city=None, location=None, radius=5000, types=None, max_results=25,
+                            require_complete=False):
+    """
+    iter_search_poi 的高德请求部分，生成器的返回值表示结果集状态：
+    'exhausted' 高德已无更多结果，'limit' 达到 max_results 或分页上限，
+    'partial' 分页请求失败只拿到部分结果，'error' 首页请求失败，
+    'truncated' 设置了 require_complete 且首页的 count 表明结果会被截断（不产出任何结果，也不再请求后续页）。
     """
-    if not api_key or not keywords:
-        return None
 
     url = "https://restapi.amap.com/v3/place/text"
     params = {
         "key": api_key,
         "keywords": keywords,
-        "offset": 25, # Number of results per page (max 25)
+        "offset": POI_PAGE_SIZE, # Number of results per page (max 25)
         "page": 1,
     }
     if city:
@@ -1931,84 +3672,117 @@ def search_poi(api_key, keywords, city=None, location=None, radius=5000, types=N
         params["types"] = types
 
     try:
-        response = requests.get(url, params=params, timeout=5)
-        response.raise_for_status()
-        data = response.json()
-
-        # 处理和转换数据格式 - 修复逻辑
-        if data.get("status") == "1" and data.get("pois"):
-            all_pois = data["pois"]
-            offset = 25  # 默认每页25个结果
-            
-            # 如果需要更多结果且当前结果数量达到了offset限制，尝试获取更多页面
-            if len(all_pois) >= offset and len(all_pois) < max_results:
-                page = 2
-                while len(all_pois) < max_results and page <= 5:  # 最多获取5页避免无限循环
-                    try:
-                        paginated_params = params.copy()
-                        paginated_params['page'] = page
-                        paginated_response = requests.get(url, params=paginated_params, timeout=5)
-                        paginated_response.raise_for_status()
-                        paginated_data = paginated_response.json()
-                        
-                        if paginated_data.get("status") == "1" and paginated_data.get("pois"):
-                            current_pois = paginated_data["pois"]
-                            all_pois.extend(current_pois)
-                            
-                            # 如果返回的结果少于offset，说明没有更多数据了
-                            if len(current_pois) < offset:
-                                break
-                        else:
-                            break
-                        page += 1
-                        time.sleep(0.05)  # 分页请求间隔
-                    except requests.exceptions.RequestException:
-                        break  # 分页请求失败，使用已获取的结果
-            
-            # 处理和转换数据格式
-            if all_pois:
-                pois_data = []
-                for poi in all_pois[:max_results]:  # 限制最终返回数量
-                    lon, lat = None, None
-                    if poi.get("location"):
-                        try:
-                            lon, lat = map(float, poi["location"].split(','))
-                        except ValueError:
-                            pass # Could not parse location
-
-                    pois_data.append({
-                        "id": poi.get("id"),
-                        "name": poi.get("name"),
-                        "type": poi.get("type"),
-                        "typecode": poi.get("typecode"),
-                        "address": poi.get("address"),
-                        "latitude": lat,
-                        "longitude": lon,
-                        "tel": poi.get("tel"),
-                        "distance": poi.get("distance"), # if location is provided
-                        "business_area": poi.get("business_area"),  # 商圈信息
-                        "province": poi.get("province"),  # 省份
-                        "city": poi.get("city"),  # 城市
-                        "district": poi.get("district"),  # 区县
-                        "adname": poi.get("adname"),  # 行政区名称
-                        "rating": poi.get("rating"),  # 评分
-                        "cost": poi.get("cost"),  # 人均消费
-                        "indoor_map": poi.get("indoor_map"),  # 是否有室内地图
-                        "photos": poi.get("photos", [])  # 照片信息
-                    })
-                return pois_data
-            else:
-                logger.warning(f"Amap POI Search Error: No POIs found for keywords: {keywords}")
-                return None
-        else:
-            logger.warning(f"Amap POI Search Error: {data.get('info')} for keywords: {keywords}")
-            return None
+        data = _fetch_poi_page(url, params, 1)
     except requests.exceptions.RequestException as e:
         logger.error(f"Amap POI Search request failed: {e}")
-        return None
-    except (ValueError, KeyError) as e:
+        return 'error'
+    except ValueError as e:
         logger.error(f"Error parsing Amap POI Search response: {e}")
-        return None
+        return 'error'
+
+    if data.get("status") != "1" or not data.get("pois"):
+        logger.warning(f"Amap POI Search Error: {data.get('info')} for keywords: {keywords}")
+        return 'exhausted' if data.get("status") == "1" else 'error'
+
+    try:
+        total_count = int(data.get("count", 0))
+    except (TypeError, ValueError):
+        total_count = 0
+    total_pages = min(POI_MAX_PAGES, -(-total_count // POI_PAGE_SIZE)) if total_count else 1
+    if require_complete and total_count >= max_results:
+        logger.info(f"POI搜索 {keywords}: 共{total_count}个结果，超过 {max_results}，不再请求后续页")
+        return 'truncated'
+
+    valid_count = 0
+    def _consume(pois):
+        nonlocal valid_count
+        for poi in pois:
+            formatted = _format_poi(poi)
+            if formatted["latitude"] is not None and formatted["longitude"] is not None:
+                valid_count += 1
+            yield formatted
+            if valid_count >= max_results:
+                return
+
+    yield from _consume(data["pois"])
+    if valid_count >= max_results:
+        return 'limit'
+    if len(data["pois"]) < POI_PAGE_SIZE:
+        return 'exhausted'
+
+    # 先并发获取凑够 max_results 所需的页数；若无效坐标导致不足，再逐页补充
+    pages_needed = min(total_pages, -(-max_results // POI_PAGE_SIZE))
+    futures = {
+        page: amap_manager.page_executor.submit(_fetch_poi_page, url, params, page)
+        for page in range(2, pages_needed + 1)
+    }
+    try:
+        for page in range(2, total_pages + 1):
+            future = futures.get(page) or amap_manager.page_executor.submit(_fetch_poi_page, url, params, page)
+            try:
+                page_data = future.result(timeout=deadline_timeout(30))
+            except (requests.exceptions.RequestException, ValueError, concurrent.futures.TimeoutError) as e:
+                logger.warning(f"POI分页请求失败（第{page}页），使用已获取的结果: {e}")
+                return 'partial'
+            pois = page_data.get("pois") if page_data.get("status") == "1" else None
+            if not pois:
+                return 'exhausted' if page_data.get("status") == "1" else 'partial'
+            yield from _consume(pois)
+            if valid_count >= max_results:
+                return 'limit'
+            # 如果返回的结果少于每页数量，说明没有更多数据了
+            if len(pois) < POI_PAGE_SIZE:
+                return 'exhausted'
+    finally:
+        # 提前结束（或调用方停止迭代）时取消尚未开始的分页请求
+        for future in futures.values():
+            future.cancel()
+    return 'limit' if total_count > total_pages * POI_PAGE_SIZE else 'exhausted'
+
+def iter_search_poi(api_key, keywords, city=None, location=None, radius=5000, types=None, max_results=25,
+                    require_complete=False):
+    """
+    流式关键字搜索：按页序逐条产出格式化后的POI，调用方可以边接收边排序。
+    先查 poi_search_cache；未命中时第1页返回总数 count 后，其余页面在分页专用线程池中并发获取（仍受限流器约束），
+    拿到 max_results 条有效坐标的结果后立即停止，未开始的分页请求会被取消。
+    完整消费且请求成功的结果写入缓存。
+    require_complete 为 True 时只接受完整的结果集：缓存中被截断的条目不复用，
+    首页 count 表明结果会达到 max_results 时不产出任何结果，也不再请求后续页。
+    """
+    if not api_key or not keywords:
+        return
+
+    cached = poi_search_cache.get(keywords, city, types, max_results)
+    if cached is not None and not (require_complete and len(cached) >= max_results):
+        yield from cached
+        return
+
+    collected = []
+    remote = _iter_search_poi_remote(api_key, keywords, city, location, radius, types, max_results, require_complete)
+    try:
+        while True:
+            try:
+                poi = next(remote)
+            except StopIteration as stop:
+                outcome = stop.value
+                break
+            collected.append(poi)
+            yield poi
+    finally:
+        remote.close()
+    if outcome in ('exhausted', 'limit'):
+        poi_search_cache.set(keywords, city, types, max_results, collected, outcome == 'exhausted')
+
+
+@amap_api_handler("search_poi")
+def search_poi(api_key, keywords, city=None, location=None, radius=5000, types=None, max_results=25,
+               require_complete=False):
+    """
+    Searches for POIs using Amap Place Text Search API.
+    Returns a list of POI dictionaries or None.
+    """
+    pois_data = list(iter_search_poi(api_key, keywords, city, location, radius, types, max_results, require_complete))
+    return pois_data or None
 
 def _parse_transit_polyline(transit_details):
     """
@@ -2214,10 +3988,39 @@ def _parse_transit_details(transit_segments):
     return detailed_steps
 
 
+def _build_transit_params(api_key, origin_lat, origin_lng, dest_lat, dest_lng, city, strategy=0, summary_only=False):
+    """构造公交路线规划请求参数；summary_only 时使用 extensions=base 只取基本信息"""
+    return {
+        "key": api_key,
+        "origin": f"{origin_lng},{origin_lat}",
+        "destination": f"{dest_lng},{dest_lat}",
+        "city": str(city),
+        "strategy": str(strategy),
+        "extensions": "base" if summary_only else "all",
+    }
+
+def _build_transit_result(transit_path, origin=None):
+    """将高德返回的单条公交方案转换为路段结果，origin（"lng,lat"）记录查询方向"""
+    result = {
+        "distance": int(transit_path.get("distance", 0)),
+        "duration": int(transit_path.get("duration", 0)),
+        "polyline": _parse_transit_polyline(transit_path),
+        "steps": _parse_transit_details(transit_path.get("segments")),
+        "segments": transit_path.get("segments", []),
+        "cost": float(transit_path.get("cost", 0)),
+        "walking_distance": int(transit_path.get("walking_distance", 0)),
+        "nightflag": transit_path.get("nightflag", "0"),
+        "railway_flag": transit_path.get("railway_flag", "0")
+    }
+    if origin:
+        result["origin"] = origin
+    return result
+
 @amap_api_handler("get_public_transit_segment_details")
-def get_public_transit_segment_details(api_key, origin_lat, origin_lng, dest_lat, dest_lng, city, strategy=0):
+def get_public_transit_segment_details(api_key, origin_lat, origin_lng, dest_lat, dest_lng, city, strategy=0, summary_only=False):
     """
     Gets public transit route details using Amap Integrated Directions API，支持缓存和智能重试.
+    summary_only=True 时只请求基本信息（extensions=base），结果缓存为摘要条目；已有完整结果时直接复用
     """
     if not api_key:
         logger.error("Amap API密钥未配置")
@@ -2227,19 +4030,13 @@ def get_public_transit_segment_details(api_key, origin_lat, origin_lng, dest_lat
     cached_result = distance_cache.get(origin_lat, origin_lng, dest_lat, dest_lng, 'public_transit', city)
     if cached_result:
         return cached_result
-
-    # 智能QPS控制
-    smart_qps_control("transit", 0.3)
+    if summary_only:
+        cached_result = distance_cache.get(origin_lat, origin_lng, dest_lat, dest_lng, 'public_transit_summary', city)
+        if cached_result:
+            return cached_result
 
     url = "https://restapi.amap.com/v3/direction/transit/integrated"
-    params = {
-        "key": api_key,
-        "origin": f"{origin_lng},{origin_lat}",
-        "destination": f"{dest_lng},{dest_lat}",
-        "city": str(city),
-        "strategy": str(strategy),
-        "extensions": "all",
-    }
+    params = _build_transit_params(api_key, origin_lat, origin_lng, dest_lat, dest_lng, city, strategy, summary_only)
 
     # 重试机制
     max_retries = 2
@@ -2251,27 +4048,16 @@ def get_public_transit_segment_details(api_key, origin_lat, origin_lng, dest_lat
                 logger.info(f"公交API重试第{attempt}次，等待{wait_time}秒...")
                 time.sleep(wait_time)
             
-            response = requests.get(url, params=params, timeout=15)
+            response = amap_manager.request('transit', url, params=params)
             response.raise_for_status()
-            data = response.json()
+            data = parse_amap_json(response)
 
             if data.get("status") == "1" and data.get("route") and data["route"].get("transits"):
-                transit_path = data["route"]["transits"][0]
-
-                full_polyline = _parse_transit_polyline(transit_path)
-                detailed_steps = _parse_transit_details(transit_path.get("segments"))
-
-                result = {
-                    "distance": int(transit_path.get("distance", 0)),
-                    "duration": int(transit_path.get("duration", 0)),
-                    "polyline": full_polyline,
-                    "steps": detailed_steps,
-                    "segments": transit_path.get("segments", []),
-                    "cost": float(transit_path.get("cost", 0)),
-                    "walking_distance": int(transit_path.get("walking_distance", 0)),
-                    "nightflag": transit_path.get("nightflag", "0"),
-                    "railway_flag": transit_path.get("railway_flag", "0")
-                }
+                if summary_only:
+                    result = _parse_route_summary(data, 'public_transit', params["origin"])
+                    distance_cache.set(origin_lat, origin_lng, dest_lat, dest_lng, result, 'public_transit_summary', city)
+                    return result
+                result = _build_transit_result(data["route"]["transits"][0], params["origin"])
                 
                 # 将结果存入缓存
                 distance_cache.set(origin_lat, origin_lng, dest_lat, dest_lng, result, 'public_transit', city)
@@ -2293,22 +4079,657 @@ def get_public_transit_segment_details(api_key, origin_lat, origin_lng, dest_lat
                     logger.info(f"未找到公交路线: {info_msg} ({info_code})")
                     return None
 
-        except requests.exceptions.Timeout:
-            logger.error(f"公交路线规划请求超时 (尝试{attempt+1}/{max_retries+1})")
-            if attempt >= max_retries:
-                return None
-        except requests.exceptions.RequestException as e:
-            logger.error(f"公交路线规划请求失败 (尝试{attempt+1}/{max_retries+1}): {e}")
-            if attempt >= max_retries:
-                return None
-        except (ValueError, KeyError, IndexError) as e:
-            logger.error(f"公交路线规划响应解析错误: {e}")
-            return None
+        except (CircuitOpenError, DeadlineExceededError) as e:
+            logger.warning(f"公交路线规划跳过: {e}")
+            return None
+        except requests.exceptions.Timeout:
+            logger.error(f"公交路线规划请求超时 (尝试{attempt+1}/{max_retries+1})")
+            if attempt >= max_retries:
+                return None
+        except requests.exceptions.RequestException as e:
+            logger.error(f"公交路线规划请求失败 (尝试{attempt+1}/{max_retries+1}): {e}")
+            if attempt >= max_retries:
+                return None
+        except (ValueError, KeyError, IndexError) as e:
+            logger.error(f"公交路线规划响应解析错误: {e}")
+            return None
+
+    return None  # 所有重试都失败了
+
+
+# --- Amap Batch Requests ---
+AMAP_BATCH_URL = "https://restapi.amap.com/v3/batch"
+AMAP_BATCH_MAX_OPS = 20  # 高德批量接口单次最多20个子请求
+AMAP_BATCH_ENABLED = os.environ.get('AMAP_BATCH_ENABLED', '1') != '0'
+AMAP_QPS_ERROR_CODES = {'CUQPS_HAS_EXCEEDED_THE_LIMIT', '10019', '10020', '10021'}
+
+class AmapBatchError(requests.exceptions.RequestException):
+    """批量请求整体失败（没有任何子请求结果）"""
+
+def amap_batch_request(api_key, ops, endpoint='default', max_retries=2):
+    """
+    调用高德 /v3/batch 接口，一次HTTP往返执行多个子请求。
+    ops: [{'url': '/v3/...?...'}]；返回与ops一一对应的响应body列表，失败的子请求为None。
+    整体失败时抛出 AmapBatchError；熔断中或预算用完时直接抛出 CircuitOpenError / DeadlineExceededError。
+    """
+    last_error = None
+    for attempt in range(max_retries + 1):
+        try:
+            if attempt > 0:
+                wait_time = 1.0 * (2 ** attempt)  # 指数退避
+                logger.info(f"批量API重试第{attempt}次，等待{wait_time}秒...")
+                time.sleep(wait_time)
+            
+            response = amap_manager.request(endpoint, AMAP_BATCH_URL, params={'key': api_key}, method='POST', json_body={'ops': ops})
+            response.raise_for_status()
+            data = parse_amap_json(response)
+            
+            if isinstance(data, dict):
+                # 整体失败时返回的是错误对象而不是列表
+                info_code = str(data.get('infocode', 'Unknown'))
+                if info_code in AMAP_QPS_ERROR_CODES and attempt < max_retries:
+                    logger.warning("批量API QPS超限，准备重试")
+                    continue
+                raise AmapBatchError(f"批量API调用失败: {data.get('info')} ({info_code})")
+            
+            bodies = []
+            for item in data[:len(ops)]:
+                if isinstance(item, dict) and item.get('status') == 200 and isinstance(item.get('body'), dict):
+                    bodies.append(item['body'])
+                else:
+                    bodies.append(None)
+            bodies.extend([None] * (len(ops) - len(bodies)))
+            return bodies
+        except (CircuitOpenError, DeadlineExceededError, AmapBatchError):
+            raise
+        except requests.exceptions.RequestException as e:
+            logger.error(f"批量API请求失败 (尝试{attempt+1}/{max_retries+1}): {e}")
+            last_error = e
+        except ValueError as e:
+            raise AmapBatchError(f"批量API响应解析错误: {e}")
+    raise AmapBatchError(f"批量API请求失败: {last_error}")
+
+def fetch_route_legs_batched(api_key, legs, mode, city=None, departure_time=None, strategy=5, summary_only=False):
+    """
+    通过批量接口获取一组路段详情。
+    legs: [(origin_lat, origin_lng, dest_lat, dest_lng)]；返回与legs一一对应的结果（失败为None）。
+    个别子请求失败或QPS超限的路段，会退回到单路段接口（保留其重试逻辑）；
+    批量请求整体失败时抛出 AmapBatchError，由 submit_route_legs 把这些路段分发回线程池并发请求。
+    熔断中或获取阶段预算用完时不再重试，全部返回None。
+    summary_only=True 时子请求使用 extensions=base，结果为摘要条目。
+    """
+    if mode == 'public_transit':
+        path, endpoint = '/v3/direction/transit/integrated', 'transit'
+        build_params = lambda leg: _build_transit_params(api_key, *leg, city, summary_only=summary_only)
+    else:
+        path, endpoint = '/v3/direction/driving', 'driving'
+        build_params = lambda leg: _build_driving_params(api_key, *leg, strategy, departure_time, summary_only)
+    
+    ops = [{'url': f"{path}?{urlencode(build_params(leg))}"} for leg in legs]
+    try:
+        bodies = amap_batch_request(api_key, ops, endpoint)
+    except (CircuitOpenError, DeadlineExceededError) as e:
+        logger.warning(f"批量获取{len(legs)}个{endpoint}路段跳过: {e}")
+        return [None] * len(legs)
+    
+    results = []
+    retry_count = 0
+    cache_key_suffix = f"_{departure_time}" if departure_time else ""
+    for leg, body in zip(legs, bodies):
+        result = None
+        if body is not None and str(body.get('infocode', '')) not in AMAP_QPS_ERROR_CODES:
+            try:
+                if summary_only:
+                    result = _parse_route_summary(body, mode, f"{leg[1]},{leg[0]}")
+                    if result and mode == 'public_transit':
+                        distance_cache.set(*leg, result, 'public_transit_summary', city)
+                    elif result:
+                        distance_cache.set(*leg, result, f'driving_summary{cache_key_suffix}')
+                elif mode == 'public_transit':
+                    if body.get("status") == "1" and body.get("route") and body["route"].get("transits"):
+                        result = _build_transit_result(body["route"]["transits"][0], f"{leg[1]},{leg[0]}")
+                        distance_cache.set(*leg, result, 'public_transit', city)
+                else:
+                    result = _parse_driving_route_response(body, departure_time)
+                    if result:
+                        distance_cache.set(*leg, result, f'driving{cache_key_suffix}')
+            except (ValueError, KeyError, IndexError) as e:
+                logger.error(f"批量子响应解析错误: {e}")
+        elif amap_manager.is_circuit_open(endpoint) or fetch_deadline_reached():
+            pass  # 熔断中或预算用完，单独重试也不会成功
+        else:
+            # 子请求失败：使用单路段接口重试
+            retry_count += 1
+            if mode == 'public_transit':
+                result = get_public_transit_segment_details(api_key, *leg, city, summary_only=summary_only)
+            else:
+                result = get_driving_route_segment_details(api_key, *leg, strategy, departure_time, summary_only)
+        results.append(result)
+    
+    logger.info(f"批量获取{len(legs)}个{endpoint}路段，1次批量请求，{retry_count}个路段单独重试")
+    return results
+
+def _resolve_leg_future(future, result=None, exception=None):
+    """设置路段Future的结果；已被等待方取消（如截止时间到）的Future直接跳过"""
+    if future.done():
+        return
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except concurrent.futures.InvalidStateError:
+        pass  # 与取消操作竞争
+
+def _chain_leg_future(source, target):
+    """把单路段任务的结果转交给对外的路段Future"""
+    if source.cancelled():
+        target.cancel()
+        return
+    exception = source.exception()
+    if exception is not None:
+        _resolve_leg_future(target, exception=exception)
+    else:
+        _resolve_leg_future(target, source.result())
+
+def submit_route_legs(executor, api_key, legs, mode, city=None, departure_time=None, strategy=5, summary_only=False):
+    """
+    提交一组路段查询，返回与legs对应的Future列表。
+    启用批量时，每 AMAP_BATCH_MAX_OPS 个路段合并为一次 /v3/batch 调用；批量请求整体失败时这些路段分发回线程池单独请求。
+    调用方取消某个路段Future后不再为其设置结果；一批路段全部被取消时，尚未开始的批量任务也会被取消。
+    summary_only=True 时只获取距离和时间（构建矩阵用），选中展示的路段再通过 enrich_route_segments 补充详情。
+    """
+    def _submit_single(leg):
+        if mode == 'public_transit':
+            return executor.submit(get_public_transit_segment_details, api_key, *leg, city, summary_only=summary_only)
+        return executor.submit(get_driving_route_segment_details, api_key, *leg, strategy, departure_time, summary_only)
+    
+    if not AMAP_BATCH_ENABLED or len(legs) < 2:
+        return [_submit_single(leg) for leg in legs]
+    
+    # 完成回调在工作线程中执行，分发单路段任务时需要恢复调用方的上下文（优先级、截止时间）
+    ctx = contextvars.copy_context()
+    futures = [concurrent.futures.Future() for _ in legs]
+    for start in range(0, len(legs), AMAP_BATCH_MAX_OPS):
+        chunk = range(start, min(start + AMAP_BATCH_MAX_OPS, len(legs)))
+        chunk_future = executor.submit(
+            fetch_route_legs_batched, api_key, [legs[k] for k in chunk], mode, city, departure_time, strategy, summary_only
+        )
+        
+        def _cancel_chunk_if_abandoned(_, chunk=chunk, chunk_future=chunk_future):
+            if all(futures[k].cancelled() for k in chunk):
+                chunk_future.cancel()
+        
+        for k in chunk:
+            futures[k].add_done_callback(_cancel_chunk_if_abandoned)
+        
+        def _distribute(done, chunk=chunk):
+            if done.cancelled():
+                return
+            try:
+                chunk_results = done.result()
+            except AmapBatchError as e:
+                logger.warning(f"{e}，{len(chunk)}个路段改为单独请求")
+                for k in chunk:
+                    if futures[k].done():
+                        continue
+                    try:
+                        leg_future = ctx.copy().run(_submit_single, legs[k])
+                    except RuntimeError as submit_error:  # 线程池已关闭
+                        _resolve_leg_future(futures[k], exception=submit_error)
+                        continue
+                    leg_future.add_done_callback(lambda f, target=futures[k]: _chain_leg_future(f, target))
+                    futures[k].add_done_callback(lambda f, source=leg_future: f.cancelled() and source.cancel())
+                return
+            except Exception as e:
+                for k in chunk:
+                    _resolve_leg_future(futures[k], exception=e)
+                return
+            for offset, k in enumerate(chunk):
+                _resolve_leg_future(futures[k], chunk_results[offset])
+        
+        chunk_future.add_done_callback(_distribute)
+    return futures
+
+# --- Amap Distance Matrix (one-to-many) ---
+AMAP_DISTANCE_URL = "https://restapi.amap.com/v3/distance"
+AMAP_DISTANCE_MAX_ORIGINS = 100  # 距离测量接口单次最多100个起点
+# full: 矩阵路段获取完整路线；summary: 路段只请求 extensions=base 的距离和时间（驾车、公交均可）；
+# distance_api: 驾车使用距离测量接口按列获取（公交不支持，退回 summary）
+MATRIX_MODES = ('full', 'summary', 'distance_api')
+DEFAULT_MATRIX_MODE = os.environ.get('AMAP_MATRIX_MODE', 'full')  # 默认与原有行为一致，调用方或环境变量可选择其他模式
+DETAIL_LEVELS = ('full', 'summary')  # summary: 只返回距离和时间，不获取路线详情
+
+def parse_matrix_options(data):
+    """读取并校验请求中的 matrix_mode 和 detail_level，返回 (matrix_mode, detail_level, 错误信息)"""
+    matrix_mode = data.get('matrix_mode', DEFAULT_MATRIX_MODE)  # 'distance_api' 使用距离测量接口构建矩阵
+    if matrix_mode not in MATRIX_MODES:
+        return None, None, f'Invalid matrix_mode. Must be one of: {", ".join(MATRIX_MODES)}'
+    detail_level = data.get('detail_level', 'full')  # 'summary' 只返回距离和时间
+    if detail_level not in DETAIL_LEVELS:
+        return None, None, f'Invalid detail_level. Must be one of: {", ".join(DETAIL_LEVELS)}'
+    return matrix_mode, detail_level, None
+
+def fetch_distance_column(api_key, origins, dest_lat, dest_lng, distance_type=1):
+    """
+    调用高德 /v3/distance 接口，一次计算多个起点到同一终点的距离和时间。
+    origins: [(lat, lng)]；返回与origins对应的摘要结果列表，失败项为None。
+    """
+    results = [None] * len(origins)
+    for start in range(0, len(origins), AMAP_DISTANCE_MAX_ORIGINS):
+        chunk = origins[start:start + AMAP_DISTANCE_MAX_ORIGINS]
+        params = {
+            "key": api_key,
+            "origins": "|".join(f"{lng},{lat}" for lat, lng in chunk),
+            "destination": f"{dest_lng},{dest_lat}",
+            "type": str(distance_type),
+        }
+        try:
+            response = amap_manager.request('distance', AMAP_DISTANCE_URL, params=params)
+            response.raise_for_status()
+            data = parse_amap_json(response)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.error(f"距离测量API请求失败: {e}")
+            continue
+        
+        if data.get("status") != "1":
+            logger.warning(f"距离测量API调用失败: {data.get('info')} ({data.get('infocode')})")
+            continue
+        
+        for item in data.get("results", []):
+            try:
+                # origin_id 从1开始，对应本批次起点的顺序
+                offset = int(item.get("origin_id", 0)) - 1
+                if 0 <= offset < len(chunk) and not item.get("code"):
+                    results[start + offset] = {
+                        "distance": int(item.get("distance", 0)),
+                        "duration": int(item.get("duration", 0)),
+                        "polyline": "",
+                        "steps": [],
+                        "summary_only": True,
+                    }
+            except (TypeError, ValueError):
+                continue
+    return results
+
+def build_summary_matrix_via_distance_api(executor, api_key, all_coords, cost_matrix, missing_pairs):
+    """
+    使用距离测量接口按列填充代价矩阵（只含距离和时间），每列一次API调用。
+    返回无法通过该接口获得结果的点对，由调用方走完整路线规划。
+    """
+    columns = defaultdict(list)
+    for i, j in missing_pairs:
+        columns[j].append(i)
+    
+    column_futures = {
+        j: executor.submit(fetch_distance_column, api_key, [all_coords[i] for i in rows], *all_coords[j])
+        for j, rows in columns.items()
+    }
+    
+    unresolved = []
+    for j, future in column_futures.items():
+        try:
+            column_results = future.result(timeout=deadline_timeout(30))
+        except Exception as e:
+            logger.error(f"距离矩阵第{j}列获取失败: {e}")
+            column_results = [None] * len(columns[j])
+        for i, summary in zip(columns[j], column_results):
+            if summary is None:
+                unresolved.append((i, j))
+                continue
+            cost_matrix[i][j] = summary
+            cost_matrix[j][i] = summary
+            distance_cache.set(*all_coords[i], *all_coords[j], summary, 'driving_summary')
+    
+    logger.info(f"距离矩阵模式：{len(column_futures)}次距离API调用覆盖{len(missing_pairs) - len(unresolved)}个路段")
+    return unresolved
+
+def enrich_route_segments(executor, api_key, pending_legs, mode='driving', city=None, departure_time=None):
+    """
+    第二阶段：为只有摘要信息的路段并发获取完整路线详情（折线、导航步骤、公交换乘）。
+    pending_legs: {(lat1, lng1, lat2, lng2): [segment, ...]}，多条候选路线共享的路段只请求一次。
+    """
+    if not pending_legs:
+        return 0
+    
+    legs = list(pending_legs)
+    futures = submit_route_legs(executor, api_key, legs, mode, city, departure_time)
+    enriched = 0
+    for leg, future in zip(legs, futures):
+        try:
+            details = future.result(timeout=deadline_timeout(30))
+        except Exception as e:
+            logger.error(f"路段详情获取失败 {leg}: {e}")
+            continue
+        if not details:
+            continue
+        for segment in pending_legs[leg]:
+            segment['polyline'] = details.get('polyline', '')
+            segment['steps'] = details.get('steps', [])
+            if 'segments' in details:
+                segment['transit_segments'] = details['segments']
+            segment.pop('summary_only', None)
+        enriched += 1
+    
+    logger.info(f"路线详情补充：{len(legs)}个不同路段，成功{enriched}个")
+    return enriched
+
+def enrich_candidate_route_legs(executor, api_key, result, all_points_objects, mode='driving', city=None, departure_time=None):
+    """为候选路线中只有摘要信息的路段补充完整路线"""
+    points_by_id = {p['id']: p for p in all_points_objects}
+    pending = {}
+    for candidate in result.get('route_candidates', []):
+        for segment in candidate.get('route_segments', []):
+            if not segment.get('summary_only'):
+                continue
+            a, b = points_by_id[segment['from_id']], points_by_id[segment['to_id']]
+            leg = (a['latitude'], a['longitude'], b['latitude'], b['longitude'])
+            pending.setdefault(leg, []).append(segment)
+    
+    enrich_route_segments(executor, api_key, pending, mode, city, departure_time)
+    return result
+
+
+
+# --- Autocomplete ---
+AUTOCOMPLETE_CACHE_TTL = int(os.environ.get('AUTOCOMPLETE_CACHE_TTL', '600'))  # 秒
+AUTOCOMPLETE_CACHE_MAX_ENTRIES = 5000
+AUTOCOMPLETE_MIN_QUERY_LENGTH = 2
+AUTOCOMPLETE_MAX_SUGGESTIONS = 8
+AUTOCOMPLETE_COALESCE_WAIT = 1.0  # 秒，等待进行中的较短前缀请求的最长时间
+INPUTTIPS_MAX_TIPS = 10  # 高德输入提示单次最多返回的条数，少于该值说明结果集是完整的
+
+class TTLCache:
+    """带过期时间的LRU缓存（线程安全）"""
+    
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.data = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+    
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return item[1]
+    
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = (time.monotonic() + self.ttl_seconds, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_entries:
+                self.data.popitem(last=False)
+    
+    def __len__(self):
+        return len(self.data)
+
+class AutocompleteService:
+    """
+    地址/POI输入提示服务，/api/geocode/search 和 /api/search-address 共用：
+    1. 按 (前缀, 城市) 缓存高德 inputtips 结果；
+    2. 较长的输入优先用已缓存的较短前缀结果过滤得到（较短前缀的结果集完整，或过滤后仍足够多时）；
+    3. 相同请求只发一次（single-flight），连续输入时等待进行中的较短前缀请求完成后再尝试过滤。
+    """
+    
+    def __init__(self, ttl_seconds=AUTOCOMPLETE_CACHE_TTL, max_entries=AUTOCOMPLETE_CACHE_MAX_ENTRIES):
+        self.cache = TTLCache(max_entries, ttl_seconds)
+        self.in_flight = {}  # (前缀, 城市) -> Future
+        self.lock = threading.Lock()
+        self.stats = defaultdict(int)
+    
+    @staticmethod
+    def _normalize(text):
+        return re.sub(r'\s+', '', text or '').lower()
+    
+    def _record(self, name):
+        with self.lock:
+            self.stats[name] += 1
+    
+    def _filter_from_prefix(self, query, city):
+        """用已缓存的最长较短前缀结果过滤，无法得出可靠结果时返回None"""
+        for length in range(len(query) - 1, AUTOCOMPLETE_MIN_QUERY_LENGTH - 1, -1):
+            entry = self.cache.get((query[:length], city))
+            if entry is None:
+                continue
+            matches = [tip for tip in entry['tips'] if query in tip['search_text']]
+            # 结果集完整时过滤结果就是答案；不完整时只有过滤后仍足够多才可用
+            if entry['complete'] or len(matches) >= AUTOCOMPLETE_MAX_SUGGESTIONS:
+                return matches
+            return None
+        return None
+    
+    def _pending_prefix(self, query, city):
+        """查找进行中的较短前缀请求（最长优先）"""
+        with self.lock:
+            for length in range(len(query) - 1, AUTOCOMPLETE_MIN_QUERY_LENGTH - 1, -1):
+                future = self.in_flight.get((query[:length], city))
+                if future is not None:
+                    return future
+        return None
+    
+    def _fetch(self, api_key, keywords, city):
+        """调用高德 inputtips，返回缓存条目 {'tips': [...], 'complete': bool}"""
+        params = {
+            'key': api_key,
+            'keywords': keywords,
+            'city': city,
+            'datatype': 'all',
+            'citylimit': 'true' if city else 'false'
+        }
+        response = amap_manager.request('inputtips', "https://restapi.amap.com/v3/assistant/inputtips", params=params)
+        response.raise_for_status()
+        result = parse_amap_json(response)
+        if result.get('status') != '1':
+            logger.warning(f"输入提示API返回失败: {result.get('info')}")
+            return None
+        raw_tips = result.get('tips') or []
+        tips = []
+        for tip in raw_tips:
+            location = tip.get('location')
+            if not location or not isinstance(location, str):
+                continue
+            try:
+                longitude, latitude = (float(v) for v in location.split(','))
+            except ValueError:
+                continue
+            tips.append({
+                'id': tip.get('id', '') if isinstance(tip.get('id'), str) else '',
+                'name': tip.get('name', ''),
+                'address': tip.get('address', '') if isinstance(tip.get('address'), str) else '',
+                'district': tip.get('district', '') if isinstance(tip.get('district'), str) else '',
+                'latitude': latitude,
+                'longitude': longitude,
+                'search_text': self._normalize(f"{tip.get('name', '')}{tip.get('district', '')}{tip.get('address', '')}")
+            })
+        return {'tips': tips, 'complete': len(raw_tips) < INPUTTIPS_MAX_TIPS}
+    
+    def suggest(self, api_key, keywords, city='', limit=AUTOCOMPLETE_MAX_SUGGESTIONS):
+        """返回输入提示列表（每项含 id/name/address/district/latitude/longitude）"""
+        query = self._normalize(keywords)
+        city = (city or '').strip()
+        if len(query) < AUTOCOMPLETE_MIN_QUERY_LENGTH:
+            return []
+        
+        tips = self._lookup(query, city)
+        if tips is None:
+            # 连续输入：较短前缀的请求还在进行中，等它完成后再尝试过滤
+            pending = self._pending_prefix(query, city)
+            if pending is not None:
+                try:
+                    pending.result(timeout=AUTOCOMPLETE_COALESCE_WAIT)
+                except Exception:
+                    pass
+                tips = self._lookup(query, city)
+                if tips is not None:
+                    self._record('coalesced')
+        if tips is None:
+            tips = self._fetch_single_flight(api_key, keywords, query, city)
+        return [{k: v for k, v in tip.items() if k != 'search_text'} for tip in tips[:limit]]
+    
+    def _lookup(self, query, city):
+        entry = self.cache.get((query, city))
+        if entry is not None:
+            self._record('hits')
+            return entry['tips']
+        tips = self._filter_from_prefix(query, city)
+        if tips is not None:
+            self._record('prefix_hits')
+        return tips
+    
+    def _fetch_single_flight(self, api_key, keywords, query, city):
+        key = (query, city)
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                self.in_flight[key] = future
+        if not leader:
+            self._record('coalesced')
+            entry = future.result(timeout=AUTOCOMPLETE_COALESCE_WAIT * 10)
+            return entry['tips'] if entry else []
+        
+        self._record('fetches')
+        try:
+            entry = self._fetch(api_key, keywords.strip(), city)
+            if entry is not None:
+                self.cache.set(key, entry)
+            future.set_result(entry)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+        return entry['tips'] if entry else []
+    
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats.get('hits', 0) + stats.get('prefix_hits', 0) + stats.get('coalesced', 0) + stats.get('fetches', 0)
+        stats['cached_prefixes'] = len(self.cache)
+        stats['served_without_api_rate'] = round((lookups - stats.get('fetches', 0)) / lookups * 100, 2) if lookups else 0.0
+        return stats
+
+autocomplete_service = AutocompleteService()
 
-    return None  # 所有重试都失败了
 
+# --- District Table ---
+DISTRICT_TABLE_PATH = os.environ.get('DISTRICT_TABLE_PATH', './instance/district_table.json')
+DISTRICT_REFRESH_TIMEOUT = (5, 60)  # 全国行政区树的响应有数MB，读取超时放宽
+
+def _parse_district(district):
+    """将高德行政区记录转换为表记录，center 无法解析时返回None"""
+    center = district.get('center')
+    if not center or not isinstance(center, str):
+        return None
+    longitude, latitude = map(float, center.split(','))
+    return {
+        'name': district.get('name', ''),
+        'level': district.get('level', ''),
+        'center': {'longitude': longitude, 'latitude': latitude}
+    }
+
+class DistrictTable:
+    """
+    行政区划表：adcode -> 名称、级别和中心坐标，常驻内存按 adcode O(1) 查询。
+    数据文件由 `flask --app app refresh-districts` 从高德全量构建；
+    表中没有的 adcode 由调用方查询高德后写回（写穿）并持久化。
+    """
+    
+    def __init__(self, path=DISTRICT_TABLE_PATH):
+        self.path = path
+        self.districts = {}
+        self.updated_at = None
+        self.lock = threading.Lock()
+        self.stats = defaultdict(int)
+        self._load()
+    
+    def _load(self):
+        if not os.path.exists(self.path):
+            logger.info(f"行政区划表文件不存在: {self.path}，将按需从高德查询")
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                data = json_codec.loads(f.read(), 'district_load')
+            self.districts = data.get('districts', {})
+            self.updated_at = data.get('updated_at')
+            logger.info(f"已加载行政区划表: {len(self.districts)} 条, 更新于 {self.updated_at}")
+        except Exception as e:
+            logger.error(f"加载行政区划表失败: {e}")
+    
+    def _save(self):
+        """调用方需持有 self.lock"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_file = self.path + '.tmp'
+        with open(temp_file, 'wb') as f:
+            f.write(json_codec.dumps({'updated_at': self.updated_at, 'districts': self.districts}, 'district_save', indent=True))
+        os.replace(temp_file, self.path)
+    
+    def get(self, adcode):
+        record = self.districts.get(adcode)
+        with self.lock:
+            self.stats['hits' if record else 'misses'] += 1
+        return record
+    
+    def put(self, adcode, record):
+        """写穿：加入内存表并立即持久化"""
+        with self.lock:
+            self.districts[adcode] = record
+            self.stats['write_through'] += 1
+            try:
+                self._save()
+            except Exception as e:
+                logger.error(f"保存行政区划表失败: {e}")
+    
+    def refresh(self, api_key):
+        """从高德拉取全国省/市/区县三级行政区并整体替换，返回条目数"""
+        url = "https://restapi.amap.com/v3/config/district"
+        params = {
+            'key': api_key,
+            'keywords': '中国',
+            'subdistrict': 3,
+            'extensions': 'base'
+        }
+        response = amap_manager.request('district', url, params=params, timeout=DISTRICT_REFRESH_TIMEOUT)
+        response.raise_for_status()
+        result = parse_amap_json(response)
+        if result.get('status') != '1' or not result.get('districts'):
+            raise ValueError(f"行政区查询失败: {result.get('info')}")
+        
+        districts = {}
+        stack = list(result['districts'])
+        while stack:
+            district = stack.pop()
+            stack.extend(district.get('districts') or [])
+            adcode = district.get('adcode')
+            if not adcode or not isinstance(adcode, str):
+                continue
+            record = _parse_district(district)
+            # 同一adcode可能在多个层级出现（如直辖市），保留先出现的较高层级
+            if record and adcode not in districts:
+                districts[adcode] = record
+        
+        with self.lock:
+            self.districts = districts
+            self.updated_at = datetime.now().isoformat(timespec='seconds')
+            self._save()
+        return len(districts)
+    
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['entries'] = len(self.districts)
+        stats['updated_at'] = self.updated_at
+        return stats
 
-# get_driving_route_segment_details function has been replaced with the safe version above
+district_table = DistrictTable()
 
 
 # --- API Endpoints ---
@@ -2430,6 +4851,7 @@ def home_location():
         }), 200
 
 @app.route('/api/geocode/search', methods=['POST'])
+@amap_request_priority('interactive')
 def geocode_search():
     """地址搜索建议API"""
     try:
@@ -2445,41 +4867,8 @@ def geocode_search():
         
         api_key = app.config['AMAP_API_KEY']
         
-        # 使用高德地图的输入提示API
-        url = "https://restapi.amap.com/v3/assistant/inputtips"
-        params = {
-            'key': api_key,
-            'keywords': address,
-            'city': city,
-            'datatype': 'all',
-            'citylimit': 'true' if city else 'false'
-        }
-        
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        result = response.json()
-        
-        suggestions = []
-        if result.get('status') == '1' and result.get('tips'):
-            for tip in result['tips'][:8]:  # 限制返回8个建议
-                if tip.get('location') and tip.get('location') != '':
-                    location_parts = tip['location'].split(',')
-                    if len(location_parts) == 2:
-                        try:
-                            longitude = float(location_parts[0])
-                            latitude = float(location_parts[1])
-                            
-                            suggestion = {
-                                'id': tip.get('id', ''),
-                                'name': tip.get('name', ''),
-                                'address': tip.get('address', ''),
-                                'district': tip.get('district', ''),
-                                'latitude': latitude,
-                                'longitude': longitude
-                            }
-                            suggestions.append(suggestion)
-                        except (ValueError, IndexError):
-                            continue
+        # 输入提示服务：按前缀缓存，较长输入尽量由已缓存的较短前缀过滤得到
+        suggestions = autocomplete_service.suggest(api_key, address, city)
         
         return jsonify({'suggestions': suggestions}), 200
         
@@ -2513,7 +4902,44 @@ def geocode_address_api():
         logger.error(f"地址解析API错误: {e}")
         return jsonify({'message': 'Address geocoding failed'}), 500
 
+@app.route('/api/geocode/batch', methods=['POST'])
+def geocode_batch_api():
+    """批量地址解析API：先查缓存，未命中的地址按高德批量模式每10个一次请求"""
+    try:
+        data = request.get_json() or {}
+        addresses = data.get('addresses')
+        city = data.get('city') or ''
+        
+        if not isinstance(addresses, list) or not addresses:
+            return jsonify({'message': 'addresses must be a non-empty list'}), 400
+        if not isinstance(city, str):
+            return jsonify({'message': 'city must be a string'}), 400
+        if len(addresses) > GEOCODE_BATCH_MAX_ADDRESSES:
+            return jsonify({'message': f'At most {GEOCODE_BATCH_MAX_ADDRESSES} addresses per request'}), 400
+        addresses = [address.strip() if isinstance(address, str) else '' for address in addresses]
+        
+        api_key = app.config['AMAP_API_KEY']
+        geocoded_results = geocode_addresses(api_key, addresses, city)
+        
+        results = []
+        for address, geocoded_result in zip(addresses, geocoded_results):
+            if geocoded_result:
+                results.append({'address': address, **geocoded_result})
+            else:
+                results.append({'address': address, 'error': 'Unable to geocode the address'})
+        succeeded = sum(1 for geocoded_result in geocoded_results if geocoded_result)
+        return jsonify({
+            'results': results,
+            'succeeded': succeeded,
+            'failed': len(results) - succeeded
+        }), 200
+            
+    except Exception as e:
+        logger.error(f"批量地址解析API错误: {e}")
+        return jsonify({'message': 'Batch geocoding failed'}), 500
+
 @app.route('/api/search-address', methods=['GET'])
+@amap_request_priority('interactive')
 def search_address():
     """地址搜索建议API - 兼容前端GET请求"""
     try:
@@ -2532,54 +4958,17 @@ def search_address():
         if not api_key:
             return jsonify({'suggestions': [], 'error': '服务配置错误'}), 500
         
-        # 使用高德地图的输入提示API
-        url = "https://restapi.amap.com/v3/assistant/inputtips"
-        params = {
-            'key': api_key,
-            'keywords': query,
-            'city': city,
-            'datatype': 'all',
-            'citylimit': 'true' if city else 'false'
-        }
-        
-        logger.info(f"调用高德API: {url}, params: {params}")
-        
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        
-        # 确保正确处理中文响应
-        if response.encoding is None or response.encoding == 'ISO-8859-1':
-            response.encoding = 'utf-8'
-        
-        try:
-            result = response.json()
-        except UnicodeDecodeError:
-            # 如果仍然有编码问题，强制使用utf-8解码
-            content = response.content.decode('utf-8', errors='ignore')
-            result = json.loads(content)
-        
-        logger.info(f"高德API响应状态: {result.get('status')}")
-        
-        suggestions = []
-        if result.get('status') == '1' and result.get('tips'):
-            for tip in result['tips'][:8]:  # 限制返回8个建议
-                if tip.get('location') and tip.get('location') != '':
-                    location_parts = tip['location'].split(',')
-                    if len(location_parts) == 2:
-                        try:
-                            longitude = float(location_parts[0])
-                            latitude = float(location_parts[1])
-                            
-                            suggestion = {
-                                'id': tip.get('id', ''),
-                                'name': tip.get('name', ''),
-                                'address': tip.get('address', ''),
-                                'district': tip.get('district', ''),
-                                'location': f"{longitude},{latitude}"
-                            }
-                            suggestions.append(suggestion)
-                        except (ValueError, IndexError):
-                            continue
+        # 输入提示服务：按前缀缓存，较长输入尽量由已缓存的较短前缀过滤得到
+        suggestions = [
+            {
+                'id': tip['id'],
+                'name': tip['name'],
+                'address': tip['address'],
+                'district': tip['district'],
+                'location': f"{tip['longitude']},{tip['latitude']}"
+            }
+            for tip in autocomplete_service.suggest(api_key, query, city)
+        ]
         
         logger.info(f"返回建议数量: {len(suggestions)}")
         return jsonify({'suggestions': suggestions}), 200
@@ -2729,11 +5118,16 @@ def get_city_center():
         if not adcode:
             return jsonify({'success': False, 'error': '缺少行政区划代码'}), 400
         
+        # 优先查内存中的行政区划表，不消耗高德配额
+        record = district_table.get(adcode)
+        if record:
+            return jsonify({'success': True, **record}), 200
+        
         api_key = app.config.get('AMAP_API_KEY')
         if not api_key:
             return jsonify({'success': False, 'error': '服务配置错误'}), 500
         
-        # 使用高德地图行政区查询API
+        # 表中没有的adcode使用高德地图行政区查询API，结果写回表中
         url = "https://restapi.amap.com/v3/config/district"
         params = {
             'key': api_key,
@@ -2742,24 +5136,17 @@ def get_city_center():
             'extensions': 'base'
         }
         
-        response = requests.get(url, params=params, timeout=10)
+        response = amap_manager.request('district', url, params=params)
         response.raise_for_status()
-        result = response.json()
+        result = parse_amap_json(response)
         
         if result.get('status') == '1' and result.get('districts'):
             district = result['districts'][0]
-            center = district.get('center')
-            if center:
-                longitude, latitude = map(float, center.split(','))
-                return jsonify({
-                    'success': True,
-                    'center': {
-                        'longitude': longitude,
-                        'latitude': latitude
-                    },
-                    'name': district.get('name', ''),
-                    'level': district.get('level', '')
-                }), 200
+            record = _parse_district(district)
+            if record:
+                if district.get('adcode') == adcode:
+                    district_table.put(adcode, record)
+                return jsonify({'success': True, **record}), 200
         
         return jsonify({'success': False, 'error': '未找到对应的行政区'}), 404
         
@@ -2770,6 +5157,12 @@ def get_city_center():
         logger.error(f"获取城市中心处理错误: {e}")
         return jsonify({'success': False, 'error': '处理失败'}), 500
 
+@app.cli.command('refresh-districts')
+def refresh_districts_command():
+    """从高德重新构建行政区划表（DISTRICT_TABLE_PATH）"""
+    count = district_table.refresh(app.config['AMAP_API_KEY'])
+    print(f"行政区划表已更新: {count} 条 -> {district_table.path}")
+
 @app.route('/api/optimize-route', methods=['POST'])
 def optimize_route_compat():
     """路线优化API - 兼容前端调用"""
@@ -2781,6 +5174,7 @@ MAX_SHOPS_FOR_OPTIMIZATION = 15 # Max shops (N) for TSP optimization (increased
 MAX_SHOPS_FOR_EXACT_TSP = 6 # Max shops for exact TSP algorithm
 
 @app.route('/api/route/optimize', methods=['POST'])
+@with_latency_budget
 def optimize_route_enhanced():
     """增强的路线优化接口 - 支持智能连锁店选择"""
     try:
@@ -2816,6 +5210,9 @@ def optimize_route_enhanced():
         top_n = data.get('top_n', 10)
         departure_time = data.get('departure_time')  # 实时路况支持
         algorithm_preference = data.get('algorithm', 'adaptive')  # 算法偏好
+        matrix_mode, detail_level, options_error = parse_matrix_options(data)
+        if options_error:
+            return jsonify({'message': options_error}), 400
         api_key = app.config.get('AMAP_API_KEY')
         if not api_key:
             return jsonify({'message': 'Amap API key not configured on server.'}), 500
@@ -2824,10 +5221,10 @@ def optimize_route_enhanced():
             return jsonify({
                 'message': f'Too many shops for optimization. Please select {MAX_SHOPS_FOR_OPTIMIZATION} or fewer shops.'
             }), 400
-        # 使用线程池处理API调用以提高性能
-        with ThreadPoolExecutor(max_workers=3) as executor:
+        # 使用线程池处理API调用以提高性能（在途请求数由共享的自适应并发控制器约束）
+        with ContextThreadPoolExecutor(max_workers=AMAP_MAX_CONCURRENCY) as executor:
             result = process_route_optimization_threaded(
-                executor, api_key, home_location_data, shops_data, mode, city_param, top_n, departure_time, algorithm_preference
+                executor, api_key, home_location_data, shops_data, mode, city_param, top_n, departure_time, algorithm_preference, matrix_mode, detail_level
             )
         return jsonify(result)
     except Exception as e:
@@ -2857,6 +5254,10 @@ def handle_chain_store_optimization(data):
         if not city_param:
             return jsonify({'message': 'City parameter is required for chain store optimization'}), 400
         
+        matrix_mode, detail_level, options_error = parse_matrix_options(data)
+        if options_error:
+            return jsonify({'message': options_error}), 400
+        
         # 处理两种请求格式
         chain_categories = {}
         private_shops = []
@@ -2868,6 +5269,7 @@ def handle_chain_store_optimization(data):
         else:
             # 兼容格式：从shops中分离连锁店和私人店铺
             shops_data = data.get('shops', [])
+            brands_to_search = []
             
             for shop in shops_data:
                 if shop.get('type') == 'chain':
@@ -2876,13 +5278,21 @@ def handle_chain_store_optimization(data):
                         chain_categories[brand_name] = []
                     # 对于"type": "chain"的请求，需要搜索分店
                     if 'branches' not in shop:
-                        # 搜索连锁店分店
-                        branches = search_chain_store_branches(api_key, brand_name, home_location_data, city_param)
-                        chain_categories[brand_name] = branches
+                        brands_to_search.append(brand_name)
                     else:
                         chain_categories[brand_name] = shop['branches']
                 else:
                     private_shops.append(shop)
+            
+            # 并发搜索连锁店分店，按请求顺序写回
+            if brands_to_search:
+                with ContextThreadPoolExecutor(max_workers=min(SHOP_SEARCH_MAX_WORKERS, len(brands_to_search))) as executor:
+                    futures = [
+                        executor.submit(search_chain_store_branches, api_key, brand_name, home_location_data, city_param)
+                        for brand_name in brands_to_search
+                    ]
+                    for brand_name, future in zip(brands_to_search, futures):
+                        chain_categories[brand_name] = future.result()
         
         # 如果没有连锁店类别，但有私人店铺，继续处理
         if not chain_categories and not private_shops:
@@ -2940,7 +5350,7 @@ def handle_chain_store_optimization(data):
             logger.info("检测到连锁店类别和数量，开始搜索分店...")
             searched_branches = {}
             # 使用线程池并行搜索
-            with ThreadPoolExecutor(max_workers=5) as executor:
+            with ContextThreadPoolExecutor(max_workers=5) as executor:
                 future_to_brand = {
                     executor.submit(
                         search_chain_store_branches, 
@@ -2970,7 +5380,9 @@ def handle_chain_store_optimization(data):
             chain_categories, 
             private_shops, 
             api_key, 
-            city_param
+            city_param,
+            matrix_mode=matrix_mode,
+            detail_level=detail_level
         )
         
         # 执行优化（使用同步包装器）
@@ -2979,7 +5391,7 @@ def handle_chain_store_optimization(data):
             loop = asyncio.get_event_loop()
             if loop.is_running():
                 # 如果事件循环正在运行，在线程池中执行
-                with ThreadPoolExecutor() as executor:
+                with ContextThreadPoolExecutor() as executor:
                     future = executor.submit(asyncio.run, optimizer.optimize(mode, 60))
                     result = future.result(timeout=120)  # 2分钟超时
             else:
@@ -3021,8 +5433,8 @@ def search_chain_store_branches(api_key, brand_name, home_location, city, max_re
         radius = 15000  # 15km半径
         location_str = f"{home_location['longitude']},{home_location['latitude']}"
         
-        # 总是搜索更多分店（最多25家），以便筛选出最近的
-        branches = search_poi(
+        # 总是搜索更多分店（最多25家），以便筛选出最近的；分页结果边到达边计算距离
+        branches = iter_search_poi(
             api_key, 
             brand_name, 
             city=city,
@@ -3031,13 +5443,11 @@ def search_chain_store_branches(api_key, brand_name, home_location, city, max_re
             max_results=25  # 总是搜索最多25个，以获得最佳选择
         )
         
-        if not branches:
-            logger.warning(f"在 {city} 未找到 {brand_name} 的任何分店")
-            return []
-        
         # 转换为标准格式并计算距离
         formatted_branches_with_distance = []
+        searched_count = 0
         for branch in branches:
+            searched_count += 1
             latitude = branch.get('latitude')
             longitude = branch.get('longitude')
             
@@ -3066,6 +5476,10 @@ def search_chain_store_branches(api_key, brand_name, home_location, city, max_re
                 except (ValueError, TypeError) as e:
                     logger.warning(f"分店坐标解析失败: {branch.get('name', 'Unknown')} - {e}")
         
+        if searched_count == 0:
+            logger.warning(f"在 {city} 未找到 {brand_name} 的任何分店")
+            return []
+        
         if not formatted_branches_with_distance:
             logger.warning(f"未找到 {brand_name} 的任何有效分店")
             return []
@@ -3080,7 +5494,7 @@ def search_chain_store_branches(api_key, brand_name, home_location, city, max_re
         for branch in top_branches:
             del branch['distance_to_home']
         
-        logger.info(f"从 {len(branches)} 个搜索结果中筛选出 {len(top_branches)} 家最近的 {brand_name} 分店")
+        logger.info(f"从 {searched_count} 个搜索结果中筛选出 {len(top_branches)} 家最近的 {brand_name} 分店")
         return top_branches
         
     except Exception as e:
@@ -3121,8 +5535,17 @@ def validate_route_request(data):
                 return f'Invalid stay_duration format in shop {i}'
     return None
 
-def process_route_optimization_threaded(executor, api_key, home_location_data, shops_data, mode, city_param, top_n, departure_time=None, algorithm_preference='adaptive'):
-    """使用线程池处理路线优化"""
+def process_route_optimization_threaded(executor, api_key, home_location_data, shops_data, mode, city_param, top_n, departure_time=None, algorithm_preference='adaptive', matrix_mode=DEFAULT_MATRIX_MODE, detail_level='full'):
+    """
+    使用线程池处理路线优化
+    matrix_mode='distance_api' 时先用距离测量接口构建摘要矩阵求解（仅驾车），matrix_mode='summary' 时矩阵路段只请求基本信息，
+    两者都只为候选路线中的路段获取完整路线；detail_level='summary' 时跳过第二阶段，路段只包含距离和时间。
+    """
+    if matrix_mode == 'distance_api' and mode == 'public_transit':
+        logger.info("距离测量接口不支持公交，使用摘要路线矩阵")
+        matrix_mode = 'summary'
+    summary_legs = matrix_mode != 'full'
+
     # 准备点数据
     home_point = {
         "id": "home",
@@ -3138,7 +5561,7 @@ def process_route_optimization_threaded(executor, api_key, home_location_data, s
     cost_matrix = [[None for _ in range(num_points)] for _ in range(num_points)]
     
     # 首先检查缓存，收集需要API调用的点对
-    api_tasks = []
+    missing_pairs = []
     cache_hits = 0
     
     for i in range(num_points):
@@ -3149,8 +5572,12 @@ def process_route_optimization_threaded(executor, api_key, home_location_data, s
             # 检查缓存
             if mode == "public_transit":
                 cached_result = distance_cache.get(p1_lat, p1_lon, p2_lat, p2_lon, 'public_transit', city_param)
+                if not cached_result and summary_legs:
+                    cached_result = distance_cache.get(p1_lat, p1_lon, p2_lat, p2_lon, 'public_transit_summary', city_param)
             else:
                 cached_result = distance_cache.get(p1_lat, p1_lon, p2_lat, p2_lon, 'driving')
+                if not cached_result and summary_legs:
+                    cached_result = distance_cache.get(p1_lat, p1_lon, p2_lat, p2_lon, 'driving_summary')
             
             if cached_result:
                 cost_matrix[i][j] = cached_result
@@ -3158,24 +5585,41 @@ def process_route_optimization_threaded(executor, api_key, home_location_data, s
                 cache_hits += 1
             else:
                 # 需要API调用
-                if mode == "public_transit":
-                    task = executor.submit(
-                        get_public_transit_segment_details,
-                        api_key, p1_lat, p1_lon, p2_lat, p2_lon, city_param
-                    )
-                else:
-                    task = executor.submit(
-                        get_driving_route_segment_details,
-                        api_key, p1_lat, p1_lon, p2_lat, p2_lon, 5, departure_time
-                    )
-                api_tasks.append((i, j, task))
+                missing_pairs.append((i, j))
+    
+    if matrix_mode == 'distance_api' and missing_pairs:
+        missing_pairs = build_summary_matrix_via_distance_api(executor, api_key, all_coords, cost_matrix, missing_pairs)
+    
+    # 路线端点熔断中或获取阶段预算已用完：未命中的路段直接使用估算值，而不是逐个等待超时
+    leg_endpoint = 'transit' if mode == 'public_transit' else 'driving'
+    estimate_reason = 'circuit_open' if amap_manager.is_circuit_open(leg_endpoint) else 'deadline' if fetch_deadline_reached() else None
+    if missing_pairs and estimate_reason:
+        logger.warning(f"{leg_endpoint}路段使用直线距离估算（{estimate_reason}）: {len(missing_pairs)}个")
+        for i, j in missing_pairs:
+            estimated = build_estimated_leg(*all_coords[i], *all_coords[j], mode, estimate_reason)
+            cost_matrix[i][j] = estimated
+            cost_matrix[j][i] = estimated
+        missing_pairs = []
+    
+    # 未命中的路段合并为批量请求（每批最多 AMAP_BATCH_MAX_OPS 个）
+    leg_futures = submit_route_legs(
+        executor, api_key, [all_coords[i] + all_coords[j] for i, j in missing_pairs],
+        mode, city_param, departure_time, summary_only=summary_legs
+    )
+    api_tasks = [(i, j, task) for (i, j), task in zip(missing_pairs, leg_futures)]
     
     logger.info(f"缓存命中: {cache_hits}, API调用: {len(api_tasks)}")
     
     # 批量等待API调用完成
     for i, j, task in api_tasks:
+        segment_details, deadline_reached = wait_for_leg(task, timeout=30)  # 30秒超时，且不超过获取阶段剩余预算
+        if deadline_reached:
+            # 获取阶段预算用完：用估算值补齐，直接开始求解
+            estimated = build_estimated_leg(*all_coords[i], *all_coords[j], mode, 'deadline')
+            cost_matrix[i][j] = estimated
+            cost_matrix[j][i] = estimated
+            continue
         try:
-            segment_details = task.result(timeout=30)  # 30秒超时
             if segment_details is None:
                 if mode == "public_transit":
                     # 公交路线查找失败时，明确告诉用户这是因为没有找到公交路线
@@ -3228,8 +5672,8 @@ def process_route_optimization_threaded(executor, api_key, home_location_data, s
                     # distance_cache.set(p1_lat, p1_lon, p2_lat, p2_lon, segment_details, 'public_transit', city_param)
                 else:
                     raise Exception(f'Failed to get {mode} route details between {all_points_objects[i]["name"]} and {all_points_objects[j]["name"]}')
-            else:
-                # API成功返回数据，存储到缓存
+            elif not segment_details.get('summary_only'):
+                # API成功返回数据，存储到缓存（摘要条目已由查询函数按摘要模式缓存）
                 if mode == "public_transit":
                     distance_cache.set(all_coords[i][0], all_coords[i][1], all_coords[j][0], all_coords[j][1], segment_details, 'public_transit', city_param)
                 else:
@@ -3239,8 +5683,16 @@ def process_route_optimization_threaded(executor, api_key, home_location_data, s
         except Exception as e:
             logger.error(f"API调用失败 {i}->{j}: {e}")
             raise Exception(f'Route calculation failed between points {i} and {j}: {str(e)}')
+    finish_fetch_phase()
     # 继续TSP计算...
-    return complete_tsp_calculation(all_points_objects, cost_matrix, top_n, algorithm_preference)
+    result = complete_tsp_calculation(all_points_objects, cost_matrix, top_n, algorithm_preference)
+    if detail_level != 'summary':
+        result = enrich_candidate_route_legs(executor, api_key, result, all_points_objects, mode, city_param, departure_time)
+    result['estimated_legs'] = collect_estimated_legs(all_points_objects, cost_matrix)
+    deadline = get_request_deadline()
+    if deadline is not None:
+        result['deadline'] = deadline.get_stats()
+    return result
 
 def complete_tsp_calculation(all_points_objects, cost_matrix, top_n, algorithm_preference='adaptive'):
     """完成TSP计算并返回结果，使用改进的自适应优化算法"""
@@ -3262,13 +5714,13 @@ def complete_tsp_calculation(all_points_objects, cost_matrix, top_n, algorithm_p
         if algorithm_preference == 'exact':
             best_routes, best_costs = optimizer._exact_tsp_solution(shop_indices)
         elif algorithm_preference == 'ortools' and ORTOOLS_AVAILABLE:
-                            best_routes, best_costs = optimizer.ortools_solve(max_time_seconds=20)
+                            best_routes, best_costs = optimizer.ortools_solve(max_time_seconds=deadline_solver_seconds(20))
         elif algorithm_preference == 'genetic':
             best_routes, best_costs = optimizer.genetic_algorithm_solve(population_size=30, generations=50)
         elif algorithm_preference == 'heuristic':
             best_routes, best_costs = optimizer._heuristic_tsp_solution(shop_indices)
         else:  # adaptive
-                            best_routes, best_costs = optimizer.adaptive_solve(max_time_seconds=20)
+                            best_routes, best_costs = optimizer.adaptive_solve(max_time_seconds=deadline_solver_seconds(20))
         
         # 构建结果数据
         all_route_results = []
@@ -3313,6 +5765,11 @@ def complete_tsp_calculation(all_points_objects, cost_matrix, top_n, algorithm_p
                         segment_data['mode'] = 'public_transit'
                     else:
                         segment_data['mode'] = 'driving'
+                    if segment_info.get('summary_only'):
+                        segment_data['summary_only'] = True
+                    if segment_info.get('is_estimated'):
+                        segment_data['is_estimated'] = True
+                        segment_data['estimate_reason'] = segment_info.get('estimate_reason')
                     
                     route_segments.append(segment_data)
                 
@@ -3378,6 +5835,11 @@ def complete_tsp_calculation(all_points_objects, cost_matrix, top_n, algorithm_p
                         segment_data['mode'] = 'public_transit'
                     else:
                         segment_data['mode'] = 'driving'
+                    if segment_info.get('summary_only'):
+                        segment_data['summary_only'] = True
+                    if segment_info.get('is_estimated'):
+                        segment_data['is_estimated'] = True
+                        segment_data['estimate_reason'] = segment_info.get('estimate_reason')
                     
                     route_segments.append(segment_data)
                 
@@ -3538,79 +6000,174 @@ def _generate_route_id(transit_path):
     return hashlib.md5(id_string.encode('utf-8')).hexdigest()
 
 
-def get_public_transit_routes(api_key, origin_lat, origin_lng, dest_lat, dest_lng, city, top_n=5):
+TRANSIT_ROUTE_STRATEGIES = [0, 2, 1, 3, 5] # 0:推荐, 2:最少换乘, 1:最少花费, 3:最少步行, 5:不乘地铁
+TRANSIT_ROUTES_CACHE_TTL = int(os.environ.get('TRANSIT_ROUTES_CACHE_TTL', '1800'))  # 备选路线集合缓存30分钟
+
+def _transit_routes_cache_mode(origin_lat, origin_lng, dest_lat, dest_lng, strategies):
+    """备选路线集合的缓存模式名：包含策略集合和方向（缓存键本身与方向无关）"""
+    direction = 'fwd' if (origin_lat, origin_lng) <= (dest_lat, dest_lng) else 'rev'
+    return f"transit_routes_{'-'.join(map(str, strategies))}_{direction}"
+
+def _build_transit_route_option(route_id, transit_path):
+    """将一条公交方案转换为 /api/route/directions 返回的备选路线"""
+    full_polyline = _parse_transit_polyline(transit_path)
+    detailed_steps = _parse_transit_details(transit_path.get("segments"))
+    
+    # 为路线摘要创建一个简洁的描述
+    summary = "Unknown Route"
+    if detailed_steps:
+        # 尝试从第一段有效指令开始构建摘要
+        first_step = detailed_steps[0].get('instruction', '...')
+        # 尝试找到关键的公交或地铁线路名
+        main_transit_names = []
+        for segment in transit_path.get("segments", []):
+            if segment.get("bus") and segment["bus"].get("lines"):
+                main_transit_names.extend([l.get('name', '') for l in segment["bus"]["lines"]])
+            if segment.get("railway") and segment["railway"].get("name"):
+                main_transit_names.append(segment["railway"]["name"])
+        
+        if main_transit_names:
+            summary = " -> ".join(filter(None, main_transit_names))
+        else:
+            summary = first_step # Fallback to first instruction
+
+    return {
+        "id": route_id,
+        "summary": summary, # 添加路线摘要
+        "distance": int(transit_path.get("distance", 0)),
+        "duration": int(transit_path.get("duration", 0)),
+        "cost": float(transit_path.get("cost", 0)),
+        "walking_distance": int(transit_path.get("walking_distance", 0)),
+        "polyline": full_polyline,
+        "steps": detailed_steps,
+        "segments": transit_path.get("segments") # Keep original segments for detailed view
+    }
+
+def _fetch_transit_strategy(api_key, origin_lat, origin_lng, dest_lat, dest_lng, city, strategy):
+    """查询单个策略的公交方案列表；无方案时返回空列表，请求失败时返回None"""
+    url = "https://restapi.amap.com/v3/direction/transit/integrated"
+    params = _build_transit_params(api_key, origin_lat, origin_lng, dest_lat, dest_lng, city, strategy)
+    try:
+        response = amap_manager.request('transit', url, params=params)
+        response.raise_for_status()
+        data = parse_amap_json(response)
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Amap Public Transit request failed for strategy {strategy}: {e}")
+        return None
+    except ValueError as e:
+        logger.warning(f"Error parsing Amap Public Transit response for strategy {strategy}: {e}")
+        return None
+
+    if data.get("status") == "1" and data.get("route") and data["route"].get("transits"):
+        return data["route"]["transits"]
+    return []
+
+def _merge_transit_paths(all_routes, transit_paths, strategy):
+    """把一个策略返回的方案按 _generate_route_id 去重合并进 all_routes"""
+    try:
+        for transit_path in transit_paths:
+            route_id = _generate_route_id(transit_path)
+            if route_id not in all_routes:
+                all_routes[route_id] = _build_transit_route_option(route_id, transit_path)
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        logger.warning(f"Error parsing Amap Public Transit response for strategy {strategy}: {e}")
+
+def _cache_transit_routes(origin_lat, origin_lng, dest_lat, dest_lng, city, cache_mode, all_routes):
+    sorted_routes = sorted(all_routes.values(), key=lambda x: (x['duration'], x['distance']))
+    distance_cache.set(
+        origin_lat, origin_lng, dest_lat, dest_lng, sorted_routes, cache_mode, city,
+        ttl_seconds=TRANSIT_ROUTES_CACHE_TTL
+    )
+    return sorted_routes
+
+def _finish_transit_strategies_in_background(pending, all_routes, completed, total, cache_args):
+    """
+    first_k 提前返回后，其余策略查询照常完成（已在执行的请求无法取消），
+    全部成功后把完整路线集合写入缓存，后续相同查询直接命中，已消耗的配额不被浪费。
+    """
+    all_routes = dict(all_routes)
+    lock = threading.Lock()
+    state = {'remaining': len(pending), 'completed': completed}
+
+    def _on_done(future, strategy):
+        transit_paths = None
+        if not future.cancelled():
+            try:
+                transit_paths = future.result()
+            except Exception as e:
+                logger.warning(f"公交策略{strategy}后台查询失败: {e}")
+        with lock:
+            if transit_paths is not None:
+                state['completed'] += 1
+                _merge_transit_paths(all_routes, transit_paths, strategy)
+            state['remaining'] -= 1
+            if state['remaining'] or state['completed'] != total:
+                return
+            _cache_transit_routes(*cache_args, all_routes)
+        logger.info(f"公交多策略后台查询完成，已缓存{len(all_routes)}条路线")
+
+    for future, strategy in pending.items():
+        future.add_done_callback(lambda f, strategy=strategy: _on_done(f, strategy))
+
+def get_public_transit_routes(api_key, origin_lat, origin_lng, dest_lat, dest_lng, city, top_n=5, first_k=None):
     """
     Gets multiple public transit route options from Amap, sorted by duration and distance.
+    各策略在共享线程池中并发查询（受transit限流桶约束），响应到达时按 _generate_route_id 去重；
+    完整的去重路线集合按 (起点, 终点, 城市, 策略集合) 缓存 TRANSIT_ROUTES_CACHE_TTL 秒。
+    指定 first_k 时，拿到 first_k 条不同路线后立即返回以降低延迟，但不减少上游调用：
+    其余策略查询在后台照常完成（消耗同样的transit配额），结果合并后写入上述缓存。
     """
-    strategies = [0, 2, 1, 3, 5] # 0:推荐, 2:最少换乘, 1:最少花费, 3:最少步行, 5:不乘地铁
+    cache_mode = _transit_routes_cache_mode(origin_lat, origin_lng, dest_lat, dest_lng, TRANSIT_ROUTE_STRATEGIES)
+    cached_routes = distance_cache.get(origin_lat, origin_lng, dest_lat, dest_lng, cache_mode, city)
+    if cached_routes:
+        return cached_routes[:top_n]
+
     all_routes = {} # Use dict for deduplication
 
-    for strategy in strategies:
-        url = "https://restapi.amap.com/v3/direction/transit/integrated"
-        params = {
-            "key": api_key,
-            "origin": f"{origin_lng},{origin_lat}",
-            "destination": f"{dest_lng},{dest_lat}",
-            "city": str(city),
-            "strategy": str(strategy),
-            "extensions": "all",
-        }
-        try:
-            response = requests.get(url, params=params, timeout=15)
-            response.raise_for_status()
-            data = response.json()
+    # 路线规划已缓存的同方向路段（推荐策略的首选方案）作为种子
+    cached_leg = distance_cache.get(origin_lat, origin_lng, dest_lat, dest_lng, 'public_transit', city)
+    if cached_leg and cached_leg.get("segments") and cached_leg.get("origin") == f"{origin_lng},{origin_lat}":
+        route_id = _generate_route_id(cached_leg)
+        all_routes[route_id] = _build_transit_route_option(route_id, cached_leg)
+        if first_k and len(all_routes) >= first_k:
+            return list(all_routes.values())[:top_n]
+
+    completed = 0
+    consumed = set()
+    futures = {
+        amap_manager.executor.submit(
+            _fetch_transit_strategy, api_key, origin_lat, origin_lng, dest_lat, dest_lng, city, strategy
+        ): strategy
+        for strategy in TRANSIT_ROUTE_STRATEGIES
+    }
+    cache_args = (origin_lat, origin_lng, dest_lat, dest_lng, city, cache_mode)
 
-            if data.get("status") == "1" and data.get("route") and data["route"].get("transits"):
-                for transit_path in data["route"]["transits"]:
-                    route_id = _generate_route_id(transit_path)
-                    if route_id not in all_routes:
-                        full_polyline = _parse_transit_polyline(transit_path)
-                        detailed_steps = _parse_transit_details(transit_path.get("segments"))
-                        
-                        # 为路线摘要创建一个简洁的描述
-                        summary = "Unknown Route"
-                        if detailed_steps:
-                            # 尝试从第一段有效指令开始构建摘要
-                            first_step = detailed_steps[0].get('instruction', '...')
-                            # 尝试找到关键的公交或地铁线路名
-                            main_transit_names = []
-                            for segment in transit_path.get("segments", []):
-                                if segment.get("bus") and segment["bus"].get("lines"):
-                                    main_transit_names.extend([l.get('name', '') for l in segment["bus"]["lines"]])
-                                if segment.get("railway") and segment["railway"].get("name"):
-                                    main_transit_names.append(segment["railway"]["name"])
-                            
-                            if main_transit_names:
-                                summary = " -> ".join(filter(None, main_transit_names))
-                            else:
-                                summary = first_step # Fallback to first instruction
-
-                        all_routes[route_id] = {
-                            "id": route_id,
-                            "summary": summary, # 添加路线摘要
-                            "distance": int(transit_path.get("distance", 0)),
-                            "duration": int(transit_path.get("duration", 0)),
-                            "cost": float(transit_path.get("cost", 0)),
-                            "walking_distance": int(transit_path.get("walking_distance", 0)),
-                            "polyline": full_polyline,
-                            "steps": detailed_steps,
-                            "segments": transit_path.get("segments") # Keep original segments for detailed view
-                        }
-        except requests.exceptions.RequestException as e:
-            print(f"Amap Public Transit request failed for strategy {strategy}: {e}")
-            continue # Try next strategy
-        except (ValueError, KeyError, IndexError) as e:
-            print(f"Error parsing Amap Public Transit response for strategy {strategy}: {e}")
-            continue
-        time.sleep(0.05) # Rate limiting
+    try:
+        for future in concurrent.futures.as_completed(futures, timeout=30):
+            strategy = futures[future]
+            consumed.add(future)
+            transit_paths = future.result()
+            if transit_paths is None:
+                continue
+            completed += 1
+            _merge_transit_paths(all_routes, transit_paths, strategy)
+            if first_k and len(all_routes) >= first_k and len(consumed) < len(futures):
+                logger.info(f"已获得{len(all_routes)}条不同公交路线，提前返回，其余策略在后台完成后写入缓存")
+                pending = {f: s for f, s in futures.items() if f not in consumed}
+                _finish_transit_strategies_in_background(pending, all_routes, completed, len(futures), cache_args)
+                break
+    except concurrent.futures.TimeoutError:
+        logger.warning(f"公交多策略查询超时，使用已获得的{len(all_routes)}条路线")
+        for future in futures:
+            future.cancel()
 
     if not all_routes:
         return None
 
-    # Sort routes: primary key duration, secondary key distance
-    sorted_routes = sorted(all_routes.values(), key=lambda x: (x['duration'], x['distance']))
-    
-    return sorted_routes[:top_n]
+    # 只缓存所有策略都已返回的完整集合
+    if completed == len(futures):
+        return _cache_transit_routes(*cache_args, all_routes)[:top_n]
+    return sorted(all_routes.values(), key=lambda x: (x['duration'], x['distance']))[:top_n]
 
 @app.route('/api/route/directions', methods=['POST'])
 def get_directions():
@@ -3622,6 +6179,9 @@ def get_directions():
     destination = data.get('destination')
     mode = data.get('mode', 'public_transit') # 默认公共交通
     city = data.get('city')
+    first_k = data.get('first_k')  # 拿到K条不同路线后立即返回（只降低延迟，其余策略仍在后台查询并写入缓存）
+    if first_k is not None and (isinstance(first_k, bool) or not isinstance(first_k, int) or first_k < 1):
+        return jsonify({'message': '"first_k" must be a positive integer.'}), 400
 
     if not origin or 'latitude' not in origin or 'longitude' not in origin:
         return jsonify({'message': 'Missing or invalid "origin". It must be an object with "latitude" and "longitude".'}), 400
@@ -3641,7 +6201,8 @@ def get_directions():
             api_key, 
             origin['latitude'], origin['longitude'],
             destination['latitude'], destination['longitude'],
-            city
+            city,
+            first_k=first_k
         )
 
         if routes is None or not routes:
@@ -3778,22 +6339,7 @@ def optimize_cache():
 def clear_fallback_cache():
     """清除所有备选路线和估算数据的缓存"""
     try:
-        cleared_count = 0
-        keys_to_remove = []
-        
-        # 查找所有包含备选数据的缓存条目
-        for key, value in distance_cache.cache.items():
-            if isinstance(value, dict) and 'data' in value:
-                data = value['data']
-                if (data.get('is_fallback') or 
-                    data.get('mode') in ['driving_fallback', 'unavailable'] or
-                    any(step.get('type') in ['fallback', 'unavailable'] for step in data.get('steps', []))):
-                    keys_to_remove.append(key)
-                    cleared_count += 1
-        
-        # 删除找到的备选数据缓存
-        for key in keys_to_remove:
-            del distance_cache.cache[key]
+        cleared_count = distance_cache.clear_fallback_entries()
         
         logger.info(f"已清除 {cleared_count} 个备选路线缓存条目")
         return jsonify({
@@ -3805,6 +6351,22 @@ def clear_fallback_cache():
         logger.error(f"清除备选缓存失败: {e}")
         return jsonify({'message': f'Failed to clear fallback cache: {str(e)}'}), 500
 
+@app.route('/api/amap/stats', methods=['GET'])
+def get_amap_stats():
+    """获取高德API客户端统计信息（连接池、握手耗时、各端点请求情况、各Key用量）"""
+    try:
+        return jsonify({
+            'amap_stats': amap_manager.get_stats(),
+            'autocomplete': autocomplete_service.get_stats(),
+            'geocode_cache': geocode_cache.get_stats(),
+            'district_table': district_table.get_stats(),
+            'poi_search_cache': poi_search_cache.get_stats(),
+            'message': 'Amap client statistics retrieved successfully.'
+        }), 200
+    except Exception as e:
+        logger.error(f"获取高德客户端统计信息失败: {str(e)}")
+        return jsonify({'message': 'Failed to get Amap client statistics.'}), 500
+
 @app.route('/api/algorithms/info', methods=['GET'])
 def get_algorithms_info():
     """获取可用算法信息"""
@@ -3860,6 +6422,7 @@ def get_algorithms_info():
         return jsonify({'message': 'Failed to get algorithms info.'}), 500
 
 @app.route('/api/algorithms/benchmark', methods=['POST'])
+@amap_request_priority('benchmark')
 def benchmark_algorithms():
     """算法性能测试接口 - 使用真实地理位置数据"""
     try:
@@ -3914,7 +6477,7 @@ def benchmark_algorithms():
             
             # 批量获取距离数据
             api_calls = []
-            with ThreadPoolExecutor(max_workers=3) as executor:
+            with ContextThreadPoolExecutor(max_workers=AMAP_MAX_CONCURRENCY) as executor:
                 for i in range(test_points):
                     for j in range(i + 1, test_points):
                         loc1 = selected_locations[i]
@@ -4128,161 +6691,297 @@ init_db()
 
 # 在search_chain_store_branches函数之后添加新函数
 
-def classify_and_search_shops(api_key, shop_names, home_location, city):
+SHOP_SEARCH_MAX_WORKERS = int(os.environ.get('SHOP_SEARCH_MAX_WORKERS', '4'))  # 店铺并发搜索的最大并行数
+
+def _classify_single_shop(api_key, shop_name, home_location, city, search_results=None):
+    """
+    搜索并分类单个店铺名称（已有组合搜索结果时直接分类，不再请求API）
+    
+    Returns:
+        tuple: (类型, 数据)，类型为 'private'（数据为店铺）、'chain'（数据为分店列表）或 'not_found'（数据为None）
+    """
+    if search_results is None:
+        logger.info(f"搜索店铺: {shop_name}")
+        
+        # 搜索店铺
+        location_str = f"{home_location['longitude']},{home_location['latitude']}"
+        search_results = search_poi(
+            api_key,
+            shop_name,
+            city=city,
+            location=location_str,
+            radius=15000,  # 15km半径
+            max_results=25
+        )
+    
+    if not search_results:
+        logger.warning(f"未找到店铺: {shop_name}")
+        return 'not_found', None
+    
+    logger.info(f"店铺 {shop_name} 搜索到 {len(search_results)} 个结果")
+    
+    if len(search_results) == 1:
+        # 私人店铺（唯一结果）
+        shop = search_results[0]
+        latitude = shop.get('latitude')
+        longitude = shop.get('longitude')
+        
+        if latitude is None or longitude is None:
+            logger.warning(f"店铺 {shop_name} 缺少坐标信息")
+            return 'not_found', None
+        
+        try:
+            formatted_shop = {
+                'id': shop.get('id', f"private_{shop_name}"),
+                'name': shop.get('name', shop_name),
+                'latitude': float(latitude),
+                'longitude': float(longitude),
+                'address': shop.get('address', ''),
+                'type': 'private'
+            }
+        except (ValueError, TypeError) as e:
+            logger.warning(f"店铺 {shop_name} 坐标解析失败: {e}")
+            return 'not_found', None
+        
+        # 验证坐标有效性
+        if formatted_shop['latitude'] == 0 or formatted_shop['longitude'] == 0:
+            logger.warning(f"店铺 {shop_name} 坐标无效")
+            return 'not_found', None
+        
+        logger.info(f"归类为私人店铺: {shop_name}")
+        return 'private', formatted_shop
+    
+    # 连锁店铺（多个结果）
+    logger.info(f"归类为连锁店铺: {shop_name} (找到 {len(search_results)} 家分店)")
+    
+    # 处理连锁店分店
+    formatted_branches = []
+    for branch in search_results:
+        # 修复：直接使用已解析的坐标字段
+        latitude = branch.get('latitude')
+        longitude = branch.get('longitude')
+        
+        if latitude is None or longitude is None:
+            logger.warning(f"分店缺少坐标信息: {branch.get('name', 'Unknown')} - latitude: {latitude}, longitude: {longitude}")
+            continue
+        
+        try:
+            latitude = float(latitude)
+            longitude = float(longitude)
+        except (ValueError, TypeError) as e:
+            logger.warning(f"分店坐标解析失败: {branch.get('name', 'Unknown')} - {e}")
+            continue
+        
+        if latitude != 0 and longitude != 0:
+            # 计算距离用于排序
+            distance = calculate_haversine_distance(
+                home_location['latitude'], home_location['longitude'],
+                latitude, longitude
+            )
+            
+            formatted_branches.append({
+                'id': branch.get('id', f"chain_{shop_name}_{len(formatted_branches)}"),
+                'name': branch.get('name', shop_name),
+                'latitude': latitude,
+                'longitude': longitude,
+                'address': branch.get('address', ''),
+                'brand': shop_name,
+                'type': 'chain',
+                'distance_to_home': distance
+            })
+    
+    if not formatted_branches:
+        logger.warning(f"连锁店 {shop_name} 没有有效分店")
+        return 'not_found', None
+    
+    # 按距离排序，选择最近的分店
+    formatted_branches.sort(key=lambda x: x['distance_to_home'])
+    
+    # 限制分店数量
+    if len(formatted_branches) > MAX_CHAIN_BRANCHES_PER_BRAND:
+        logger.info(f"连锁店 {shop_name} 分店过多，限制为 {MAX_CHAIN_BRANCHES_PER_BRAND} 家最近的")
+        formatted_branches = formatted_branches[:MAX_CHAIN_BRANCHES_PER_BRAND]
+    
+    # 移除距离字段（仅用于排序）
+    for branch in formatted_branches:
+        branch.pop('distance_to_home', None)
+    
+    logger.info(f"连锁店 {shop_name} 成功添加 {len(formatted_branches)} 家分店")
+    return 'chain', formatted_branches
+
+SHOP_COMBINED_SEARCH = os.environ.get('SHOP_COMBINED_SEARCH', '1') != '0'  # 多个店铺名合并为一次 "|" 关键字搜索
+COMBINED_SEARCH_MAX_KEYWORDS = 5       # 每次组合搜索最多包含的店铺名数
+COMBINED_SEARCH_MAX_NAME_LENGTH = 12   # 只有较短的名称（通常是品牌名）参与组合搜索
+COMBINED_MATCH_THRESHOLD = 0.75        # 模糊匹配的最低得分
+
+def _normalize_shop_name(name):
+    """归一化店铺名：小写并去掉空白和常见标点"""
+    return re.sub(r"[\s()（）·\-_,，.。'\"]+", "", (name or "").lower())
+
+def _shop_name_match_score(shop_name, poi_name):
+    """店铺名与POI名称的匹配得分：包含关系为1.0，否则为最长连续公共片段占店铺名的比例"""
+    a, b = _normalize_shop_name(shop_name), _normalize_shop_name(poi_name)
+    if not a or not b:
+        return 0.0
+    if a in b:
+        return 1.0
+    match = difflib.SequenceMatcher(None, a, b, autojunk=False).find_longest_match(0, len(a), 0, len(b))
+    return match.size / len(a)
+
+def _group_combinable_names(shop_names):
+    """把可以合并搜索的店铺名分组（去重，每组至少2个名称）"""
+    combinable = []
+    for name in dict.fromkeys(shop_names):
+        if name and '|' not in name and len(name) <= COMBINED_SEARCH_MAX_NAME_LENGTH:
+            combinable.append(name)
+    groups = [combinable[i:i + COMBINED_SEARCH_MAX_KEYWORDS] for i in range(0, len(combinable), COMBINED_SEARCH_MAX_KEYWORDS)]
+    return [group for group in groups if len(group) >= 2]
+
+def _combined_search_shops(api_key, shop_names, home_location, city):
+    """
+    用一次 "|" 组合关键字搜索多个店铺名，并按名称模糊匹配把结果归属到各店铺名。
+    返回 {店铺名: 搜索结果}；无法可靠归属的名称（无匹配、与其他名称同分）不在返回中，由调用方单独搜索。
+    组合结果被截断时每个名称的结果数都不完整（连锁店可能只归属到少数分店），全部交给单独搜索；
+    是否截断由首页的 count 判断，此时只花费一次请求，不再获取后续页。
+    注意：每个名称只得到得分不低于 COMBINED_MATCH_THRESHOLD 的POI，而 _classify_single_shop 按结果数分类
+    （1个为独立店铺，多个为连锁店），因此分类和分店集合可能与单独搜索的结果不同。
+    """
+    location_str = f"{home_location['longitude']},{home_location['latitude']}"
+    max_results = min(25 * len(shop_names), POI_PAGE_SIZE * POI_MAX_PAGES)
+    pois = search_poi(
+        api_key,
+        '|'.join(shop_names),
+        city=city,
+        location=location_str,
+        radius=15000,  # 15km半径
+        max_results=max_results,
+        require_complete=True
+    ) or []
+    if len(pois) >= max_results:
+        logger.info(f"组合搜索 {'|'.join(shop_names)}: 结果被截断（{len(pois)}个），全部改为单独搜索")
+        return {}
+    
+    attributed = {name: [] for name in shop_names}
+    ambiguous = set()
+    for poi in pois:
+        scores = [(_shop_name_match_score(name, poi.get('name')), name) for name in shop_names]
+        best_score = max(score for score, _ in scores)
+        if best_score < COMBINED_MATCH_THRESHOLD:
+            continue
+        winners = [name for score, name in scores if score == best_score]
+        if len(winners) > 1:
+            ambiguous.update(winners)
+            continue
+        attributed[winners[0]].append(poi)
+    
+    resolved = {}
+    for name, results in attributed.items():
+        if name in ambiguous or not results:
+            continue
+        resolved[name] = results[:25]
+    
+    logger.info(f"组合搜索 {'|'.join(shop_names)}: {len(pois)} 个结果，归属 {len(resolved)}/{len(shop_names)} 个店铺名")
+    return resolved
+
+def _timed_combined_search_shops(api_key, shop_names, home_location, city):
+    """执行组合搜索并记录耗时（秒），失败时所有名称都回退到单独搜索"""
+    start = time.perf_counter()
+    try:
+        resolved = _combined_search_shops(api_key, shop_names, home_location, city)
+    except Exception as e:
+        logger.error(f"组合搜索 {shop_names} 时发生错误: {str(e)}")
+        resolved = {}
+    return resolved, time.perf_counter() - start
+
+def _timed_classify_single_shop(api_key, shop_name, home_location, city, search_results=None):
+    """执行单个店铺的分类搜索并记录耗时（秒）"""
+    start = time.perf_counter()
+    try:
+        kind, payload = _classify_single_shop(api_key, shop_name, home_location, city, search_results)
+    except Exception as e:
+        logger.error(f"搜索店铺 {shop_name} 时发生错误: {str(e)}")
+        kind, payload = 'not_found', None
+    return kind, payload, time.perf_counter() - start
+
+def classify_and_search_shops(api_key, shop_names, home_location, city, combined_search=None):
     """
     智能分类和搜索店铺
     根据搜索结果数量自动判断店铺类型：
     - 搜索结果 > 1：连锁店铺，使用所有搜索结果
     - 搜索结果 = 1：私人店铺，直接使用该结果
     - 搜索结果 = 0：未找到，记录错误
+    各店铺名在独立的有界线程池中并发搜索（分页请求仍走共享限流器），结果按输入顺序合并。
+    启用组合搜索时，较短的店铺名先按 "|" 合并搜索，只有无法可靠归属的名称才单独搜索；
+    组合搜索只保留名称匹配度足够的结果，分类结果可能与逐个单独搜索不同（见 _combined_search_shops）。
     
     Args:
         api_key: 高德API密钥
         shop_names: 店铺名称列表
         home_location: 用户家位置
         city: 城市名称
+        combined_search: 是否使用组合搜索，默认取 SHOP_COMBINED_SEARCH
         
     Returns:
         dict: {
             'chain_categories': {brand_name: [branches]},
             'private_shops': [shop_objects],
-            'not_found': [shop_names]
+            'not_found': [shop_names],
+            'search_latency': {shop_name: milliseconds}
         }
     """
     result = {
         'chain_categories': {},
         'private_shops': [],
-        'not_found': []
+        'not_found': [],
+        'search_latency': {}
     }
     
     logger.info(f"开始智能分类搜索 {len(shop_names)} 个店铺")
+    if not shop_names:
+        return result
     
-    for shop_name in shop_names:
-        try:
-            logger.info(f"搜索店铺: {shop_name}")
-            
-            # 搜索店铺
-            location_str = f"{home_location['longitude']},{home_location['latitude']}"
-            search_results = search_poi(
-                api_key,
-                shop_name,
-                city=city,
-                location=location_str,
-                radius=15000,  # 15km半径
-                max_results=25
-            )
-            
-            if not search_results:
-                logger.warning(f"未找到店铺: {shop_name}")
-                result['not_found'].append(shop_name)
-                continue
-            
-            logger.info(f"店铺 {shop_name} 搜索到 {len(search_results)} 个结果")
-            
-            if len(search_results) == 1:
-                # 私人店铺（唯一结果）
-                shop = search_results[0]
-                latitude = shop.get('latitude')
-                longitude = shop.get('longitude')
-                
-                if latitude is not None and longitude is not None:
-                    try:
-                        formatted_shop = {
-                            'id': shop.get('id', f"private_{shop_name}_{len(result['private_shops'])}"),
-                            'name': shop.get('name', shop_name),
-                            'latitude': float(latitude),
-                            'longitude': float(longitude),
-                            'address': shop.get('address', ''),
-                            'type': 'private'
-                        }
-                        
-                        # 验证坐标有效性
-                        if formatted_shop['latitude'] != 0 and formatted_shop['longitude'] != 0:
-                            result['private_shops'].append(formatted_shop)
-                            logger.info(f"归类为私人店铺: {shop_name}")
-                        else:
-                            logger.warning(f"店铺 {shop_name} 坐标无效")
-                            result['not_found'].append(shop_name)
-                    except (ValueError, TypeError) as e:
-                        logger.warning(f"店铺 {shop_name} 坐标解析失败: {e}")
-                        result['not_found'].append(shop_name)
-                else:
-                    logger.warning(f"店铺 {shop_name} 缺少坐标信息")
-                    result['not_found'].append(shop_name)
-                    
-            else:
-                # 连锁店铺（多个结果）
-                logger.info(f"归类为连锁店铺: {shop_name} (找到 {len(search_results)} 家分店)")
-                logger.info(f"搜索结果样本: {search_results[0] if search_results else 'None'}")
-                
-                # 处理连锁店分店
-                formatted_branches = []
-                for branch in search_results:
-                    # 修复：直接使用已解析的坐标字段
-                    latitude = branch.get('latitude')
-                    longitude = branch.get('longitude')
-                    
-                    # 添加调试日志
-                    logger.info(f"处理分店: {branch.get('name', 'Unknown')}, latitude: {latitude}, longitude: {longitude}")
-                    
-                    if latitude is not None and longitude is not None:
-                        try:
-                            latitude = float(latitude)
-                            longitude = float(longitude)
-                            
-                            if latitude != 0 and longitude != 0:
-                                # 计算距离用于排序
-                                distance = calculate_haversine_distance(
-                                    home_location['latitude'], home_location['longitude'],
-                                    latitude, longitude
-                                )
-                                
-                                formatted_branch = {
-                                    'id': branch.get('id', f"chain_{shop_name}_{len(formatted_branches)}"),
-                                    'name': branch.get('name', shop_name),
-                                    'latitude': latitude,
-                                    'longitude': longitude,
-                                    'address': branch.get('address', ''),
-                                    'brand': shop_name,
-                                    'type': 'chain',
-                                    'distance_to_home': distance
-                                }
-                                formatted_branches.append(formatted_branch)
-                                logger.info(f"成功添加分店: {branch.get('name')} ({latitude}, {longitude})")
-                        except (ValueError, TypeError) as e:
-                            logger.warning(f"分店坐标解析失败: {branch.get('name', 'Unknown')} - {e}")
-                            continue
-                    else:
-                        logger.warning(f"分店缺少坐标信息: {branch.get('name', 'Unknown')} - latitude: {latitude}, longitude: {longitude}")
-                        continue
-                
-                if formatted_branches:
-                    # 按距离排序，选择最近的分店
-                    formatted_branches.sort(key=lambda x: x['distance_to_home'])
-                    
-                    # 限制分店数量
-                    if len(formatted_branches) > MAX_CHAIN_BRANCHES_PER_BRAND:
-                        logger.info(f"连锁店 {shop_name} 分店过多，限制为 {MAX_CHAIN_BRANCHES_PER_BRAND} 家最近的")
-                        formatted_branches = formatted_branches[:MAX_CHAIN_BRANCHES_PER_BRAND]
-                    
-                    # 移除距离字段（仅用于排序）
-                    for branch in formatted_branches:
-                        branch.pop('distance_to_home', None)
-                    
-                    result['chain_categories'][shop_name] = formatted_branches
-                    logger.info(f"连锁店 {shop_name} 成功添加 {len(formatted_branches)} 家分店")
-                else:
-                    logger.warning(f"连锁店 {shop_name} 没有有效分店")
-                    result['not_found'].append(shop_name)
-                    
-        except Exception as e:
-            logger.error(f"搜索店铺 {shop_name} 时发生错误: {str(e)}")
+    use_combined = SHOP_COMBINED_SEARCH if combined_search is None else combined_search
+    combined_results = {}
+    combined_latency = {}
+    
+    # 使用独立线程池并发搜索各店铺名；search_poi 的分页请求在 amap_manager.page_executor 中执行
+    with ContextThreadPoolExecutor(max_workers=min(SHOP_SEARCH_MAX_WORKERS, len(shop_names))) as executor:
+        if use_combined:
+            groups = _group_combinable_names(shop_names)
+            group_futures = [
+                executor.submit(_timed_combined_search_shops, api_key, group, home_location, city)
+                for group in groups
+            ]
+            for group, future in zip(groups, group_futures):
+                resolved, elapsed = future.result()
+                combined_results.update(resolved)
+                for name in group:
+                    combined_latency[name] = elapsed
+            if groups:
+                logger.info(f"组合搜索: {len(groups)} 次请求归属了 {len(combined_results)} 个店铺名，其余单独搜索")
+        
+        futures = [
+            executor.submit(_timed_classify_single_shop, api_key, shop_name, home_location, city, combined_results.get(shop_name))
+            for shop_name in shop_names
+        ]
+        outcomes = [future.result() for future in futures]
+    
+    # 按输入顺序合并，保证结果确定
+    for shop_name, (kind, payload, elapsed) in zip(shop_names, outcomes):
+        result['search_latency'][shop_name] = round((elapsed + combined_latency.get(shop_name, 0)) * 1000, 1)
+        if kind == 'private':
+            result['private_shops'].append(payload)
+        elif kind == 'chain':
+            result['chain_categories'][shop_name] = payload
+        else:
             result['not_found'].append(shop_name)
     
-    logger.info(f"智能分类完成 - 连锁店: {len(result['chain_categories'])}, 私人店: {len(result['private_shops'])}, 未找到: {len(result['not_found'])}")
+    slowest = max(result['search_latency'].items(), key=lambda item: item[1])
+    logger.info(f"智能分类完成 - 连锁店: {len(result['chain_categories'])}, 私人店: {len(result['private_shops'])}, 未找到: {len(result['not_found'])}，最慢: {slowest[0]} {slowest[1]}ms")
     return result
 
 @app.route('/api/route/smart-optimize', methods=['POST'])
+@with_latency_budget
 def smart_optimize_route():
     """
     全新的智能路线优化接口
@@ -4312,11 +7011,16 @@ def smart_optimize_route():
         if not city_param:
             return jsonify({'message': 'City parameter is required'}), 400
         
+        matrix_mode, detail_level, options_error = parse_matrix_options(data)
+        if options_error:
+            return jsonify({'message': options_error}), 400
+        
         logger.info(f"收到智能优化请求: {len(shop_names)} 个店铺, 城市: {city_param}")
         
         # 智能分类和搜索店铺
         classification_result = classify_and_search_shops(
-            api_key, shop_names, home_location_data, city_param
+            api_key, shop_names, home_location_data, city_param,
+            combined_search=data.get('combined_search')
         )
         
         chain_categories = classification_result['chain_categories']
@@ -4336,6 +7040,7 @@ def smart_optimize_route():
                 'chain_categories': chain_categories,
                 'private_shops': private_shops,
                 'not_found': not_found,
+                'search_latency': classification_result['search_latency'],
                 'preview_mode': True
             })
         
@@ -4362,10 +7067,11 @@ def smart_optimize_route():
             }
             
             # 使用现有的路线优化逻辑
-            with ThreadPoolExecutor(max_workers=3) as executor:
+            with ContextThreadPoolExecutor(max_workers=AMAP_MAX_CONCURRENCY) as executor:
                 result = process_route_optimization_threaded(
                     executor, api_key, home_location_data, private_shops, 
-                    mode, city_param, 10, None, 'adaptive'
+                    mode, city_param, 10, None, 'adaptive',
+                    matrix_mode=matrix_mode, detail_level=detail_level
                 )
             
             return jsonify({
@@ -4387,7 +7093,9 @@ def smart_optimize_route():
             chain_categories,
             private_shops,
             api_key,
-            city_param
+            city_param,
+            matrix_mode=matrix_mode,
+            detail_level=detail_level
         )
         
         # 执行优化
@@ -4396,7 +7104,7 @@ def smart_optimize_route():
             loop = asyncio.get_event_loop()
             if loop.is_running():
                 import concurrent.futures
-                with concurrent.futures.ThreadPoolExecutor() as executor:
+                with ContextThreadPoolExecutor() as executor:
                     future = executor.submit(asyncio.run, optimizer.optimize(mode, 120))
                     optimization_result = future.result(timeout=180)  # 3分钟超时
             else:
@@ -4458,11 +7166,16 @@ def generate_multiple_route_candidates():
         if not city_param:
             return jsonify({'message': 'City parameter is required'}), 400
         
+        matrix_mode, detail_level, options_error = parse_matrix_options(data)
+        if options_error:
+            return jsonify({'message': options_error}), 400
+        
         logger.info(f"收到多候选路线请求: {len(shop_names)} 个店铺, 最多 {max_candidates} 个候选")
         
         # 智能分类和搜索店铺
         classification_result = classify_and_search_shops(
-            api_key, shop_names, home_location_data, city_param
+            api_key, shop_names, home_location_data, city_param,
+            combined_search=data.get('combined_search')
         )
         
         chain_categories = classification_result['chain_categories']
@@ -4484,7 +7197,9 @@ def generate_multiple_route_candidates():
             chain_categories,
             private_shops,
             api_key,
-            city_param
+            city_param,
+            matrix_mode=matrix_mode,
+            detail_level=detail_level
         )
         
         # 执行优化
@@ -4493,7 +7208,7 @@ def generate_multiple_route_candidates():
             loop = asyncio.get_event_loop()
             if loop.is_running():
                 import concurrent.futures
-                with concurrent.futures.ThreadPoolExecutor() as executor:
+                with ContextThreadPoolExecutor() as executor:
                     future = executor.submit(asyncio.run, optimizer.optimize(mode, 120))
                     optimization_result = future.result(timeout=180)
             else:
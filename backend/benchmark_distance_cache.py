@@ -0,0 +1,307 @@
+"""
+DistanceCache 规模基准测试
+
+在 1万 / 10万 / 100万 条目规模下测量 DistanceCache 的各项操作耗时：
+get/set 吞吐、缓存键生成、_save_cache_to_file 与加载、get_cache_stats、
+optimize_cache、clear_fallback_entries，以及每条目的内存占用。
+载荷为参照 instance/distance_cache.json 结构生成的驾车/公交合成数据，完全离线运行。
+
+用法示例:
+    python benchmark_distance_cache.py --sizes 10000,100000 --output bench.json
+    python benchmark_distance_cache.py --sizes 1000000 --skip stats,save_load --transit-ratio 0.2
+    python benchmark_distance_cache.py --backend mymodule:OtherCache   # 对比其他缓存实现
+
+结果以JSON输出（stdout或--output文件），便于不同缓存后端之间对比。
+"""
+import argparse
+import gc
+import importlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+PHASES = ('keygen', 'set', 'get', 'stats', 'save_load', 'clear_fallback', 'optimize', 'memory')
+
+
+def _polyline(rng, center_lat, center_lng, points):
+    """生成高德格式的折线字符串 'lng,lat;lng,lat;...'"""
+    lat, lng = center_lat, center_lng
+    coords = []
+    for _ in range(points):
+        lat += rng.uniform(-0.0005, 0.0005)
+        lng += rng.uniform(-0.0005, 0.0005)
+        coords.append(f"{lng:.6f},{lat:.6f}")
+    return ";".join(coords)
+
+
+def make_driving_payload(rng, steps=8, polyline_points=12):
+    """参照 get_driving_route_segment_details 返回结构生成驾车载荷"""
+    lat, lng = 32.0 + rng.random() / 5, 118.7 + rng.random() / 5
+    driving_steps = []
+    for i in range(steps):
+        distance = rng.randint(50, 3000)
+        duration = int(distance / 8)
+        driving_steps.append({
+            "type": "driving",
+            "instruction": f"沿测试路{i}号向东行驶{distance}米右转，沿测试路{i}号行驶（{distance}米，约{duration // 60}分钟）",
+            "action": rng.choice(["左转", "右转", "直行", ""]),
+            "road": f"测试路{i}号",
+            "distance": str(distance),
+            "duration": str(duration),
+        })
+    total_distance = sum(int(s["distance"]) for s in driving_steps)
+    return {
+        "distance": total_distance,
+        "duration": int(total_distance / 8),
+        "polyline": _polyline(rng, lat, lng, polyline_points * steps),
+        "steps": driving_steps,
+        "traffic_lights": rng.randint(0, 20),
+        "restriction": 0,
+        "has_real_time": False,
+        "tolls": 0,
+        "toll_distance": 0,
+        "restrictions": [],
+    }
+
+
+def make_transit_payload(rng, steps=8, polyline_points=12):
+    """参照 get_public_transit_segment_details 返回结构生成公交载荷（含原始segments）"""
+    lat, lng = 32.0 + rng.random() / 5, 118.7 + rng.random() / 5
+    parsed_steps = []
+    segments = []
+    for i in range(max(1, steps // 3)):
+        walk_distance = rng.randint(50, 800)
+        walking_steps = [{
+            "instruction": f"步行{walk_distance // 2}米右转",
+            "road": [],
+            "distance": str(walk_distance // 2),
+            "duration": [],
+            "polyline": _polyline(rng, lat, lng, polyline_points),
+            "action": "右转",
+            "assistant_action": [],
+        } for _ in range(2)]
+        line_distance = rng.randint(1000, 15000)
+        line_name = f"地铁{i + 1}号线(测试站--终点站)" if rng.random() < 0.5 else f"{rng.randint(1, 999)}路(测试站--终点站)"
+        segments.append({
+            "taxi": [],
+            "walking": {
+                "origin": f"{lng:.6f},{lat:.6f}",
+                "destination": f"{lng + 0.003:.6f},{lat + 0.003:.6f}",
+                "distance": str(walk_distance),
+                "duration": str(walk_distance),
+                "steps": walking_steps,
+            },
+            "bus": {"buslines": [{
+                "departure_stop": {"name": f"测试站{i}", "id": f"3201000{i}", "location": f"{lng:.6f},{lat:.6f}"},
+                "arrival_stop": {"name": f"终点站{i}", "id": f"3201001{i}", "location": f"{lng + 0.05:.6f},{lat + 0.05:.6f}"},
+                "name": line_name,
+                "type": "地铁线路" if "地铁" in line_name else "普通公交线路",
+                "distance": str(line_distance),
+                "duration": str(int(line_distance / 9)),
+                "polyline": _polyline(rng, lat, lng, polyline_points * 2),
+                "via_num": str(rng.randint(1, 15)),
+            }]},
+            "entrance": [],
+            "exit": [],
+            "railway": {"alters": [], "spaces": []},
+        })
+        for ws in walking_steps:
+            parsed_steps.append({"type": "walking", "instruction": ws["instruction"], "distance": int(ws["distance"]), "duration": 0})
+        parsed_steps.append({
+            "type": "railway" if "地铁" in line_name else "bus",
+            "instruction": f"乘坐 {line_name}，从 测试站{i} 到 终点站{i}",
+            "line_name": line_name,
+            "departure_stop": f"测试站{i}",
+            "arrival_stop": f"终点站{i}",
+            "via_num": rng.randint(1, 15),
+            "distance": line_distance,
+            "duration": int(line_distance / 9),
+        })
+    total_distance = sum(s["distance"] for s in parsed_steps)
+    return {
+        "distance": total_distance,
+        "duration": int(total_distance / 6),
+        "polyline": None,
+        "steps": parsed_steps,
+        "segments": segments,
+        "cost": float(rng.choice([2, 3, 4, 5, 6])),
+        "walking_distance": sum(int(seg["walking"]["distance"]) for seg in segments),
+        "nightflag": "0",
+        "railway_flag": "0",
+    }
+
+
+def make_fallback_payload(rng):
+    """直线距离估算的备选数据，用于测试 clear_fallback_entries"""
+    distance = rng.randint(500, 30000)
+    return {
+        "distance": distance,
+        "duration": max(300, int(distance / 11)),
+        "polyline": "",
+        "steps": [{"type": "fallback", "instruction": "⚠️ 未找到公交路线"}],
+        "is_fallback": True,
+        "fallback_reason": "公交路线不可达",
+    }
+
+
+def generate_workload(n, rng, transit_ratio, fallback_ratio, steps, polyline_points, city):
+    """生成 n 条 (lat1, lng1, lat2, lng2, mode, city, payload) 记录"""
+    for _ in range(n):
+        lat1, lng1 = 31.8 + rng.random() * 0.4, 118.5 + rng.random() * 0.5
+        lat2, lng2 = 31.8 + rng.random() * 0.4, 118.5 + rng.random() * 0.5
+        roll = rng.random()
+        if roll < fallback_ratio:
+            yield lat1, lng1, lat2, lng2, 'public_transit', city, make_fallback_payload(rng)
+        elif roll < fallback_ratio + transit_ratio:
+            yield lat1, lng1, lat2, lng2, 'public_transit', city, make_transit_payload(rng, steps, polyline_points)
+        else:
+            yield lat1, lng1, lat2, lng2, 'driving', None, make_driving_payload(rng, steps, polyline_points)
+
+
+def load_backend(spec):
+    """加载缓存实现，格式 'module:Class'，默认使用 app.DistanceCache"""
+    module_name, _, class_name = spec.partition(':')
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name or 'DistanceCache')
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def _rate(count, seconds):
+    return round(count / seconds, 1) if seconds > 0 else None
+
+
+def run_size(cache_cls, n, args):
+    """在单个规模下运行全部基准阶段"""
+    rng = random.Random(args.seed + n)
+    skip = set(args.skip)
+    result = {'entries': n}
+
+    workload = list(generate_workload(n, rng, args.transit_ratio, args.fallback_ratio,
+                                      args.steps, args.polyline_points, args.city))
+    cache = cache_cls(cache_duration_hours=24, persistent_cache=False)
+
+    if 'keygen' not in skip:
+        sample = workload[:min(n, args.sample)]
+        elapsed, _ = _timed(lambda: [cache._generate_cache_key(w[0], w[1], w[2], w[3], w[4], w[5]) for w in sample])
+        result['keygen'] = {'ops': len(sample), 'seconds': round(elapsed, 4),
+                            'ops_per_sec': _rate(len(sample), elapsed),
+                            'us_per_op': round(elapsed / len(sample) * 1e6, 3)}
+
+    if 'memory' not in skip:
+        gc.collect()
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        mem_cache = cache_cls(cache_duration_hours=24, persistent_cache=False)
+        for lat1, lng1, lat2, lng2, mode, city, payload in workload:
+            mem_cache.set(lat1, lng1, lat2, lng2, payload, mode, city)
+        after, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        # 载荷对象在workload中已分配，此处只统计缓存本身（键、条目字典、时间戳）的开销
+        result['memory'] = {'cache_overhead_bytes': after - before,
+                            'overhead_bytes_per_entry': round((after - before) / n, 1)}
+        sizes = [len(json.dumps(w[6], ensure_ascii=False).encode('utf-8')) for w in workload[:min(n, args.sample)]]
+        result['memory']['avg_payload_json_bytes'] = round(sum(sizes) / len(sizes), 1)
+        del mem_cache
+        gc.collect()
+
+    # 后续阶段依赖已填充的缓存，因此set总是执行，--skip set 只是不输出结果
+    elapsed, _ = _timed(lambda: [cache.set(w[0], w[1], w[2], w[3], w[6], w[4], w[5]) for w in workload])
+    if 'set' not in skip:
+        result['set'] = {'ops': n, 'seconds': round(elapsed, 4), 'ops_per_sec': _rate(n, elapsed)}
+
+    if 'get' not in skip:
+        sample = workload[:min(n, args.sample)]
+        elapsed, _ = _timed(lambda: [cache.get(w[0], w[1], w[2], w[3], w[4], w[5]) for w in sample])
+        misses = [(w[0] + 1.0, w[1], w[2], w[3], w[4], w[5]) for w in sample]
+        miss_elapsed, _ = _timed(lambda: [cache.get(*m) for m in misses])
+        result['get'] = {'hit_ops': len(sample), 'hit_ops_per_sec': _rate(len(sample), elapsed),
+                         'miss_ops': len(misses), 'miss_ops_per_sec': _rate(len(misses), miss_elapsed)}
+
+    if 'stats' not in skip:
+        elapsed, stats = _timed(cache.get_cache_stats)
+        result['stats'] = {'seconds': round(elapsed, 4), 'reported_size_mb': stats.get('cache_size_mb')}
+
+    if 'save_load' not in skip:
+        fd, path = tempfile.mkstemp(suffix='.json', prefix='distance_cache_bench_')
+        os.close(fd)
+        try:
+            cache.persistent_cache = True
+            cache.cache_file_path = path
+            save_elapsed, _ = _timed(cache._save_cache_to_file)
+            cache.persistent_cache = False
+            file_size = os.path.getsize(path)
+            load_elapsed, loaded = _timed(cache_cls, cache_duration_hours=24, persistent_cache=True, cache_file_path=path)
+            loaded_entries = len(loaded.cache)
+            loaded.persistent_cache = False  # 避免析构时再次写盘
+            del loaded
+            result['save_load'] = {'save_seconds': round(save_elapsed, 4), 'load_seconds': round(load_elapsed, 4),
+                                   'file_size_mb': round(file_size / 1024 / 1024, 2), 'loaded_entries': loaded_entries}
+        finally:
+            for leftover in (path, path + '.tmp'):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    if 'clear_fallback' not in skip:
+        elapsed, cleared = _timed(cache.clear_fallback_entries)
+        result['clear_fallback'] = {'seconds': round(elapsed, 4), 'cleared': cleared}
+
+    if 'optimize' not in skip:
+        elapsed, opt = _timed(cache.optimize_cache)
+        result['optimize'] = {'seconds': round(elapsed, 4), **opt}
+
+    del cache, workload
+    gc.collect()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='DistanceCache 规模基准测试')
+    parser.add_argument('--sizes', default='10000,100000', help='逗号分隔的条目数，例如 10000,100000,1000000')
+    parser.add_argument('--backend', default='app:DistanceCache', help='缓存实现 module:Class')
+    parser.add_argument('--transit-ratio', type=float, default=0.5, help='公交载荷占比')
+    parser.add_argument('--fallback-ratio', type=float, default=0.05, help='备选(估算)载荷占比')
+    parser.add_argument('--steps', type=int, default=8, help='每条路线的步骤数')
+    parser.add_argument('--polyline-points', type=int, default=12, help='每个步骤的折线点数')
+    parser.add_argument('--city', default='南京市')
+    parser.add_argument('--sample', type=int, default=100000, help='get/keygen 阶段的最大采样次数')
+    parser.add_argument('--skip', default='', help=f'跳过的阶段，逗号分隔: {",".join(PHASES)}')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='结果JSON文件路径（默认输出到stdout）')
+    args = parser.parse_args(argv)
+    args.skip = [p for p in args.skip.split(',') if p]
+
+    cache_cls = load_backend(args.backend)
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+
+    report = {
+        'backend': args.backend,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output',)},
+        'results': [],
+    }
+    for n in sizes:
+        print(f"运行基准: {n} 条目...", file=sys.stderr)
+        report['results'].append(run_size(cache_cls, n, args))
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""
+缓存策略离线模拟器
+
+回放 DistanceCache 记录的访问日志（设置环境变量 DISTANCE_CACHE_ACCESS_LOG 启用），
+在不同的淘汰策略（LRU / LFU / TinyLFU）、TTL、坐标吸附半径和内存预算下重新计算
+命中率、内存占用以及可节省的高德API调用次数。
+
+用法示例:
+    python cache_simulator.py instance/cache_access.log \
+        --policies lru,lfu,tinylfu --ttl-hours 24,6 --snap-meters 0,50,200 --budget-mb 0,5,50
+
+--budget-mb 0 表示不限内存；--snap-meters 0 表示不做坐标吸附（与线上缓存键一致）。
+"""
+import argparse
+import hashlib
+import heapq
+import json
+import math
+import sys
+from collections import OrderedDict, defaultdict
+
+METERS_PER_DEGREE_LAT = 111320.0
+
+
+def load_access_log(path):
+    """读取访问日志，返回按时间排序的事件列表"""
+    events = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"跳过无法解析的第{line_no}行", file=sys.stderr)
+                continue
+            if record.get('e') in ('hit', 'miss', 'set') and record.get('p'):
+                events.append(record)
+    events.sort(key=lambda r: r.get('t', 0))
+    return events
+
+
+def _snap(lat, lng, snap_meters):
+    """将坐标吸附到边长约为 snap_meters 的网格中心"""
+    if snap_meters <= 0:
+        return (round(lat, 6), round(lng, 6))
+    lat_step = snap_meters / METERS_PER_DEGREE_LAT
+    lng_step = snap_meters / (METERS_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+    return (math.floor(lat / lat_step), math.floor(lng / lng_step))
+
+
+def simulation_key(record, snap_meters):
+    """根据吸附半径计算模拟缓存键"""
+    if snap_meters <= 0:
+        return record['k']
+    lat1, lng1, lat2, lng2 = record['p']
+    a = _snap(lat1, lng1, snap_meters)
+    b = _snap(lat2, lng2, snap_meters)
+    if a > b:
+        a, b = b, a
+    return (a, b, record.get('m'), record.get('c'))
+
+
+class _SimCache:
+    """模拟缓存基类：按字节预算淘汰，支持TTL"""
+
+    def __init__(self, budget_bytes=0, ttl_seconds=None):
+        self.budget_bytes = budget_bytes
+        self.ttl_seconds = ttl_seconds
+        self.entries = {}  # key -> (size, inserted_at)
+        self.used_bytes = 0
+        self.peak_bytes = 0
+        self.evictions = 0
+
+    def lookup(self, key, now):
+        entry = self.entries.get(key)
+        if entry is None:
+            return False
+        if self.ttl_seconds is not None and now - entry[1] >= self.ttl_seconds:
+            self._remove(key)
+            return False
+        self._touch(key)
+        return True
+
+    def admit(self, key, size, now):
+        if self.budget_bytes and size > self.budget_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        while self.budget_bytes and self.used_bytes + size > self.budget_bytes and self.entries:
+            victim = self._victim()
+            if not self._should_admit(key, victim):
+                return
+            self._remove(victim)
+            self.evictions += 1
+        self.entries[key] = (size, now)
+        self.used_bytes += size
+        self.peak_bytes = max(self.peak_bytes, self.used_bytes)
+        self._on_insert(key)
+
+    def _remove(self, key):
+        size, _ = self.entries.pop(key)
+        self.used_bytes -= size
+        self._on_remove(key)
+
+    def _should_admit(self, candidate, victim):
+        return True
+
+    def _touch(self, key):
+        pass
+
+    def _on_insert(self, key):
+        pass
+
+    def _on_remove(self, key):
+        pass
+
+    def _victim(self):
+        raise NotImplementedError
+
+
+class LRUSimCache(_SimCache):
+    """最近最少使用"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.order = OrderedDict()
+
+    def _touch(self, key):
+        self.order.move_to_end(key)
+
+    def _on_insert(self, key):
+        self.order[key] = None
+
+    def _on_remove(self, key):
+        self.order.pop(key, None)
+
+    def _victim(self):
+        return next(iter(self.order))
+
+
+class LFUSimCache(_SimCache):
+    """最不经常使用（同频次时淘汰较早插入的条目）"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.freq = {}
+        self.heap = []
+        self.tick = 0
+
+    def _push(self, key):
+        self.tick += 1
+        heapq.heappush(self.heap, (self.freq[key], self.tick, key))
+
+    def _touch(self, key):
+        self.freq[key] += 1
+        self._push(key)
+
+    def _on_insert(self, key):
+        self.freq[key] = 1
+        self._push(key)
+
+    def _on_remove(self, key):
+        self.freq.pop(key, None)
+
+    def _victim(self):
+        # 惰性删除：跳过已失效的堆记录
+        while self.heap:
+            freq, _, key = self.heap[0]
+            if key in self.entries and self.freq.get(key) == freq:
+                return key
+            heapq.heappop(self.heap)
+        return next(iter(self.entries))
+
+
+class _CountMinSketch:
+    """TinyLFU使用的频率估计器，带周期性衰减"""
+
+    def __init__(self, width=4096, depth=4, sample_size=None):
+        if not 1 <= depth <= 16:
+            raise ValueError('depth must be between 1 and 16')  # blake2b 摘要最长64字节
+        self.width = width
+        self.depth = depth
+        self.table = [[0] * width for _ in range(depth)]
+        self.additions = 0
+        self.sample_size = sample_size or width * 10
+
+    def _indexes(self, key):
+        # 不使用内置 hash()：str/tuple 的哈希按进程加盐（PYTHONHASHSEED），同一日志多次回放结果会不同。
+        # 对 repr(key) 取 blake2b 摘要，每行使用摘要中独立的4个字节
+        digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=4 * self.depth).digest()
+        for i in range(self.depth):
+            yield i, int.from_bytes(digest[4 * i:4 * i + 4], 'little') % self.width
+
+    def add(self, key):
+        for i, idx in self._indexes(key):
+            self.table[i][idx] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            self._age()
+
+    def estimate(self, key):
+        return min(self.table[i][idx] for i, idx in self._indexes(key))
+
+    def _age(self):
+        for row in self.table:
+            for idx in range(self.width):
+                row[idx] >>= 1
+        self.additions //= 2
+
+
+class TinyLFUSimCache(LRUSimCache):
+    """LRU主缓存 + TinyLFU准入：新条目的频率必须高于淘汰候选才能进入"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sketch = _CountMinSketch()
+
+    def lookup(self, key, now):
+        self.sketch.add(key)
+        return super().lookup(key, now)
+
+    def _should_admit(self, candidate, victim):
+        return self.sketch.estimate(candidate) > self.sketch.estimate(victim)
+
+
+POLICIES = {
+    'lru': LRUSimCache,
+    'lfu': LFUSimCache,
+    'tinylfu': TinyLFUSimCache,
+}
+
+
+def simulate(events, policy='lru', ttl_hours=24, snap_meters=0, budget_mb=0):
+    """回放访问日志，返回单个策略组合的模拟结果"""
+    ttl_seconds = ttl_hours * 3600 if ttl_hours else None
+    budget_bytes = int(budget_mb * 1024 * 1024) if budget_mb else 0
+    cache = POLICIES[policy](budget_bytes=budget_bytes, ttl_seconds=ttl_seconds)
+
+    # 每个原始缓存键对应的载荷大小（来自 set/hit 记录）
+    payload_sizes = {}
+    for record in events:
+        if record.get('s'):
+            payload_sizes[record['k']] = max(payload_sizes.get(record['k'], 0), record['s'])
+
+    lookups = hits = 0
+    recorded_misses = 0
+    for record in events:
+        if record['e'] == 'set':
+            continue
+        lookups += 1
+        if record['e'] == 'miss':
+            recorded_misses += 1
+        key = simulation_key(record, snap_meters)
+        now = record.get('t', 0)
+        if cache.lookup(key, now):
+            hits += 1
+            continue
+        size = payload_sizes.get(record['k'])
+        if size:
+            # 未命中时视为发起一次API调用，并把结果写入模拟缓存
+            cache.admit(key, size, now)
+
+    api_calls = lookups - hits
+    return {
+        'policy': policy,
+        'ttl_hours': ttl_hours,
+        'snap_meters': snap_meters,
+        'budget_mb': budget_mb,
+        'lookups': lookups,
+        'hits': hits,
+        'hit_rate': round(hits / lookups * 100, 2) if lookups else 0.0,
+        'api_calls': api_calls,
+        'api_calls_saved_vs_no_cache': hits,
+        'api_calls_saved_vs_recorded': recorded_misses - api_calls,
+        'recorded_hit_rate': round((lookups - recorded_misses) / lookups * 100, 2) if lookups else 0.0,
+        'peak_memory_mb': round(cache.peak_bytes / 1024 / 1024, 3),
+        'final_memory_mb': round(cache.used_bytes / 1024 / 1024, 3),
+        'final_entries': len(cache.entries),
+        'evictions': cache.evictions,
+    }
+
+
+def _parse_list(value, cast):
+    return [cast(v) for v in value.split(',') if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='回放DistanceCache访问日志，评估不同缓存策略')
+    parser.add_argument('access_log', help='DISTANCE_CACHE_ACCESS_LOG 生成的日志文件')
+    parser.add_argument('--policies', default='lru,lfu,tinylfu')
+    parser.add_argument('--ttl-hours', default='24', help='逗号分隔，0表示永不过期')
+    parser.add_argument('--snap-meters', default='0', help='逗号分隔的坐标吸附半径（米）')
+    parser.add_argument('--budget-mb', default='0', help='逗号分隔的内存预算（MB），0表示不限')
+    parser.add_argument('--json', action='store_true', help='以JSON格式输出结果')
+    args = parser.parse_args(argv)
+
+    events = load_access_log(args.access_log)
+    if not events:
+        print('访问日志为空', file=sys.stderr)
+        return 1
+
+    results = []
+    for policy in _parse_list(args.policies, str):
+        if policy not in POLICIES:
+            parser.error(f'未知策略: {policy}')
+        for ttl_hours in _parse_list(args.ttl_hours, float):
+            for snap_meters in _parse_list(args.snap_meters, float):
+                for budget_mb in _parse_list(args.budget_mb, float):
+                    results.append(simulate(events, policy, ttl_hours, snap_meters, budget_mb))
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return 0
+
+    header = f"{'policy':<8} {'ttl_h':>6} {'snap_m':>7} {'budget':>7} {'hit%':>7} {'api':>7} {'saved':>7} {'vs_log':>7} {'peak_mb':>8}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['policy']:<8} {r['ttl_hours']:>6g} {r['snap_meters']:>7g} {r['budget_mb']:>7g} "
+              f"{r['hit_rate']:>7.2f} {r['api_calls']:>7} {r['api_calls_saved_vs_no_cache']:>7} "
+              f"{r['api_calls_saved_vs_recorded']:>7} {r['peak_memory_mb']:>8.3f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,16 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# app 在导入时建表，并把缓存等文件写到 ./instance/ 下；
+# 测试使用临时目录和临时数据库，不改动仓库中的 instance 文件
+TEST_ROOT = tempfile.mkdtemp(prefix='store-discovery-tests-')
+os.makedirs(os.path.join(TEST_ROOT, 'instance'))
+atexit.register(shutil.rmtree, TEST_ROOT, ignore_errors=True)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TEST_ROOT, 'instance', 'travel_planner.db')
+os.chdir(TEST_ROOT)
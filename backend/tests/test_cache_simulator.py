@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+
+import cache_simulator
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPT = """
+import json
+import cache_simulator
+events = [{'e': 'miss' if i % 3 else 'hit', 'k': f'k{i % 50}', 'p': [39.9, 116.4, 40.0, 116.5],
+           'm': 'driving', 's': 100, 't': i} for i in range(2000)]
+print(json.dumps(cache_simulator.simulate(events, 'tinylfu', budget_mb=0.002)))
+"""
+
+
+def _run_with_hash_seed(seed):
+    env = dict(os.environ, PYTHONHASHSEED=str(seed))
+    output = subprocess.run([sys.executable, '-c', SCRIPT], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+def test_tinylfu_results_do_not_depend_on_hash_seed():
+    assert _run_with_hash_seed(1) == _run_with_hash_seed(2)
+
+
+def test_count_min_sketch_counts_keys():
+    sketch = cache_simulator._CountMinSketch(width=64, depth=4)
+    for _ in range(5):
+        sketch.add(('a', 1))
+    sketch.add('b')
+    assert sketch.estimate(('a', 1)) >= 5
+    assert sketch.estimate('b') >= 1
@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+import app
+from app import CircuitBreaker, CircuitOpenError, DeadlineExceededError
+
+
+def _make_half_open(breaker):
+    """打开熔断器并让半开探测时间已到"""
+    breaker._open(time.monotonic() - breaker.open_seconds - 1, 'test')
+
+
+def test_opens_on_error_rate_and_rejects():
+    breaker = CircuitBreaker('t', min_requests=4, error_rate=0.5, open_seconds=60)
+    for failed in (False, True, True, True):
+        breaker.record(0.01, failed=failed)
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+def test_half_open_allows_single_probe_then_closes():
+    breaker = CircuitBreaker('t', open_seconds=60)
+    _make_half_open(breaker)
+    probe_id = breaker.before_request()
+    assert probe_id is not None
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+    breaker.record(0.01, failed=False)
+    assert breaker.state == 'closed'
+    assert breaker.before_request() is None
+
+
+def test_failed_probe_reopens():
+    breaker = CircuitBreaker('t', open_seconds=60)
+    _make_half_open(breaker)
+    breaker.before_request()
+    breaker.record(0.01, failed=True)
+    assert breaker.state == 'open'
+
+
+def test_released_probe_can_be_retried():
+    breaker = CircuitBreaker('t', open_seconds=60)
+    _make_half_open(breaker)
+    probe_id = breaker.before_request()
+    breaker.release_probe(probe_id)
+    assert breaker.before_request() == probe_id + 1
+
+
+def test_stale_release_does_not_clear_newer_probe():
+    breaker = CircuitBreaker('t', open_seconds=60)
+    _make_half_open(breaker)
+    first = breaker.before_request()
+    breaker.record(0.01, failed=True)  # 探测失败，重新打开
+    _make_half_open(breaker)
+    breaker.before_request()
+    breaker.release_probe(first)
+    assert breaker.probe_in_flight
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request()
+
+
+@pytest.mark.parametrize('failure', ['key_acquire', 'deadline_in_send'])
+def test_probe_released_when_request_never_sent(monkeypatch, failure):
+    """探测请求在发出前失败时不能让熔断器永远停在半开状态"""
+    endpoint = f'probe_{failure}'
+    breaker = app.amap_manager.get_breaker(endpoint)
+    _make_half_open(breaker)
+
+    original_acquire = app.amap_manager.key_pool.acquire
+    if failure == 'key_acquire':
+        def acquire(*args, **kwargs):
+            raise DeadlineExceededError('budget exhausted while waiting for a token')
+    else:
+        def acquire(*args, **kwargs):
+            time.sleep(0.1)  # 等待令牌期间预算用完，_send 在发出前抛出
+            return original_acquire(*args, **kwargs)
+    monkeypatch.setattr(app.amap_manager.key_pool, 'acquire', acquire)
+
+    with app.request_deadline(0.1 / app.DEADLINE_FETCH_FRACTION):
+        with pytest.raises(DeadlineExceededError):
+            app.amap_manager.request(endpoint, 'http://127.0.0.1:9/unused', params={'key': 'k'})
+
+    assert breaker.state == 'half_open'
+    assert not breaker.probe_in_flight
+    assert breaker.before_request() is not None
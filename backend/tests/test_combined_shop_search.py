@@ -0,0 +1,75 @@
+import pytest
+
+import app
+
+HOME = {'latitude': 39.90, 'longitude': 116.40}
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.content = app.json_codec.dumps(body)
+
+    def raise_for_status(self):
+        pass
+
+
+def _pois(name, n, page=1):
+    return [
+        {'id': f'{name}-{page}-{i}', 'name': f'{name}({i}号店)', 'location': f'116.{400 + i},39.{900 + i}'}
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def amap(monkeypatch):
+    """按关键字返回固定结果数的假高德搜索，记录每次请求的 (关键字, 页码)"""
+    counts = {}
+    calls = []
+
+    def request(endpoint, url, params=None, **kwargs):
+        keywords, page = params['keywords'], params['page']
+        calls.append((keywords, page))
+        total = sum(counts.get(name, 0) for name in keywords.split('|'))
+        start = (page - 1) * app.POI_PAGE_SIZE
+        n = max(0, min(app.POI_PAGE_SIZE, total - start))
+        pois = []
+        for name in keywords.split('|'):
+            pois += _pois(name, counts.get(name, 0), page)
+        return FakeResponse({'status': '1', 'count': str(total), 'pois': pois[start:start + n]})
+
+    monkeypatch.setattr(app.amap_manager, 'request', request)
+    monkeypatch.setattr(app, 'poi_search_cache', app.POISearchCache())
+    return counts, calls
+
+
+def test_truncated_combined_search_costs_a_single_request(amap):
+    counts, calls = amap
+    counts.update({'星巴克': 60, '瑞幸': 60, '喜茶': 40})
+
+    assert app._combined_search_shops('key', ['星巴克', '瑞幸', '喜茶'], HOME, '北京') == {}
+    assert calls == [('星巴克|瑞幸|喜茶', 1)]
+
+
+def test_complete_combined_search_resolves_names_without_extra_requests(amap):
+    counts, calls = amap
+    counts.update({'星巴克': 3, '瑞幸': 1})
+
+    resolved = app._combined_search_shops('key', ['星巴克', '瑞幸'], HOME, '北京')
+
+    assert sorted(resolved) == ['星巴克', '瑞幸']
+    assert len(resolved['星巴克']) == 3
+    assert calls == [('星巴克|瑞幸', 1)]
+
+
+def test_truncated_combined_search_adds_one_request_over_individual_searches(amap, monkeypatch):
+    counts, calls = amap
+    counts.update({'星巴克': 60, '瑞幸': 60})
+
+    result = app.classify_and_search_shops('key', ['星巴克', '瑞幸'], HOME, '北京', combined_search=True)
+    combined_calls = len(calls)
+    calls.clear()
+    monkeypatch.setattr(app, 'poi_search_cache', app.POISearchCache())
+    app.classify_and_search_shops('key', ['星巴克', '瑞幸'], HOME, '北京', combined_search=False)
+
+    assert sorted(result['chain_categories']) == ['星巴克', '瑞幸']
+    assert combined_calls == len(calls) + 1
@@ -0,0 +1,114 @@
+import threading
+import time
+
+import app
+from app import AdaptiveConcurrencyLimiter
+
+WEIGHTS = {'interactive': 8, 'optimization': 4, 'benchmark': 1}
+
+
+def _limiter(**kwargs):
+    options = dict(min_limit=1, max_limit=8, initial_limit=2, latency_target=1.0, decrease_cooldown=60, weights=WEIGHTS)
+    options.update(kwargs)
+    return AdaptiveConcurrencyLimiter(**options)
+
+
+def test_additive_increase_after_a_window_of_fast_successes():
+    limiter = _limiter()
+    limiter.record(0.1)
+    assert limiter.get_stats()['limit'] == 2
+    limiter.record(0.1)
+    assert limiter.get_stats()['limit'] == 3
+
+
+def test_slow_successes_do_not_increase():
+    limiter = _limiter()
+    for _ in range(10):
+        limiter.record(5.0)
+    assert limiter.get_stats()['limit'] == 2
+
+
+def test_multiplicative_decrease_once_per_cooldown_and_floor():
+    limiter = _limiter(initial_limit=8)
+    limiter.record(0.1, overloaded=True)
+    limiter.record(0.1, overloaded=True)
+    assert limiter.get_stats()['limit'] == 4
+    assert limiter.get_stats()['decreases'] == 1
+
+    limiter = _limiter(initial_limit=2, decrease_cooldown=0)
+    for _ in range(5):
+        limiter.record(0.1, overloaded=True)
+    assert limiter.get_stats()['limit'] == 1
+
+
+def test_in_flight_never_exceeds_limit():
+    limiter = _limiter(initial_limit=3)
+    lock = threading.Lock()
+    current = [0, 0]  # 当前在途, 峰值
+
+    def worker():
+        limiter.acquire('optimization')
+        with lock:
+            current[0] += 1
+            current[1] = max(current[1], current[0])
+        time.sleep(0.01)
+        with lock:
+            current[0] -= 1
+        limiter.release()
+
+    threads = [threading.Thread(target=worker) for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    assert current[1] <= 3
+    assert limiter.get_stats()['in_flight'] == 0
+
+
+def _queue_behind_held_slot(limiter, priorities, order):
+    """占住唯一名额后按顺序排队，返回线程列表"""
+    queued = sum(len(q) for q in limiter.queues.values())
+    threads = []
+    for priority in priorities:
+        def run(priority=priority):
+            limiter.acquire(priority)
+            order.append(priority)
+            limiter.release()
+        thread = threading.Thread(target=run)
+        thread.start()
+        threads.append(thread)
+        while sum(len(q) for q in limiter.queues.values()) < queued + len(threads):
+            time.sleep(0.001)
+    return threads
+
+
+def test_interactive_overtakes_queued_background_work():
+    limiter = _limiter(initial_limit=1, max_limit=1)
+    limiter.acquire('benchmark')
+    order = []
+    threads = _queue_behind_held_slot(limiter, ['benchmark', 'benchmark', 'interactive'], order)
+    limiter.release()
+    for t in threads:
+        t.join(5)
+    assert order[0] == 'interactive'
+
+
+def test_starved_queue_head_is_served_first():
+    limiter = _limiter(initial_limit=1, max_limit=1, max_wait=0.05)
+    limiter.acquire('interactive')
+    order = []
+    threads = _queue_behind_held_slot(limiter, ['benchmark'], order)
+    time.sleep(0.1)  # benchmark 队首等待超过 max_wait
+    threads += _queue_behind_held_slot(limiter, ['interactive'], order)
+    limiter.release()
+    for t in threads:
+        t.join(5)
+    assert order == ['benchmark', 'interactive']
+    assert limiter.get_stats()['priorities']['benchmark']['aged'] == 1
+
+
+def test_unknown_priority_uses_default_class():
+    limiter = AdaptiveConcurrencyLimiter(initial_limit=2)
+    limiter.acquire('no-such-class')
+    limiter.release()
+    assert limiter.get_stats()['priorities'][app.AMAP_DEFAULT_PRIORITY]['granted'] == 1
@@ -0,0 +1,25 @@
+import pytest
+
+import app
+
+ORIGIN = (39.90, 116.40)
+DEST = (39.95, 116.45)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = app.DistanceCache(persistent_cache=False)
+    monkeypatch.setattr(app, 'distance_cache', cache)
+    return cache
+
+
+def test_clear_fallback_skips_cached_transit_alternatives(cache):
+    cache.set(*ORIGIN, *DEST, [{'id': 'r1', 'duration': 600, 'distance': 1000}], 'transit_routes', '北京')
+    cache.set(*ORIGIN, *DEST, {'distance': 1000, 'is_fallback': True}, 'transit', '北京')
+
+    response = app.app.test_client().post('/api/cache/clear-fallback')
+
+    assert response.status_code == 200
+    assert response.get_json()['cleared_items'] == 1
+    assert cache.get(*ORIGIN, *DEST, 'transit_routes', '北京') is not None
+    assert cache.get(*ORIGIN, *DEST, 'transit', '北京') is None
@@ -0,0 +1,21 @@
+
+import app
+
+
+def test_estimated_leg_uses_meters_and_seconds():
+    # 北京天安门 -> 约11.1km 以北
+    leg = app.build_estimated_leg(39.90, 116.40, 40.00, 116.40)
+    distance_km = app.calculate_haversine_distance(39.90, 116.40, 40.00, 116.40)
+
+    assert leg['distance'] == int(distance_km * 1000)
+    assert 11000 < leg['distance'] < 11200
+    assert leg['duration'] == int(leg['distance'] / (40 / 3.6))  # 40km/h 约1000秒
+    assert f"{distance_km:.1f}公里" in leg['steps'][0]['instruction']
+    assert leg['is_estimated'] is True
+
+
+def test_short_estimated_leg_has_minimum_duration():
+    leg = app.build_estimated_leg(39.90, 116.40, 39.901, 116.40, mode='public_transit', reason='deadline')
+    assert leg['duration'] == 300
+    assert leg['segments'] == []
+    assert leg['estimate_reason'] == 'deadline'
@@ -0,0 +1,58 @@
+import pytest
+
+import app
+from app import GeocodeCacheEntry, User, db
+
+
+@pytest.fixture
+def app_context():
+    with app.app.app_context():
+        yield
+        GeocodeCacheEntry.query.filter(GeocodeCacheEntry.city == 'test-city').delete()
+        db.session.commit()
+
+
+def test_normalize_geocode_address():
+    assert app.normalize_geocode_address(' 北京市 朝阳区ＡＢＣ路１号 ') == '北京市朝阳区abc路1号'
+
+
+def test_cache_write_does_not_end_callers_transaction(app_context):
+    pending_user = User(username='geocode-cache-pending', password_hash='x')
+    db.session.add(pending_user)
+
+    cache = app.GeocodeCache()
+    cache.set_many({'某路1号': {'latitude': 39.9, 'longitude': 116.4, 'formatted_address': '某路1号'}}, 'test-city')
+
+    # 调用方的未提交修改仍然挂起，回滚后不会落库
+    assert pending_user in db.session.new
+    db.session.rollback()
+    assert User.query.filter_by(username='geocode-cache-pending').first() is None
+
+    assert cache.get_many({'某路1号', '某路2号'}, 'test-city') == {
+        '某路1号': {'latitude': 39.9, 'longitude': 116.4, 'formatted_address': '某路1号'}
+    }
+    assert cache.get_stats()['hits'] == 1
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.content = app.json_codec.dumps(body)
+
+
+@pytest.mark.parametrize('count', [1, 2])
+def test_malformed_location_is_a_failed_address(monkeypatch, count):
+    body = {'status': '1', 'geocodes': [{'location': 'not-a-location'}] * count}
+    monkeypatch.setattr(app.amap_manager, 'safe_request', lambda *args, **kwargs: FakeResponse(body))
+    addresses = [f'某路{i}号' for i in range(count)]
+    assert app._request_geocode_batch('key', addresses) == [None] * count
+
+
+def test_single_address_without_geocodes(monkeypatch):
+    monkeypatch.setattr(app.amap_manager, 'safe_request', lambda *args, **kwargs: FakeResponse({'status': '1', 'geocodes': []}))
+    assert app._request_geocode_batch('key', ['某路1号']) == [None]
+
+
+@pytest.mark.parametrize('city', [123, ['北京'], {'name': '北京'}])
+def test_batch_api_rejects_non_string_city(city):
+    response = app.app.test_client().post('/api/geocode/batch', json={'addresses': ['某路1号'], 'city': city})
+    assert response.status_code == 400
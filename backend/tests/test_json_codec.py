@@ -0,0 +1,66 @@
+import uuid
+from datetime import date, datetime
+
+import numpy as np
+import pytest
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+import app
+from app import JSONCodec
+
+SAMPLE = {
+    'b': datetime(2024, 1, 2, 3, 4, 5),
+    'a': date(2024, 1, 2),
+    'n': np.float64(1.5),
+    'i': np.int64(7),
+    'arr': np.array([1, 2]),
+    'u': uuid.UUID(int=1),
+    's': {3},
+    '名称': '星巴克',
+}
+
+
+@pytest.mark.skipif(not app.ORJSON_AVAILABLE, reason='orjson not installed')
+@pytest.mark.parametrize('sort_keys', [False, True])
+def test_orjson_and_stdlib_output_identical(sort_keys):
+    fast = app.json_codec.loads(JSONCodec('orjson').dumps(SAMPLE, sort_keys=sort_keys))
+    slow = app.json_codec.loads(JSONCodec('json').dumps(SAMPLE, sort_keys=sort_keys))
+    assert fast == slow
+    assert list(fast) == list(slow)
+
+
+def test_dates_match_flask_default_provider():
+    expected = app.json_codec.loads(DefaultJSONProvider(app.app).dumps({'b': SAMPLE['b'], 'a': SAMPLE['a']}))
+    assert app.json_codec.loads(app.app.json.dumps({'b': SAMPLE['b'], 'a': SAMPLE['a']})) == expected
+
+
+def test_provider_honours_kwargs_and_sort_keys():
+    provider = app.app.json
+    default = DefaultJSONProvider(app.app)
+    obj = {'b': 1, 'a': [1, 2]}
+    assert provider.dumps(obj, separators=(',', ':')) == default.dumps(obj, separators=(',', ':'))
+    assert provider.dumps(obj, indent=2) == default.dumps(obj, indent=2)
+    assert provider.dumps(obj) == '{"a":[1,2],"b":1}'
+
+
+def test_session_cookie_round_trip():
+    flask_app = Flask(__name__)
+    flask_app.secret_key = 'test'
+    flask_app.json = app.CodecJSONProvider(flask_app)
+
+    @flask_app.route('/__test_session_set')
+    def _set_session():
+        from flask import session
+        session['when'] = datetime(2024, 1, 2, 3, 4, 5)
+        session['items'] = (1, 2)
+        return 'ok'
+
+    @flask_app.route('/__test_session_get')
+    def _get_session():
+        from flask import session
+        return app.jsonify({'when': session['when'].replace(tzinfo=None).isoformat(), 'items': list(session['items'])})
+
+    client = flask_app.test_client()
+    client.get('/__test_session_set')
+    assert client.get('/__test_session_get').json == {'when': '2024-01-02T03:04:05', 'items': [1, 2]}
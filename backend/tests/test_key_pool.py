@@ -0,0 +1,46 @@
+import threading
+import time
+from collections import Counter
+
+import app
+
+BACKEND_DELAY = 0.05
+
+
+class SlowBackend(app.MemoryRateLimitBackend):
+    """模拟 SQLite/Redis 后端的I/O延迟"""
+
+    def reserve(self, *args, **kwargs):
+        time.sleep(BACKEND_DELAY)
+        return super().reserve(*args, **kwargs)
+
+    def peek(self, *args, **kwargs):
+        time.sleep(BACKEND_DELAY)
+        return super().peek(*args, **kwargs)
+
+
+def _acquire_concurrently(pool, count):
+    chosen = []
+    threads = [threading.Thread(target=lambda: chosen.append(pool.acquire('default')[0].api_key)) for _ in range(count)]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return chosen, time.monotonic() - start
+
+
+def test_backend_io_is_not_serialized_by_pool_lock():
+    pool = app.AmapKeyPool(['key-a', 'key-b'], limits={'default': (1000.0, 1000)}, backend=SlowBackend())
+    chosen, elapsed = _acquire_concurrently(pool, 8)
+    assert len(chosen) == 8
+    # 在锁内做I/O时8个请求至少串行 8 * 2 * BACKEND_DELAY 秒
+    assert elapsed < 8 * BACKEND_DELAY
+
+
+def test_concurrent_acquires_spread_across_keys():
+    pool = app.AmapKeyPool(['key-a', 'key-b'], limits={'default': (1000.0, 1000)}, backend=SlowBackend())
+    chosen, _ = _acquire_concurrently(pool, 8)
+    counts = Counter(chosen)
+    assert set(counts) == {'key-a', 'key-b'}
+    assert all(pool.pending[k] == 0 for k in pool.keys)
@@ -0,0 +1,47 @@
+import pytest
+
+import app
+
+HOME = {'latitude': 39.90, 'longitude': 116.40}
+BRANCH = {'id': 'b1', 'name': '星巴克(1号店)', 'latitude': 39.91, 'longitude': 116.41}
+
+REQUESTS = {
+    '/api/route/optimize': {'home_location': HOME, 'city': '北京', 'chain_categories': {'星巴克': [BRANCH]}},
+    '/api/route/smart-optimize': {'home_location': HOME, 'city': '北京', 'shop_names': ['星巴克']},
+    '/api/route/multi-candidates': {'home_location': HOME, 'city': '北京', 'shop_names': ['星巴克']},
+}
+
+
+@pytest.fixture
+def optimizer_calls(monkeypatch):
+    calls = []
+
+    class FakeOptimizer:
+        def __init__(self, *args, **kwargs):
+            calls.append(kwargs)
+
+        async def optimize(self, mode, time_limit):
+            return {'success': True, 'routes': []}
+
+    monkeypatch.setattr(app, 'TSPWithCategoriesOptimizer', FakeOptimizer)
+    monkeypatch.setattr(app, 'classify_and_search_shops', lambda *args, **kwargs: {
+        'chain_categories': {'星巴克': [BRANCH, dict(BRANCH, id='b2')]},
+        'private_shops': [], 'not_found': [], 'search_latency': {}
+    })
+    return calls
+
+
+@pytest.mark.parametrize('path', sorted(REQUESTS))
+@pytest.mark.parametrize('field', ['matrix_mode', 'detail_level'])
+def test_invalid_matrix_options_are_rejected(optimizer_calls, path, field):
+    response = app.app.test_client().post(path, json=dict(REQUESTS[path], **{field: 'bogus'}))
+    assert response.status_code == 400
+    assert field in response.get_json()['message']
+    assert optimizer_calls == []
+
+
+@pytest.mark.parametrize('path', sorted(REQUESTS))
+def test_matrix_options_reach_the_optimizer(optimizer_calls, path):
+    response = app.app.test_client().post(path, json=dict(REQUESTS[path], matrix_mode='summary', detail_level='summary'))
+    assert response.status_code == 200
+    assert optimizer_calls == [{'matrix_mode': 'summary', 'detail_level': 'summary'}]
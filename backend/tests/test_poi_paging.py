@@ -0,0 +1,29 @@
+import app
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.content = app.json_codec.dumps(body)
+
+    def raise_for_status(self):
+        pass
+
+
+def test_paged_search_inside_a_saturated_amap_pool_completes(monkeypatch):
+    """搜索运行在 amap 线程池唯一的工作线程中时，分页请求不能排在它后面等待"""
+    total = app.POI_PAGE_SIZE * 3
+
+    def request(endpoint, url, params=None, **kwargs):
+        start = (params['page'] - 1) * app.POI_PAGE_SIZE
+        pois = [{'id': str(i), 'name': f'店{i}', 'location': '116.4,39.9'} for i in range(start, start + app.POI_PAGE_SIZE)]
+        return FakeResponse({'status': '1', 'count': str(total), 'pois': pois})
+
+    monkeypatch.setattr(app.amap_manager, 'request', request)
+    monkeypatch.setattr(app, 'poi_search_cache', app.POISearchCache())
+    single_worker = app.ContextThreadPoolExecutor(max_workers=1, thread_name_prefix='amap')
+    monkeypatch.setattr(app.amap_manager, 'executor', single_worker)
+    try:
+        future = single_worker.submit(app.search_poi, 'key', '店', city='北京', max_results=total)
+        assert len(future.result(timeout=10)) == total
+    finally:
+        single_worker.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,95 @@
+
+import app
+from app import POISearchCache
+
+
+def _poi(name, lat, lng=116.4):
+    return {'name': name, 'latitude': lat, 'longitude': lng, 'distance': ''}
+
+
+POIS = [_poi('far', 39.9180), _poi('near', 39.9009), _poi('unlocated', None, None), _poi('mid', 39.9090)]
+
+
+def _set(cache, max_results=10, pois=POIS, complete=True, keywords='咖啡', types=''):
+    cache.set(keywords, '北京', types, max_results, pois, complete)
+
+
+def test_hit_keeps_upstream_order():
+    cache = POISearchCache(ttl_seconds=60, max_entries=10)
+    _set(cache)
+    assert [poi['name'] for poi in cache.get('咖啡', '北京', '', 10)] == ['far', 'near', 'unlocated', 'mid']
+    assert cache.get_stats()['hits'] == 1
+
+
+def test_result_is_a_copy():
+    cache = POISearchCache(ttl_seconds=60, max_entries=10)
+    _set(cache)
+    cache.get('咖啡', '北京', '', 10)[0]['name'] = 'changed'
+    assert cache.get('咖啡', '北京', '', 10)[0]['name'] == 'far'
+
+
+def test_smaller_request_counts_only_located_pois():
+    cache = POISearchCache(ttl_seconds=60, max_entries=10)
+    _set(cache)
+    assert [poi['name'] for poi in cache.get('咖啡', '北京', '', 2)] == ['far', 'near']
+    assert [poi['name'] for poi in cache.get('咖啡', '北京', '', 3)] == ['far', 'near', 'unlocated', 'mid']
+
+
+def test_truncated_entry_serves_only_smaller_requests():
+    cache = POISearchCache(ttl_seconds=60, max_entries=10)
+    _set(cache, max_results=2, pois=POIS[:2], complete=False)
+    assert len(cache.get('咖啡', '北京', '', 1)) == 1
+    assert cache.get('咖啡', '北京', '', 5) is None
+
+
+def test_key_normalizes_keywords_and_types():
+    cache = POISearchCache(ttl_seconds=60, max_entries=10)
+    _set(cache, keywords='Starbucks  Coffee', types='050000|060000')
+    assert cache.get(' ｓｔａｒｂｕｃｋｓ coffee ', '北京', '060000|050000', 10) is not None
+    assert cache.get('starbucks coffee', '上海', '060000|050000', 10) is None
+
+
+def test_ttl_expiry():
+    cache = POISearchCache(ttl_seconds=0, max_entries=10)
+    _set(cache)
+    assert cache.get('咖啡', '北京', '', 10) is None
+    assert cache.get_stats()['entries'] == 0
+
+
+def test_lru_eviction():
+    cache = POISearchCache(ttl_seconds=60, max_entries=2)
+    _set(cache, keywords='a')
+    _set(cache, keywords='b')
+    cache.get('a', '北京', '', 10)
+    _set(cache, keywords='c')
+    assert cache.get('b', '北京', '', 10) is None
+    assert cache.get('a', '北京', '', 10) is not None
+    assert cache.get('c', '北京', '', 10) is not None
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.content = app.json_codec.dumps(body)
+
+    def raise_for_status(self):
+        pass
+
+
+def test_cached_search_matches_fresh_search_from_another_location(monkeypatch):
+    """place/text 不按位置过滤，缓存命中与直接请求返回同样的结果"""
+    calls = []
+    pois = [{'id': str(i), 'name': f'咖啡{i}', 'location': f'116.{300 + 50 * i},39.9'} for i in range(4)]
+
+    def request(endpoint, url, params=None, **kwargs):
+        calls.append(params)
+        return FakeResponse({'status': '1', 'count': '4', 'pois': pois})
+
+    monkeypatch.setattr(app.amap_manager, 'request', request)
+    monkeypatch.setattr(app, 'poi_search_cache', POISearchCache())
+
+    fresh = app.search_poi('key', '咖啡', city='北京', location='116.300000,39.900000', radius=1000)
+    cached = app.search_poi('key', '咖啡', city='北京', location='116.450000,39.900000', radius=1000)
+
+    assert len(calls) == 1
+    assert cached == fresh
+    assert len(cached) == 4
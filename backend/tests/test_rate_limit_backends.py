@@ -0,0 +1,70 @@
+import multiprocessing
+import os
+
+import pytest
+
+import app
+from app import LocalTokenStore, NetworkRateLimitBackend, SQLiteRateLimitBackend, TokenBucket
+
+BUCKET = 'test-rate-limit:place'
+
+
+def _shared_budget(make_backend):
+    """两个限流器实例共享同一份配额：容量2、几乎不补充，第3次预留必须等待"""
+    first = TokenBucket(BUCKET, rate=0.01, capacity=2, backend=make_backend())
+    second = TokenBucket(BUCKET, rate=0.01, capacity=2, backend=make_backend())
+    return [first.reserve(), second.reserve(), first.reserve(), second.reserve()]
+
+
+def test_network_backends_sharing_a_store_enforce_one_budget():
+    store = LocalTokenStore()
+    waits = _shared_budget(lambda: NetworkRateLimitBackend(store))
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(100, rel=0.01)
+    assert waits[3] == pytest.approx(200, rel=0.01)
+
+
+def test_separate_stores_do_not_share_budget():
+    waits = _shared_budget(lambda: NetworkRateLimitBackend(LocalTokenStore()))
+    assert waits == [0.0, 0.0, 0.0, 0.0]
+
+
+def test_local_backend_is_selectable(monkeypatch):
+    monkeypatch.setenv('AMAP_RATE_LIMIT_BACKEND', 'local')
+    backend = app.create_rate_limit_backend()
+    assert backend.name == 'network'
+    assert isinstance(backend.store, LocalTokenStore)
+
+
+def _reserve_in_child(db_path, count, results):
+    backend = SQLiteRateLimitBackend(db_path)
+    results.put([backend.reserve('place', 0.001, 5) for _ in range(count)])
+
+
+def test_sqlite_backend_shares_budget_across_processes(tmp_path):
+    db_path = str(tmp_path / 'rate_limit.db')
+    SQLiteRateLimitBackend(db_path)
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    processes = [ctx.Process(target=_reserve_in_child, args=(db_path, 4, results)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    remaining = [value for _ in processes for value in results.get(timeout=30)]
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    # 3个进程各预留4个，共12个，容量5：恰好5次不需要透支，令牌数按原子扣减依次递减
+    assert sum(1 for value in remaining if value >= 0) == 5
+    assert sorted(round(value) for value in remaining) == list(range(-7, 5))
+    assert SQLiteRateLimitBackend(db_path).peek('place', 0.001, 5) == pytest.approx(-7, abs=0.1)
+
+
+@pytest.mark.skipif(not os.environ.get('AMAP_TEST_REDIS_URL'), reason='需要 AMAP_TEST_REDIS_URL 指向可用的Redis')
+def test_redis_store_enforces_one_budget():
+    url = os.environ['AMAP_TEST_REDIS_URL']
+    key_store = app.RedisTokenStore(url)
+    key_store.client.delete(BUCKET)
+    waits = _shared_budget(lambda: NetworkRateLimitBackend(app.RedisTokenStore(url)))
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] > 0
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+LEGS = [(39.90 + i * 0.01, 116.40, 39.95, 116.45 + i * 0.01) for i in range(4)]
+
+
+@pytest.fixture
+def executor():
+    pool = app.ContextThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+@pytest.fixture(autouse=True)
+def batching(monkeypatch):
+    monkeypatch.setattr(app, 'AMAP_BATCH_ENABLED', True)
+    monkeypatch.setattr(app, 'AMAP_BATCH_MAX_OPS', 2)
+
+
+def _fake_result(leg):
+    return {'distance': int(leg[0] * 1000), 'duration': 60, 'summary_only': True}
+
+
+def test_chunks_resolve_leg_futures_in_order(monkeypatch, executor):
+    monkeypatch.setattr(app, 'fetch_route_legs_batched', lambda api_key, legs, *args: [_fake_result(leg) for leg in legs])
+    futures = app.submit_route_legs(executor, 'k', LEGS, 'driving')
+    assert [f.result(timeout=5) for f in futures] == [_fake_result(leg) for leg in LEGS]
+
+
+def test_cancelled_leg_does_not_break_rest_of_chunk(monkeypatch, executor):
+    release = threading.Event()
+
+    def slow_batch(api_key, legs, *args):
+        release.wait(5)
+        return [_fake_result(leg) for leg in legs]
+
+    monkeypatch.setattr(app, 'fetch_route_legs_batched', slow_batch)
+    futures = app.submit_route_legs(executor, 'k', LEGS, 'driving')
+    assert futures[0].cancel()
+    release.set()
+    assert futures[0].cancelled()
+    assert futures[1].result(timeout=5) == _fake_result(LEGS[1])
+    assert futures[3].result(timeout=5) == _fake_result(LEGS[3])
+
+
+def test_fully_cancelled_chunk_is_not_fetched(monkeypatch):
+    pool = app.ContextThreadPoolExecutor(max_workers=1)
+    blocker = threading.Event()
+    pool.submit(blocker.wait, 5)  # 占住唯一的工作线程，批量任务只能排队
+    fetched = []
+    monkeypatch.setattr(app, 'fetch_route_legs_batched', lambda api_key, legs, *args: fetched.append(legs) or [None] * len(legs))
+    try:
+        futures = app.submit_route_legs(pool, 'k', LEGS, 'driving')
+        futures[0].cancel()
+        futures[1].cancel()
+        blocker.set()
+        assert futures[2].result(timeout=5) is None
+        assert fetched == [LEGS[2:]]
+    finally:
+        blocker.set()
+        pool.shutdown(wait=True)
+
+
+def test_deadline_cancels_pending_legs(monkeypatch, executor):
+    release = threading.Event()
+
+    def slow_batch(api_key, legs, *args):
+        release.wait(5)
+        return [_fake_result(leg) for leg in legs]
+
+    monkeypatch.setattr(app, 'fetch_route_legs_batched', slow_batch)
+    with app.request_deadline(0.05 / app.DEADLINE_FETCH_FRACTION):
+        futures = app.submit_route_legs(executor, 'k', LEGS, 'driving')
+        outcomes = [app.wait_for_leg(f, timeout=5) for f in futures]
+    release.set()
+    assert outcomes == [(None, True)] * len(LEGS)
+    assert all(f.cancelled() for f in futures)
+
+
+def test_whole_batch_failure_fans_legs_out_to_executor(monkeypatch, executor):
+    def failing_batch(*args, **kwargs):
+        raise app.AmapBatchError('batch down')
+
+    threads = set()
+
+    def single(api_key, *args):
+        threads.add(threading.current_thread().name)
+        time.sleep(0.05)
+        return _fake_result(args[:4])
+
+    monkeypatch.setattr(app, 'amap_batch_request', failing_batch)
+    monkeypatch.setattr(app, 'get_driving_route_segment_details', single)
+    futures = app.submit_route_legs(executor, 'k', LEGS, 'driving')
+    assert [f.result(timeout=5) for f in futures] == [_fake_result(leg) for leg in LEGS]
+    assert len(threads) > 1
+
+
+@pytest.mark.parametrize('error', [app.CircuitOpenError, app.DeadlineExceededError])
+def test_breaker_or_deadline_skips_single_leg_retries(monkeypatch, executor, error):
+    def failing_batch(*args, **kwargs):
+        raise error('skip')
+
+    calls = []
+    monkeypatch.setattr(app, 'amap_batch_request', failing_batch)
+    monkeypatch.setattr(app, 'get_driving_route_segment_details', lambda *args: calls.append(args))
+    futures = app.submit_route_legs(executor, 'k', LEGS, 'driving')
+    assert [f.result(timeout=5) for f in futures] == [None] * len(LEGS)
+    assert calls == []
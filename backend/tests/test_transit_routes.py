@@ -0,0 +1,90 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+ORIGIN = (39.90, 116.40)
+DEST = (39.95, 116.45)
+
+
+def _path(strategy):
+    return {
+        'duration': str(600 + strategy), 'distance': '1000', 'cost': '2', 'walking_distance': '100',
+        'segments': [{'walking': {'distance': str(strategy), 'duration': '60', 'steps': []}}],
+    }
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = app.DistanceCache(persistent_cache=False)
+    monkeypatch.setattr(app, 'distance_cache', cache)
+    return cache
+
+
+def _cached_routes(cache):
+    mode = app._transit_routes_cache_mode(*ORIGIN, *DEST, app.TRANSIT_ROUTE_STRATEGIES)
+    return cache.get(*ORIGIN, *DEST, mode, '北京')
+
+
+def test_first_k_returns_early_and_caches_full_set(monkeypatch, cache):
+    release = threading.Event()
+    calls = []
+
+    def fetch(api_key, o_lat, o_lng, d_lat, d_lng, city, strategy):
+        calls.append(strategy)
+        if strategy != app.TRANSIT_ROUTE_STRATEGIES[0]:
+            release.wait(5)
+        return [_path(strategy)]
+
+    monkeypatch.setattr(app, '_fetch_transit_strategy', fetch)
+    routes = app.get_public_transit_routes('k', *ORIGIN, *DEST, '北京', first_k=1)
+    assert len(routes) == 1
+    assert _cached_routes(cache) is None
+
+    release.set()
+    for _ in range(50):
+        if _cached_routes(cache):
+            break
+        time.sleep(0.05)
+    cached = _cached_routes(cache)
+    assert cached is not None and len(cached) == len(app.TRANSIT_ROUTE_STRATEGIES)
+    assert sorted(calls) == sorted(app.TRANSIT_ROUTE_STRATEGIES)
+
+    # 后续查询直接命中缓存，不再请求高德
+    calls.clear()
+    assert len(app.get_public_transit_routes('k', *ORIGIN, *DEST, '北京')) == 5
+    assert calls == []
+
+
+def test_background_failure_does_not_cache_partial_set(monkeypatch, cache):
+    release = threading.Event()
+    done = threading.Event()
+
+    def fetch(api_key, o_lat, o_lng, d_lat, d_lng, city, strategy):
+        if strategy == app.TRANSIT_ROUTE_STRATEGIES[0]:
+            return [_path(strategy)]
+        release.wait(5)
+        if strategy == app.TRANSIT_ROUTE_STRATEGIES[-1]:
+            done.set()
+            return None  # 请求失败
+        return [_path(strategy)]
+
+    monkeypatch.setattr(app, '_fetch_transit_strategy', fetch)
+    assert len(app.get_public_transit_routes('k', *ORIGIN, *DEST, '北京', first_k=1)) == 1
+    release.set()
+    done.wait(5)
+    time.sleep(0.2)
+    assert _cached_routes(cache) is None
+
+
+@pytest.mark.parametrize('first_k', [True, False, 0, -1, 1.5, '2'])
+def test_directions_rejects_invalid_first_k(first_k):
+    response = app.app.test_client().post('/api/route/directions', json={
+        'origin': {'latitude': ORIGIN[0], 'longitude': ORIGIN[1]},
+        'destination': {'latitude': DEST[0], 'longitude': DEST[1]},
+        'mode': 'public_transit', 'city': '北京', 'first_k': first_k,
+    })
+    assert response.status_code == 400
+    assert 'first_k' in response.get_json()['message']